@@ -0,0 +1,81 @@
+"""Benchmark of dialect construction for very wide mappings
+
+Constructs each registered dialect over mappings of growing width and fits the
+log-log slope of construction time against the number of select columns. The
+mapping built by the loaders is passed through without being validated again,
+so the slope should stay close to 0. `--untrusted` times the construction from
+a plain tuple of the mapping fields, which is validated element by element.
+
+    python benchmarks/bench_construct.py [--sizes 1000 10000 100000] [--max-slope 0.2]
+"""
+import math
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_render import scaling_slope  # noqa: E402
+
+from app.services.config_parser import (Filter, JoinStep, MetadataMapping,  # noqa: E402
+                                       SelectColumn, TargetColumn, TargetTable)
+from app.services.query_builder import get_dialect  # noqa: E402
+
+
+def build_mapping(num_columns: int) -> MetadataMapping:
+    """method to build a mapping model with a select list of the given width"""
+    return MetadataMapping(
+        'schema.table1', 't1',
+        (JoinStep('t2', 'left join', 'schema.table2', None, 't1.id = t2.id'),),
+        (Filter('t1.col_1 > 30', 0),),
+        tuple(SelectColumn(f'col_alias_{i}', f'sum(t1.column_{i} * t2.column_{i})', 'sum',
+                           f't1.column_{i} * t2.column_{i}', 'schema.table1', 't1')
+              for i in range(num_columns)),
+        TargetTable('target', 'schema', tuple(TargetColumn(f'col_alias_{i}', 'int', None)
+                                              for i in range(num_columns))))
+
+
+def time_construct(dialect: type, mapping: object, repeat: int) -> float:
+    """method to time the best of `repeat` constructions of a dialect"""
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dialect(mapping)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Dialect construction benchmark")
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--targets", nargs='+', default=['redshift', 'postgres'])
+    parser.add_argument("--max-slope", type=float, default=0.2)
+    parser.add_argument("--untrusted", action="store_true",
+                        help="also time the construction from a plain tuple, validated element by element")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    mappings = {size: build_mapping(size) for size in args.sizes}
+    failed = False
+    for target in args.targets:
+        dialect = get_dialect(target)
+        timings = []
+        for size, mapping in mappings.items():
+            seconds = time_construct(dialect, mapping, args.repeat)
+            timings.append((size, seconds))
+            line = f'{target:>10} {size:>8} columns  {seconds * 1e6:10.1f} us'
+            if args.untrusted:
+                line += f'  untrusted {time_construct(dialect, tuple(mapping), 1) * 1000:10.2f} ms'
+            print(line)
+        slope = scaling_slope(timings)
+        print(f'{target:>10} log-log slope {slope:.2f} (max {args.max_slope})')
+        failed = failed or slope > args.max_slope
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
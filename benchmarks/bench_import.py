@@ -0,0 +1,102 @@
+"""Import time budget of the CLI and the builder modules
+
+Runs each scenario in a fresh interpreter with `-X importtime`, subtracts the
+bare interpreter startup and compares the best of `--repeat` runs to its
+budget. Modules only needed by other code paths (pandas, openpyxl, pypika,
+sqlalchemy)
+must not be imported at all.
+
+    python benchmarks/bench_import.py [--repeat 5] [--scale 1.0]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+HEAVY_MODULES = ('pandas', 'openpyxl', 'pypika', 'sqlalchemy')
+
+
+class Scenario(NamedTuple):
+    name: str
+    args: List[str]
+    budget_ms: float
+    forbidden: Tuple[str, ...]
+
+
+SCENARIOS = [
+    Scenario('cli_help', [os.path.join(SRC_DIR, 'auto_etl.py'), '--help'],
+             80, HEAVY_MODULES + ('pydantic', 'app.services')),
+    Scenario('register_dialect', ['-c', 'from app.services.query_builder import register_dialect'],
+             60, HEAVY_MODULES + ('pydantic',)),
+    Scenario('query_builder', ['-c', 'from app.services.query_builder import QueryBuilder'],
+             250, HEAVY_MODULES),
+    Scenario('batch_builder', ['-c', 'from app.services.batch_builder import BatchBuilder'],
+             250, HEAVY_MODULES),
+]
+
+
+def import_times(args: List[str], cwd: str) -> Tuple[float, Set[str]]:
+    """method to run a fresh interpreter and read its `-X importtime` report
+
+    Returns:
+        Tuple[float, Set[str]]: cumulative ms of the top level imports and the imported modules
+    """
+    env = {**os.environ, 'PYTHONPATH': SRC_DIR}
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            text=True, check=True).stderr
+    total_us, modules = 0, set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # nested imports are indented below their parent and already counted in it
+        if not name[1:].startswith(' '):
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+def best_of(args: List[str], cwd: str, repeat: int) -> Tuple[float, Set[str]]:
+    """method to keep the fastest of `repeat` runs, the others are noise from the machine"""
+    runs = [import_times(args, cwd) for _ in range(repeat)]
+    return min(ms for ms, _ in runs), runs[0][1]
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Import time budget check")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiplier applied to every budget, for slower machines")
+    args = parser.parse_args()
+
+    failed = False
+    # the CLI sets up its file logging in ./logs
+    with tempfile.TemporaryDirectory() as cwd:
+        os.makedirs(os.path.join(cwd, 'logs'))
+        startup_ms, startup_modules = best_of(['-c', 'pass'], cwd, args.repeat)
+        results: Dict[str, Tuple[float, List[str]]] = {}
+        for scenario in SCENARIOS:
+            ms, modules = best_of(scenario.args, cwd, args.repeat)
+            leaked = sorted(module for module in modules - startup_modules
+                            if module.startswith(scenario.forbidden))
+            results[scenario.name] = (ms - startup_ms, leaked)
+
+    print(f'{"scenario":<18}{"import ms":>10}{"budget":>9}')
+    for scenario in SCENARIOS:
+        ms, leaked = results[scenario.name]
+        budget = scenario.budget_ms * args.scale
+        status = 'ok'
+        if ms > budget:
+            status, failed = 'over budget', True
+        if leaked:
+            status, failed = f'imports {", ".join(leaked[:3])}', True
+        print(f'{scenario.name:<18}{ms:>10.1f}{budget:>9.0f}  {status}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
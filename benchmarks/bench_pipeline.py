@@ -0,0 +1,168 @@
+"""Benchmark of the query builder pipeline, stage by stage
+
+Generates synthetic metadata workbooks for a set of size profiles and reports the
+wall time and the tracemalloc peak of every stage of the pipeline. Results can be
+saved as a baseline and later runs compared against it to catch regressions.
+
+    python benchmarks/bench_pipeline.py                      # report
+    python benchmarks/bench_pipeline.py --save-baseline      # write baselines.json
+    python benchmarks/bench_pipeline.py --compare            # fail on regressions
+"""
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+# pylint: disable=wrong-import-position
+from generate_workbook import generate_sheets, write_mapping  # noqa: E402
+
+from app.services.config_parser import (MetadataMapping,  # noqa: E402
+                                        MetadataParser)
+from app.services.query_builder import RedshiftDialect  # noqa: E402
+from app.utils import excel_to_json, validate_joins_mapping  # noqa: E402
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baselines.json')
+
+try:
+    import pyarrow  # noqa: F401
+    SOURCE_FORMATS: Tuple[str, ...] = ('json', 'csv', 'parquet')
+except ImportError:
+    SOURCE_FORMATS = ('json', 'csv')
+
+PROFILES: Dict[str, Dict[str, int]] = {
+    'small': dict(select_columns=50, joins=5, subqueries=1, filters=2),
+    'wide': dict(select_columns=5000, joins=20, subqueries=5, filters=10),
+    'many_joins': dict(select_columns=500, joins=300, subqueries=50, filters=100),
+}
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[Any, Dict[str, float]]:
+    """method to time a stage (best of `repeat`) and trace its peak memory in a separate run
+
+    Args:
+        func (Callable): stage to measure
+        repeat (int): number of timed runs
+
+    Returns:
+        Tuple: result of the stage and its measurements
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': round(best, 6), 'peak_kb': round(peak / 1024, 1)}
+
+
+def bench_profile(workbook_path: str, repeat: int,
+                  sources: Dict[str, str] = None) -> Dict[str, Dict[str, float]]:
+    """method to measure every stage of the pipeline for one workbook
+
+    Args:
+        workbook_path (str): path of the workbook
+        repeat (int): number of timed runs per stage
+        sources (Dict[str, str]): the same mapping in other formats, keyed by format
+
+    Returns:
+        Dict: measurements keyed by stage name
+    """
+    parser = MetadataParser(workbook_path)
+    stages = {}
+
+    meta_xls, stages['validate_file'] = measure(parser.validate_file, repeat)
+    _, stages['excel_to_json'] = measure(lambda: [excel_to_json(meta_xls, sheet, 'records') for sheet in
+                                                  ('target_table', 'joins_and_filters', 'select_sources')],
+                                         repeat)
+    mapping, stages['load_mapping'] = measure(parser.load_mapping, repeat)
+    for fmt, path in (sources or {}).items():
+        _, stages[f'load_mapping_{fmt}'] = measure(
+            MetadataParser(path).load_mapping, repeat)
+    _, stages['validate_joins_mapping'] = measure(
+        lambda: validate_joins_mapping(mapping), repeat)
+    _, stages['get_sql'] = measure(
+        lambda: RedshiftDialect(mapping).get_sql(), repeat)
+    assert isinstance(mapping, MetadataMapping)
+    return stages
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """method to list the stages slower or hungrier than the baseline by more than `tolerance`
+
+    Args:
+        results (Dict): measurements of this run
+        baseline (Dict): saved measurements
+        tolerance (float): allowed ratio against the baseline
+
+    Returns:
+        List[str]: one message per regression
+    """
+    regressions = []
+    for profile, stages in results.items():
+        for stage, measured in stages.items():
+            saved = baseline.get(profile, {}).get(stage)
+            if saved is None:
+                continue
+            for metric in ('seconds', 'peak_kb'):
+                if saved[metric] and measured[metric] > saved[metric] * tolerance:
+                    regressions.append(f'{profile}.{stage}.{metric}: {measured[metric]} '
+                                       f'> {saved[metric]} x {tolerance}')
+    return regressions
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Query builder pipeline benchmark")
+    parser.add_argument("--profiles", nargs='+', default=list(PROFILES),
+                        choices=list(PROFILES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    parser.add_argument("--baseline-file", default=BASELINE_FILE)
+    args = parser.parse_args()
+
+    # the pipeline logs every stage, keep the report readable
+    import logging
+    logging.disable(logging.INFO)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for profile in args.profiles:
+            sheets = generate_sheets(**PROFILES[profile])
+            path = write_mapping(sheets, os.path.join(tmp_dir, f'{profile}.xlsx'), 'xlsx')
+            sources = {fmt: write_mapping(
+                sheets, os.path.join(tmp_dir, f'{profile}_{fmt}' + ('.json' if fmt == 'json' else '')), fmt)
+                       for fmt in SOURCE_FORMATS}
+            results[profile] = bench_profile(path, args.repeat, sources)
+            for stage, measured in results[profile].items():
+                print(f'{profile:<12} {stage:<24} {measured["seconds"] * 1000:10.2f} ms '
+                      f'{measured["peak_kb"]:12.1f} KiB')
+
+    if args.save_baseline:
+        with open(args.baseline_file, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        print(f'baseline saved to {args.baseline_file}')
+
+    if args.compare:
+        with open(args.baseline_file) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
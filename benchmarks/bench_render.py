@@ -0,0 +1,72 @@
+"""Benchmark of BaseQuery rendering for very wide SELECT lists
+
+Renders SELECT lists of growing width and fits the log-log slope of render time
+against the number of columns, a slope close to 1 means rendering scales linearly.
+
+    python benchmarks/bench_render.py [--sizes 1000 10000 100000] [--max-slope 1.2]
+"""
+import math
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.services.query_builder.dialect import BaseQuery  # noqa: E402
+
+
+def build_query(num_columns: int) -> BaseQuery:
+    """method to build a query with a select list of the given width"""
+    query = BaseQuery()
+    query.SELECT(*[(f'col_alias_{i}', f'sum(t1.column_{i} * t2.column_{i})')
+                   for i in range(num_columns)])
+    query.FROM(('t1', 'schema.table1'))
+    query.LEFT_JOIN(('t2', 'schema.table2', 't1.id = t2.id'))
+    query.WHERE('t1.col_1 > 30', 't2.col_2 = 2')
+    return query
+
+
+def time_render(num_columns: int, repeat: int = 3) -> float:
+    """method to time the best of `repeat` renders of a query of the given width"""
+    query = build_query(num_columns)
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        str(query)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def scaling_slope(timings: List[Tuple[int, float]]) -> float:
+    """least squares slope of log(time) against log(columns)"""
+    xs = [math.log(size) for size, _ in timings]
+    ys = [math.log(seconds) for _, seconds in timings]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / \
+        sum((x - mean_x) ** 2 for x in xs)
+
+
+def main() -> int:
+    parser = ArgumentParser(description="BaseQuery render benchmark")
+    parser.add_argument("--sizes", type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--max-slope", type=float, default=1.2)
+    args = parser.parse_args()
+
+    timings = []
+    for size in args.sizes:
+        seconds = time_render(size)
+        timings.append((size, seconds))
+        print(f'{size:>8} columns  {seconds * 1000:10.2f} ms  '
+              f'{seconds / size * 1e6:8.3f} us/column')
+
+    slope = scaling_slope(timings)
+    print(f'log-log slope {slope:.2f} (max {args.max_slope})')
+    return 0 if slope <= args.max_slope else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
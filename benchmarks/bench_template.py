@@ -0,0 +1,59 @@
+"""Benchmark of query template instantiation
+
+Builds the generated workbook once, compiles it into a template with the
+schema as placeholder, then times filling the template once per partition
+schema.
+
+    python benchmarks/bench_template.py [--columns 200] [--instances 10000] [--min-rate 1000]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_workbook import generate_workbook  # noqa: E402
+
+from app.services.query_builder import QueryBuilder  # noqa: E402
+from app.services.query_template import compile_template  # noqa: E402
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Query template instantiation benchmark")
+    parser.add_argument("--columns", type=int, default=200)
+    parser.add_argument("--joins", type=int, default=20)
+    parser.add_argument("--instances", type=int, default=10000)
+    parser.add_argument("--min-rate", type=float, default=1000,
+                        help="fail below this many instances per second")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workbook = os.path.join(tmp_dir, 'bench.xlsx')
+        generate_workbook(workbook, args.columns, args.joins)
+        config = os.path.join(tmp_dir, 'config.json')
+        with open(config, 'w') as fp:
+            json.dump({'target': 'redshift', 'template': {'parameters': {'schema': 'schema'}}}, fp)
+
+        start = time.perf_counter()
+        template = compile_template(QueryBuilder(workbook, config, None))
+        compile_seconds = time.perf_counter() - start
+
+    rows = [{'schema': f'schema_p{i}'} for i in range(args.instances)]
+    start = time.perf_counter()
+    characters = sum(len(sql) for sql in template.render_many(rows))
+    render_seconds = time.perf_counter() - start
+
+    rate = args.instances / render_seconds
+    print(f'compile  {compile_seconds * 1000:10.1f} ms  placeholders {list(template.placeholders)}')
+    print(f'instantiate {args.instances} x {characters // args.instances} chars  '
+          f'{render_seconds * 1000:10.1f} ms  {rate:12.0f} instances/s (min {args.min_rate:.0f})')
+    return 0 if rate >= args.min_rate else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Synthetic metadata workbook generator
+
+Writes a metadata workbook with the target_table, joins_and_filters and
+select_sources sheets expected by the query builder, sized by the number of
+select columns, joins, subquery joins and filters. The same mapping can be
+written as a json file or a directory of csv/parquet sheet files.
+
+    python benchmarks/generate_workbook.py out.xlsx --select-columns 5000 --joins 50
+    python benchmarks/generate_workbook.py out_dir --format csv --select-columns 5000
+"""
+import csv
+import json
+import os
+import random
+from argparse import ArgumentParser
+from typing import Dict, List, Sequence, Tuple
+
+import openpyxl
+
+FORMATS = ('xlsx', 'json', 'csv', 'parquet')
+
+TARGET_TABLE_HEADER = ('Target_Table_Name', 'Columns', 'Description',
+                       'DataType', 'Constraint', 'Schema')
+JOINS_AND_FILTERS_HEADER = ('driving_table', 'driving_table_alias', 'reference_table', 'reference_subquery',
+                            'reference_table_alias', 'join_type', 'join_condition', 'filter_condition')
+SELECT_SOURCES_HEADER = ('source_table', 'table_alias', 'transformation',
+                         'arguments', 'column_alias', 'comments')
+
+JOIN_TYPES = ('inner join', 'left join')
+TRANSFORMATIONS = ('sum', 'max', 'min', 'count', 'avg', 'any_value')
+
+
+Sheet = Tuple[Sequence[str], List[tuple]]
+
+
+def generate_sheets(select_columns: int = 100, joins: int = 5, subqueries: int = 1,
+                    filters: int = 2, seed: int = 0) -> Dict[str, Sheet]:
+    """method to generate the header and rows of each sheet of a synthetic mapping
+
+    Args:
+        select_columns (int): number of rows of the select_sources sheet
+        joins (int): number of rows of the joins_and_filters sheet
+        subqueries (int): number of joins reading from a reference subquery
+        filters (int): number of joins carrying a filter condition
+
+    Returns:
+        Dict[str, Sheet]: header and rows keyed by sheet name
+    """
+    rand = random.Random(seed)
+    joins = max(joins, 1)
+    aliases = ['t0'] + [f't{i}' for i in range(1, joins + 1)]
+
+    target_table = [('target_table', f'column_{i}', 'description', 'bigint',
+                     'primary key' if i == 0 else None, 'schema')
+                    for i in range(select_columns)]
+
+    joins_and_filters = []
+    for i in range(1, joins + 1):
+        alias, parent = aliases[i], aliases[rand.randrange(i)]
+        is_subquery = i <= subqueries
+        joins_and_filters.append((
+            'schema.table_0' if i == 1 else None,
+            't0' if i == 1 else None,
+            None if is_subquery else f'schema.table_{i}',
+            f'select * from schema.table_{i} where col_1 > {i}' if is_subquery else None,
+            alias,
+            rand.choice(JOIN_TYPES),
+            f'{parent}.id = {alias}.{parent}_id',
+            f'{alias}.col_2 > {i}' if i <= filters else None,
+        ))
+
+    select_sources = []
+    for i in range(select_columns):
+        alias = rand.choice(aliases)
+        select_sources.append(('schema.table', alias, rand.choice(TRANSFORMATIONS),
+                               f'{alias}.column_{i}', f'column_{i}', None))
+
+    return {
+        'target_table': (TARGET_TABLE_HEADER, target_table),
+        'joins_and_filters': (JOINS_AND_FILTERS_HEADER, joins_and_filters),
+        'select_sources': (SELECT_SOURCES_HEADER, select_sources),
+    }
+
+
+def generate_workbook(path: str, select_columns: int = 100, joins: int = 5, subqueries: int = 1,
+                      filters: int = 2, seed: int = 0) -> str:
+    """method to write a synthetic metadata workbook
+
+    Args:
+        path (str): path of the workbook to write
+        select_columns (int): number of rows of the select_sources sheet
+        joins (int): number of rows of the joins_and_filters sheet
+        subqueries (int): number of joins reading from a reference subquery
+        filters (int): number of joins carrying a filter condition
+
+    Returns:
+        str: path of the written workbook
+    """
+    return write_mapping(generate_sheets(select_columns, joins, subqueries, filters, seed), path, 'xlsx')
+
+
+def write_mapping(sheets: Dict[str, Sheet], path: str, fmt: str) -> str:
+    """method to write the sheets of a mapping in one of the supported mapping formats
+
+    Args:
+        sheets (Dict[str, Sheet]): header and rows keyed by sheet name
+        path (str): workbook or json file, or directory of the csv/parquet sheet files
+        fmt (str): one of `FORMATS`
+
+    Returns:
+        str: path of the written mapping
+    """
+    if fmt == 'xlsx':
+        # a regular workbook is written like excel does, with shared strings and sheet dimensions
+        workbook = openpyxl.Workbook()
+        workbook.remove(workbook.active)
+        for name, (header, rows) in sheets.items():
+            sheet = workbook.create_sheet(name)
+            sheet.append(header)
+            for row in rows:
+                sheet.append(row)
+        workbook.save(path)
+    elif fmt == 'json':
+        with open(path, 'w') as fp:
+            json.dump({name: [dict(zip(header, row)) for row in rows]
+                       for name, (header, rows) in sheets.items()}, fp)
+    elif fmt == 'csv':
+        os.makedirs(path, exist_ok=True)
+        for name, (header, rows) in sheets.items():
+            with open(os.path.join(path, name + '.csv'), 'w', newline='') as fp:
+                writer = csv.writer(fp)
+                writer.writerow(header)
+                writer.writerows(rows)
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(path, exist_ok=True)
+        for name, (header, rows) in sheets.items():
+            columns = {column: [row[i] for row in rows] for i, column in enumerate(header)}
+            pq.write_table(pa.table({column: pa.array(values, pa.string())
+                                     for column, values in columns.items()}),
+                           os.path.join(path, name + '.parquet'))
+    else:
+        raise ValueError(f'unknown mapping format {fmt!r}')
+    return path
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Synthetic metadata workbook generator")
+    parser.add_argument("path")
+    parser.add_argument("--select-columns", type=int, default=100)
+    parser.add_argument("--joins", type=int, default=5)
+    parser.add_argument("--subqueries", type=int, default=1)
+    parser.add_argument("--filters", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", default='xlsx', choices=FORMATS)
+    args = parser.parse_args()
+    write_mapping(generate_sheets(args.select_columns, args.joins, args.subqueries, args.filters, args.seed),
+                  args.path, args.format)
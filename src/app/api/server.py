@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+from app.etl_exceptions import AutoETLException
+from app.services.batch_builder.batch_builder import BUILDERS
+from app.services.query_builder import QueryBuilder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BUILDERS = 64
+
+
+class CompileService:
+    """Compiles metadata files on request with builders kept warm between requests
+
+    One builder is kept per (tool, metadata file), so the config and the
+    parsed mapping are only read again once their file changed. At most
+    `max_builders` are kept, the least recently used is dropped first, and
+    only metadata files under `root_dir` are compiled.
+    """
+
+    def __init__(self, config_file_path: str, cache_dir: Optional[str] = None,
+                 tool: str = QueryBuilder.tool, root_dir: Optional[str] = None,
+                 max_builders: int = DEFAULT_MAX_BUILDERS) -> None:
+        self.config_file_path = config_file_path
+        self.cache_dir = cache_dir
+        self.tool = tool
+        self.root_dir = os.path.realpath(root_dir or os.getcwd())
+        self.max_builders = max_builders
+        self.builders: 'OrderedDict[Tuple[str, str], QueryBuilder]' = OrderedDict()
+        # builders keep per build state, requests are compiled one at a time
+        self.lock = threading.Lock()
+
+    def compile(self, metadata_file_path: str, tool: Optional[str] = None) -> str:
+        """method to build the sql of a metadata file
+
+        Args:
+            metadata_file_path (str): path of the metadata file, relative to `root_dir`
+            tool (Optional[str]): build tool, one of `BUILDERS`, the service tool when None
+
+        Raises:
+            AutoETLException: Exception if the tool is unknown, the file is outside `root_dir`
+                or the build fails
+
+        Returns:
+            str: generated sql
+        """
+        tool = tool or self.tool
+        if tool not in BUILDERS:
+            logger.error("Tool - %s not supported.", tool)
+            raise AutoETLException(f"Tool - {tool} not supported.")
+        path = os.path.realpath(os.path.join(self.root_dir, metadata_file_path))
+        if os.path.commonpath([self.root_dir, path]) != self.root_dir:
+            logger.error("Metadata file - %s is outside %s", metadata_file_path, self.root_dir)
+            raise AutoETLException(f"Metadata file - {metadata_file_path} is outside the served directory.")
+        with self.lock:
+            builder = self.builders.get((tool, path))
+            if builder is None:
+                builder = self.builders[(tool, path)] = BUILDERS[tool](
+                    path, self.config_file_path, self.cache_dir)
+                if len(self.builders) > self.max_builders:
+                    self.builders.popitem(last=False)
+            else:
+                self.builders.move_to_end((tool, path))
+            return builder.build()
+
+
+class CompileRequestHandler(BaseHTTPRequestHandler):
+    """`POST /compile` with a `{"metadata_file": ..., "tool": ...}` body returns the sql,
+    `GET /health` answers once the server is up
+    """
+    service: CompileService
+
+    def do_GET(self) -> None:
+        if self.path != '/health':
+            self._reply(HTTPStatus.NOT_FOUND, {'error': f'unknown path {self.path}'})
+            return
+        self._reply(HTTPStatus.OK, {'status': 'ok'})
+
+    def do_POST(self) -> None:
+        if self.path != '/compile':
+            self._reply(HTTPStatus.NOT_FOUND, {'error': f'unknown path {self.path}'})
+            return
+        try:
+            body = json.loads(self.rfile.read(
+                int(self.headers.get('Content-Length', 0))) or b'{}')
+            metadata_file_path = body['metadata_file']
+        except (ValueError, KeyError, TypeError):
+            self._reply(HTTPStatus.BAD_REQUEST,
+                        {'error': 'expected a json body with a metadata_file path'})
+            return
+
+        try:
+            sql = self.service.compile(
+                metadata_file_path, body.get('tool'))
+        except AutoETLException as excep:
+            self._reply(HTTPStatus.UNPROCESSABLE_ENTITY,
+                        {'error': str(excep.args[0]), 'details': list(excep.args[1:])})
+            return
+        except Exception as excep:
+            logger.error("Failed to build query for %s - %s",
+                         metadata_file_path, excep.args)
+            self._reply(HTTPStatus.INTERNAL_SERVER_ERROR,
+                        {'error': ' '.join(str(arg) for arg in excep.args) or type(excep).__name__})
+            return
+        self._reply(HTTPStatus.OK, sql, 'application/sql')
+
+    def log_message(self, format: str, *args) -> None:
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def _reply(self, status: HTTPStatus, body, content_type: str = 'application/json') -> None:
+        data = (body if isinstance(body, str) else json.dumps(body, default=str)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_server(service: CompileService, host: str = DEFAULT_HOST,
+                port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """method to create the http server of a compile service
+
+    Args:
+        service (CompileService)
+        host (str): interface to listen on, local only by default
+        port (int): port to listen on, 0 picks a free one
+
+    Returns:
+        ThreadingHTTPServer: server, started with `serve_forever()`
+    """
+    handler = type('BoundCompileRequestHandler',
+                   (CompileRequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
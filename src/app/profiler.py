@@ -0,0 +1,75 @@
+import cProfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class StageProfiler:
+    """Records the duration, the tracemalloc peak and the processed counts of each build stage
+
+    The peak is relative to the memory already traced when the stage starts.
+    When disabled every stage is a plain no-op context, so the builder can be
+    instrumented unconditionally.
+    """
+
+    def __init__(self, enabled: bool = False, stats_path: Optional[str] = None) -> None:
+        self.enabled = enabled
+        self.stats_path = stats_path
+        self.stages: List[Dict[str, Any]] = []
+        self._started = time.perf_counter()
+        self._owns_tracemalloc = False
+        self._hottest: Optional[cProfile.Profile] = None
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """context measuring one stage, the yielded dict takes the rows/columns processed
+
+        Args:
+            name (str): name of the stage
+        """
+        counters: Dict[str, Any] = {}
+        if not self.enabled:
+            yield counters
+            return
+
+        profile = cProfile.Profile() if self.stats_path else None
+        tracemalloc.reset_peak()
+        traced_before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield counters
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            if profile is not None and seconds >= max((s['seconds'] for s in self.stages), default=0):
+                self._hottest = profile
+            self.stages.append({'stage': name, 'seconds': round(seconds, 6),
+                                'peak_kb': round((peak - traced_before) / 1024, 1), **counters})
+
+    def finish(self, **extra: Any) -> Optional[Dict[str, Any]]:
+        """method to stop profiling and build the report
+
+        Returns:
+            Optional[Dict]: structured report, None when profiling is disabled
+        """
+        if not self.enabled:
+            return None
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        hottest = max(self.stages, key=lambda s: s['seconds'], default=None)
+        if self._hottest is not None and self.stats_path:
+            self._hottest.dump_stats(self.stats_path)
+        return {**extra,
+                'total_seconds': round(time.perf_counter() - self._started, 6),
+                'hottest_stage': hottest['stage'] if hottest else None,
+                'stats_file': self.stats_path if self._hottest is not None else None,
+                'stages': self.stages}
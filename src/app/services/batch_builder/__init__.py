@@ -0,0 +1 @@
+from .batch_builder import BatchBuilder, is_batch_path, resolve_metadata_files
@@ -0,0 +1,339 @@
+import glob
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pydantic.dataclasses import dataclass
+
+from app.etl_exceptions import AutoETLException
+from app.services.config_parser import ConfigParser
+from app.services.config_parser.parser import sheet_names
+from app.services.config_parser.sources import mapping_extension
+from app.services.lineage import LineageIndex, column_lineage, target_table_name
+from app.services.pipeline_builder import PipelineBuilder
+from app.services.query_builder import QueryBuilder
+from app.services.query_builder.sharing import (MATERIALIZE_MODES, shared_candidates, shared_table_name,
+                                                shared_table_statements)
+
+logger = logging.getLogger(__name__)
+
+# json mappings sit next to other json files, e.g. the config, so directories only
+# pick up the ones named as mappings
+METADATA_EXTENSIONS = ('.xlsx', '.mapping.json')
+MANIFEST_EXTENSIONS = ('.txt', '.lst')
+SUMMARY_FILE_NAME = 'batch_summary.json'
+SHARED_FILE_NAME = '_shared_subqueries.sql'
+# a subquery read by fewer metadata files is not worth materialising
+DEFAULT_MIN_USAGE = 2
+BUILDERS = {builder.tool: builder for builder in (QueryBuilder, PipelineBuilder)}
+
+
+def is_batch_path(metadata_path: str) -> bool:
+    """method to check if the metadata path points to more than one workbook
+
+    Args:
+        metadata_path (str): directory, glob pattern, manifest or workbook path
+
+    Returns:
+        bool
+    """
+    if os.path.isdir(metadata_path):
+        # a directory of csv/parquet sheet files is a single mapping
+        return mapping_extension(metadata_path, sheet_names) is None
+    return glob.has_magic(metadata_path) or metadata_path.endswith(MANIFEST_EXTENSIONS)
+
+
+def resolve_metadata_files(metadata_path: str) -> List[str]:
+    """method to expand a directory, glob pattern or manifest file into mapping paths
+
+    Directories are searched for workbooks, `*.mapping.json` files and
+    directories of csv/parquet sheet files.
+
+    Args:
+        metadata_path (str): directory, glob pattern, manifest or workbook path
+
+    Raises:
+        AutoETLException: Exception if no metadata file could be resolved
+
+    Returns:
+        List[str]: sorted list of metadata file paths
+    """
+    if os.path.isdir(metadata_path) and is_batch_path(metadata_path):
+        files = [path for path in glob.glob(os.path.join(metadata_path, '**', '*'), recursive=True)
+                 if path.endswith(METADATA_EXTENSIONS)
+                 or (os.path.isdir(path) and mapping_extension(path, sheet_names) is not None)]
+    elif glob.has_magic(metadata_path):
+        files = glob.glob(metadata_path, recursive=True)
+    elif metadata_path.endswith(MANIFEST_EXTENSIONS):
+        if not os.path.exists(metadata_path):
+            logger.error("Manifest file not found - %s", metadata_path)
+            raise AutoETLException(
+                f"Manifest file not found - {metadata_path}")
+        base_dir = os.path.dirname(os.path.abspath(metadata_path))
+        with open(metadata_path) as fp:
+            files = [os.path.join(base_dir, line.strip()) for line in fp
+                     if line.strip() and not line.lstrip().startswith('#')]
+    else:
+        files = [metadata_path]
+
+    # excel keeps lock files next to the open workbooks
+    files = sorted(path for path in files
+                   if not os.path.basename(path).startswith('~$'))
+    if not files:
+        logger.error("No metadata files found for - %s", metadata_path)
+        raise AutoETLException(
+            f"No metadata files found for - {metadata_path}")
+    return files
+
+
+def metadata_root(metadata_path: str) -> str:
+    """method to find the directory the metadata files of a path are resolved under
+
+    Args:
+        metadata_path (str): directory, glob pattern, manifest or workbook path
+
+    Returns:
+        str: the directory, the directory before the first wildcard of a glob pattern,
+            or the directory of a manifest or workbook
+    """
+    if os.path.isdir(metadata_path) and is_batch_path(metadata_path):
+        return os.path.abspath(metadata_path)
+    if glob.has_magic(metadata_path):
+        parts = []
+        for part in metadata_path.split(os.sep):
+            if glob.has_magic(part):
+                break
+            parts.append(part)
+        return os.path.abspath(os.sep.join(parts) or os.curdir)
+    return os.path.dirname(os.path.abspath(metadata_path))
+
+
+def output_file_names(metadata_files: List[str], base_dir: Optional[str] = None) -> List[str]:
+    """method to derive one unique sql file name per metadata file
+
+    Args:
+        metadata_files (List[str]): metadata file paths
+        base_dir (Optional[str]): directory the names are relative to, the deepest directory
+            holding every metadata file when None
+
+    Returns:
+        List[str]: sql file names relative to the output directory
+    """
+    abs_paths = [os.path.abspath(path) for path in metadata_files]
+    if base_dir is None:
+        base_dir = os.path.commonpath(
+            [os.path.dirname(path) for path in abs_paths])
+    return [os.path.splitext(os.path.relpath(path, base_dir))[0].replace(os.sep, '__') + '.sql'
+            for path in abs_paths]
+
+
+def compile_mapping(metadata_file_path: str, config_file_path: str, output_file_path: str,
+                    cache_dir: Optional[str] = None, profile: bool = False,
+                    profile_stats_path: Optional[str] = None, tool: str = QueryBuilder.tool,
+                    explain: bool = False, shared_tables: Optional[Dict[str, str]] = None,
+                    share: bool = False, lineage: bool = False) -> Dict:
+    """method to compile one metadata file, meant to be run inside a worker process
+
+    Args:
+        metadata_file_path (str): path of the metadata file
+        config_file_path (str): path of the config file
+        output_file_path (str): path of the sql file to write
+        cache_dir (Optional[str]): directory of the compilation cache, None disables it
+        profile (bool): record the per stage profile of the build
+        profile_stats_path (Optional[str]): pstats file of the hottest stage
+        tool (str): build tool, one of `BUILDERS`
+        explain (bool): estimate the cost of the generated statement
+        shared_tables (Optional[Dict[str, str]]): fingerprint -> table materialising a shared subquery
+        share (bool): list the subqueries and filtered tables other metadata files may share
+        lineage (bool): resolve the column lineage of the metadata file, for the lineage index
+
+    Returns:
+        Dict: result of the compilation
+    """
+    builder = BUILDERS[tool](metadata_file_path, config_file_path, cache_dir,
+                           profile, profile_stats_path, explain, shared_tables)
+    try:
+        builder.run(output_file_path)
+        shared = [candidate._asdict() for candidate in shared_candidates(builder.load_mapping())] if share else None
+    except Exception as excep:
+        logger.error("Failed to build query for %s - %s",
+                     metadata_file_path, excep.args)
+        result = {'metadata_file': metadata_file_path, 'status': 'failed',
+                  'error': ' '.join(str(arg) for arg in excep.args) or type(excep).__name__}
+    else:
+        result = {'metadata_file': metadata_file_path, 'status': 'success',
+                  'output_file': output_file_path}
+        if shared is not None:
+            result['shared'] = shared
+        if shared_tables:
+            result['shared_tables'] = sorted(shared_tables.values())
+    if builder.profile_report is not None:
+        result['profile'] = builder.profile_report
+    if builder.explain_report is not None:
+        result['explain'] = builder.explain_report
+    if lineage:
+        try:
+            # the sheets parsed by the build are reused, only the mapping before the optimizer is built
+            mapping = builder.metadata_parser.load_mapping(builder.sheet_states)
+            result['lineage'] = (target_table_name(mapping), column_lineage(mapping))
+        except Exception as excep:
+            logger.error("Failed to index lineage of %s - %s", metadata_file_path, excep.args)
+    return result
+
+
+@dataclass
+class BatchBuilder:
+    metadata_path: str
+    config_file_path: str
+    output_dir: str
+    workers: Optional[int] = None
+    cache_dir: Optional[str] = None
+    profile: bool = False
+    profile_stats_dir: Optional[str] = None
+    tool: str = QueryBuilder.tool
+    explain: bool = False
+    lineage_path: Optional[str] = None
+    share_subqueries: bool = False
+
+    def run(self) -> Dict:
+        """Method to build the sql for every metadata file of the batch
+
+        Returns:
+            Dict: summary of the batch run
+        """
+        metadata_files = resolve_metadata_files(self.metadata_path)
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_files = [os.path.join(self.output_dir, name)
+                        for name in output_file_names(metadata_files)]
+        workers = self.workers or os.cpu_count() or 1
+        logger.info("Building %d metadata files with %d workers",
+                    len(metadata_files), workers)
+
+        if self.profile_stats_dir:
+            os.makedirs(self.profile_stats_dir, exist_ok=True)
+        stale, lineage_counts = {}, {}
+        if self.lineage_path:
+            index = LineageIndex(self.lineage_path)
+            try:
+                stale, lineage_counts = index.changed(metadata_files)
+            finally:
+                index.close()
+        jobs = [(meta_file, self.config_file_path, output_file, self.cache_dir, self.profile,
+                 self._stats_path(output_file), self.tool, self.explain, None, self.share_subqueries,
+                 os.path.abspath(meta_file) in stale)
+                for meta_file, output_file in zip(metadata_files, output_files)]
+        results = self._compile(jobs, workers)
+        # the lineage rows go to the index, not to the summary
+        lineage = {os.path.abspath(result['metadata_file']): result.pop('lineage')
+                   for result in results if 'lineage' in result}
+        shared = self._share_subqueries(jobs, results, workers) if self.share_subqueries else None
+
+        failures = [result for result in results if result['status'] == 'failed']
+        summary = {
+            'total': len(results),
+            'succeeded': len(results) - len(failures),
+            'failed': len(failures),
+            'failures': failures,
+            'results': results,
+        }
+        if self.explain:
+            # costliest mappings first, to review before they reach the cluster
+            summary['costs'] = sorted(
+                ({'metadata_file': result['metadata_file'], 'cost': result['explain']['cost'],
+                  'flags': len(result['explain']['flags'])}
+                 for result in results if 'explain' in result),
+                key=lambda cost: cost['cost'], reverse=True)
+        if shared is not None:
+            summary['shared_subqueries'] = shared
+        if self.lineage_path:
+            index = LineageIndex(self.lineage_path)
+            try:
+                summary['lineage'] = index.store(stale, lineage, lineage_counts)
+            finally:
+                index.close()
+        with open(os.path.join(self.output_dir, SUMMARY_FILE_NAME), 'w') as fp:
+            json.dump(summary, fp, indent=2)
+
+        logger.info("Batch finished - %d succeeded, %d failed",
+                    summary['succeeded'], summary['failed'])
+        return summary
+
+    def _compile(self, jobs: List[Tuple], workers: int) -> List[Dict]:
+        if workers == 1 or len(jobs) == 1:
+            return [compile_mapping(*job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(compile_mapping, *zip(*jobs)))
+
+    def _share_subqueries(self, jobs: List[Tuple], results: List[Dict], workers: int) -> Dict:
+        """method to count the subqueries and filtered tables the metadata files share
+
+        With `shared_subqueries.materialize` set, the ones read by at least
+        `min_usage` metadata files are materialised once in `SHARED_FILE_NAME`
+        and the metadata files reading them are built again to read the
+        materialised tables.
+
+        Args:
+            jobs (List[Tuple]): compile_mapping arguments of each metadata file
+            results (List[Dict]): results of the jobs, replaced by the results of the rebuilt ones
+            workers (int): number of worker processes
+
+        Raises:
+            AutoETLException: Exception if the materialisation mode is not supported
+
+        Returns:
+            Dict: shared candidates by number of metadata files reading them
+        """
+        conf = ConfigParser.get_config_parser(self.config_file_path).validate_file().get('shared_subqueries') or {}
+        min_usage, materialize = conf.get('min_usage', DEFAULT_MIN_USAGE), conf.get('materialize')
+        if materialize is not None and materialize not in MATERIALIZE_MODES:
+            logger.error("Shared subqueries materialize - %s not supported.", materialize)
+            raise AutoETLException(f"Shared subqueries materialize - {materialize} not supported.",
+                                   list(MATERIALIZE_MODES))
+
+        usages: Dict[str, Dict] = {}
+        for result in results:
+            for candidate in result.get('shared', ()):
+                usage = usages.setdefault(candidate['fingerprint'], {**candidate, 'occurrences': 0,
+                                                                     'metadata_files': []})
+                usage['occurrences'] += 1
+                if result['metadata_file'] not in usage['metadata_files']:
+                    usage['metadata_files'].append(result['metadata_file'])
+        shared = sorted((usage for usage in usages.values() if len(usage['metadata_files']) >= min_usage),
+                        key=lambda usage: (-len(usage['metadata_files']), -usage['occurrences'],
+                                           usage['fingerprint']))
+        for usage in shared:
+            usage['usage'] = len(usage['metadata_files'])
+        logger.info("Found %d subqueries shared by at least %d metadata files, most shared %s",
+                    len(shared), min_usage, [(usage['fingerprint'], usage['usage']) for usage in shared[:5]])
+
+        report = {'min_usage': min_usage, 'materialized': None, 'subqueries': shared}
+        if materialize is None or not shared:
+            return report
+
+        names = {}
+        for usage in shared:
+            usage['table'] = names[usage['fingerprint']] = shared_table_name(
+                usage['fingerprint'], materialize, conf.get('schema'))
+        report['materialized'] = os.path.join(self.output_dir, SHARED_FILE_NAME)
+        with open(report['materialized'], 'w') as fp:
+            fp.writelines(shared_table_statements(((usage['table'], usage['sql']) for usage in shared),
+                                                  materialize))
+
+        rebuilt = {}
+        for index, result in enumerate(results):
+            tables = {candidate['fingerprint']: names[candidate['fingerprint']]
+                      for candidate in result.get('shared', ()) if candidate['fingerprint'] in names}
+            if tables:
+                rebuilt[index] = jobs[index][:8] + (tables, False, False)
+        logger.info("Building %d metadata files again to read the shared tables", len(rebuilt))
+        for index, result in zip(rebuilt, self._compile(list(rebuilt.values()), workers)):
+            results[index] = {**result, 'shared': results[index]['shared']}
+        return report
+
+    def _stats_path(self, output_file: str) -> Optional[str]:
+        if not self.profile or not self.profile_stats_dir:
+            return None
+        name = os.path.splitext(os.path.basename(output_file))[0]
+        return os.path.join(self.profile_stats_dir, name + '.pstats')
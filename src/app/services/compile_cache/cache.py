@@ -0,0 +1,268 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from pydantic.dataclasses import dataclass
+
+from app import __version__
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '.auto_etl_cache'
+DEFAULT_MAX_SIZE_MB = 512
+
+SQL_SUFFIX = '.sql'
+MODEL_SUFFIX = '.pkl'
+STATE_SUFFIX = '.state'
+_CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class CompileCache:
+    cache_dir: str = DEFAULT_CACHE_DIR
+    max_size_mb: int = DEFAULT_MAX_SIZE_MB
+
+    def __post_init__(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(metadata_file_path: str, config: Dict) -> str:
+        """method to compute the cache key of a metadata file build
+
+        Args:
+            metadata_file_path (str): path of the metadata file
+            config (Dict): validated config of the build
+
+        Returns:
+            str: hex digest of the workbook bytes, config and tool version
+        """
+        return CompileCache.get_keys(metadata_file_path, [config])[0]
+
+    @staticmethod
+    def get_keys(metadata_file_path: str, configs: List[Dict]) -> List[str]:
+        """method to compute the cache keys of several builds of one metadata file
+
+        The workbook bytes are read and hashed once for all the configs.
+
+        Args:
+            metadata_file_path (str): path of the metadata file
+            configs (List[Dict]): config of each build, e.g. one per target
+
+        Returns:
+            List[str]: one key per config
+        """
+        file_digest = hashlib.sha256()
+        paths = [metadata_file_path]
+        if os.path.isdir(metadata_file_path):
+            # mapping exported as one file per sheet, named after the sheets
+            paths = sorted(entry.path for entry in os.scandir(metadata_file_path) if entry.is_file())
+        for path in paths:
+            if path != metadata_file_path:
+                file_digest.update(os.path.basename(path).encode())
+            with open(path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(_CHUNK_SIZE), b''):
+                    file_digest.update(chunk)
+        keys = []
+        for config in configs:
+            digest = file_digest.copy()
+            digest.update(json.dumps(config, sort_keys=True,
+                          default=str).encode())
+            digest.update(__version__.encode())
+            keys.append(digest.hexdigest())
+        return keys
+
+    @staticmethod
+    def get_state_key(metadata_file_path: str, tool: str) -> str:
+        """method to compute the key of the incremental build state of a metadata file
+
+        Unlike the build keys it does not depend on the file content, the
+        state of the previous build is what an edited file is compared to.
+
+        Args:
+            metadata_file_path (str): path of the metadata file
+            tool (str): build tool
+
+        Returns:
+            str: hex digest of the file path, tool and tool version
+        """
+        return hashlib.sha256('\x00'.join(
+            (os.path.abspath(metadata_file_path), tool, __version__)).encode()).hexdigest()
+
+    def get_state(self, key: str) -> Optional[Any]:
+        """method to read the incremental build state of a metadata file
+
+        Args:
+            key (str): state key
+
+        Returns:
+            Optional[Any]: stored state, None when there is none
+        """
+        try:
+            with open(self._path(key, STATE_SUFFIX), 'rb') as fp:
+                state = pickle.load(fp)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        self._touch(key)
+        return state
+
+    def put_state(self, key: str, state: Any) -> None:
+        """method to store the incremental build state of a metadata file
+
+        Args:
+            key (str): state key
+            state (Any): picklable build state
+        """
+        try:
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError) as excep:
+            logger.debug('build state not stored - %s', excep.args)
+            return
+        self._write(self._path(key, STATE_SUFFIX), data)
+        self.evict()
+
+    def get_sql(self, key: str) -> Optional[str]:
+        """method to read the cached sql of a build
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            Optional[str]: cached sql, None on a cache miss
+        """
+        path = self._path(key, SQL_SUFFIX)
+        try:
+            with open(path) as fp:
+                sql = fp.read()
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        return sql
+
+    def stream_sql(self, key: str, output: TextIO) -> bool:
+        """method to copy the cached sql of a build to an output without reading it whole
+
+        Args:
+            key (str): cache key
+            output (TextIO): output the sql is written to
+
+        Returns:
+            bool: False on a cache miss
+        """
+        try:
+            with open(self._path(key, SQL_SUFFIX)) as fp:
+                shutil.copyfileobj(fp, output, _CHUNK_SIZE)
+        except FileNotFoundError:
+            return False
+        self._touch(key)
+        return True
+
+    def get_model(self, key: str) -> Optional[Any]:
+        """method to read the cached parsed mapping model of a build
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            Optional[Any]: cached model, None on a cache miss
+        """
+        try:
+            with open(self._path(key, MODEL_SUFFIX), 'rb') as fp:
+                model = pickle.load(fp)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        self._touch(key)
+        return model
+
+    def put(self, key: str, sql: str, model: Any = None) -> None:
+        """method to store the sql and the parsed model of a build
+
+        Args:
+            key (str): cache key
+            sql (str): generated sql
+            model (Any, optional): parsed mapping model
+        """
+        with self.sql_writer(key, model) as fp:
+            fp.write(sql)
+
+    @contextmanager
+    def sql_writer(self, key: str, model: Any = None) -> Iterator[TextIO]:
+        """context yielding a file the sql of a build is streamed into
+
+        The entry only becomes visible once the context exits without error.
+
+        Args:
+            key (str): cache key
+            model (Any, optional): parsed mapping model stored along with the sql
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                yield fp
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if model is not None:
+            self._write(self._path(key, MODEL_SUFFIX),
+                        pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+        os.replace(tmp_path, self._path(key, SQL_SUFFIX))
+        self.evict()
+
+    def evict(self) -> None:
+        """method to drop the least recently used entries once the cache outgrows its size
+        """
+        entries: Dict[str, list] = {}
+        total_size = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith((SQL_SUFFIX, MODEL_SUFFIX, STATE_SUFFIX)):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                key = os.path.splitext(entry.name)[0]
+                size_mtime = entries.setdefault(key, [0, 0.0])
+                size_mtime[0] += stat.st_size
+                size_mtime[1] = max(size_mtime[1], stat.st_mtime)
+                total_size += stat.st_size
+
+        max_size = self.max_size_mb * 1024 * 1024
+        if total_size <= max_size:
+            return
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            for suffix in (SQL_SUFFIX, MODEL_SUFFIX, STATE_SUFFIX):
+                try:
+                    os.remove(self._path(key, suffix))
+                except FileNotFoundError:
+                    pass
+            logger.debug('evicted cache entry %s', key)
+            total_size -= size
+            if total_size <= max_size:
+                break
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _touch(self, key: str) -> None:
+        for suffix in (SQL_SUFFIX, MODEL_SUFFIX, STATE_SUFFIX):
+            try:
+                os.utime(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _write(self, path: str, data: bytes) -> None:
+        # written next to the target and renamed, so concurrent workers never read partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
@@ -1 +1,4 @@
+from .models import (FLAG_VALUES, GENERATED_FILTER_STEP, Filter, JoinsAndFilters,
+                     JoinStep, MetadataMapping, SelectColumn, TargetColumn, TargetTable)
 from .parser import ConfigParser, MetadataParser
+from .workbook import SheetState, WorkbookIndex
@@ -0,0 +1,236 @@
+import functools
+from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from app.utils import SHEET_ROW_KEY, transform_format
+
+# cell values setting a yes/no column of the target_table sheet, e.g. DistKey
+FLAG_VALUES = ('y', 'yes', 'true', '1')
+# step of the filters added by the builders rather than read from a joins_and_filters row
+GENERATED_FILTER_STEP = -1
+
+
+def _text(value: Any) -> Optional[str]:
+    """cells are kept as text, blank cells become None"""
+    if value is None:
+        return None
+    value = str(value)
+    return value if value.strip() else None
+
+
+class TargetColumn(NamedTuple):
+    name: Optional[str]
+    data_type: Optional[str] = None
+    description: Optional[str] = None
+    constraint: Optional[str] = None
+    # physical design, e.g. `zstd`, `yes` and `1` for the first sort key column
+    encoding: Optional[str] = None
+    dist_key: Optional[str] = None
+    sort_key: Optional[str] = None
+    # `yes` on the column chunked backfills are partitioned by
+    partition_key: Optional[str] = None
+
+
+class TargetTable(NamedTuple):
+    name: Optional[str]
+    schema_name: Optional[str]
+    columns: Tuple[TargetColumn, ...]
+    dist_style: Optional[str] = None
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> 'TargetTable':
+        """method to build the target table from the target_table sheet rows
+
+        Args:
+            records (Iterable[Dict]): target_table sheet rows
+
+        Returns:
+            TargetTable
+        """
+        name, schema_name, dist_style, columns = None, None, None, []
+        for record in records:
+            name = name or _text(record.get('Target_Table_Name'))
+            schema_name = schema_name or _text(record.get('Schema'))
+            dist_style = dist_style or _text(record.get('DistStyle'))
+            columns.append(TargetColumn(_text(record.get('Columns')),
+                                        _text(record.get('DataType')),
+                                        _text(record.get('Description')),
+                                        _text(record.get('Constraint')),
+                                        _text(record.get('Encoding')),
+                                        _text(record.get('DistKey')),
+                                        _text(record.get('SortKey')),
+                                        _text(record.get('PartitionKey'))))
+        return cls(name, schema_name, tuple(columns), dist_style)
+
+
+class SelectColumn(NamedTuple):
+    column_alias: Optional[str]
+    expression: str
+    transformation: Optional[str] = None
+    arguments: Optional[str] = None
+    source_table: Optional[str] = None
+    table_alias: Optional[str] = None
+    comments: Optional[str] = None
+
+    @classmethod
+    def from_record(cls, record: Dict) -> 'SelectColumn':
+        """method to build a select column from a select_sources sheet row
+
+        Args:
+            record (Dict): select_sources sheet row
+
+        Returns:
+            SelectColumn
+        """
+        transformation = _text(record.get('transformation'))
+        arguments = _text(record.get('arguments'))
+        if transformation is None:
+            expression = arguments or ''
+        else:
+            expression = transform_format.format(
+                func=transformation, exp=arguments or '')
+        return cls(_text(record.get('column_alias')), expression, transformation, arguments,
+                   _text(record.get('source_table')), _text(record.get('table_alias')),
+                   _text(record.get('comments')))
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> Tuple['SelectColumn', ...]:
+        """method to build the select columns from the select_sources sheet rows
+
+        Args:
+            records (Iterable[Dict]): select_sources sheet rows
+
+        Returns:
+            Tuple[SelectColumn, ...]
+        """
+        return tuple(cls.from_record(record) for record in records)
+
+
+class JoinStep(NamedTuple):
+    reference_table_alias: Optional[str]
+    join_type: Optional[str]
+    reference_table: Optional[str] = None
+    reference_subquery: Optional[str] = None
+    join_condition: Optional[str] = None
+    # joins_and_filters sheet row of the step, for error messages
+    row: Optional[int] = None
+
+    @property
+    def reference(self) -> Optional[str]:
+        """table or parenthesised subquery the step joins to"""
+        if self.reference_subquery:
+            return '(' + self.reference_subquery + ')'
+        return self.reference_table
+
+
+class Filter(NamedTuple):
+    condition: str
+    step: int
+
+
+class JoinsAndFilters(NamedTuple):
+    driving_table: Optional[str]
+    driving_table_alias: Optional[str]
+    joins: Tuple[JoinStep, ...]
+    filters: Tuple[Filter, ...]
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> 'JoinsAndFilters':
+        """method to build the join chain and the filters from the joins_and_filters sheet rows
+
+        Args:
+            records (Iterable[Dict]): joins_and_filters sheet rows, in sheet order
+
+        Returns:
+            JoinsAndFilters
+        """
+        driving_table, driving_table_alias = None, None
+        joins, filters = [], []
+        for _index, _map in enumerate(records):
+            if _index == 0:
+                driving_table = _text(_map.get('driving_table'))
+                driving_table_alias = _text(_map.get('driving_table_alias'))
+            joins.append(JoinStep(_text(_map.get('reference_table_alias')),
+                                  _text(_map.get('join_type')),
+                                  _text(_map.get('reference_table')),
+                                  _text(_map.get('reference_subquery')),
+                                  _text(_map.get('join_condition')),
+                                  _map.get(SHEET_ROW_KEY, _index + 2)))
+            condition = _text(_map.get('filter_condition'))
+            if condition:
+                filters.append(Filter(condition, _index))
+        return cls(driving_table, driving_table_alias, tuple(joins), tuple(filters))
+
+
+class MetadataMapping(NamedTuple):
+    driving_table: Optional[str]
+    driving_table_alias: Optional[str]
+    joins: Tuple[JoinStep, ...]
+    filters: Tuple[Filter, ...]
+    select_columns: Tuple[SelectColumn, ...]
+    target_table: TargetTable
+    # (name, query) of the WITH clauses added by the optimizer
+    ctes: Tuple[Tuple[str, str], ...] = ()
+
+    @classmethod
+    def from_records(cls, target_table: Iterable[Dict], joins_and_filters: Iterable[Dict],
+                     select_sources: Iterable[Dict]) -> 'MetadataMapping':
+        """method to build the mapping model from the rows of the three metadata sheets
+
+        Args:
+            target_table (Iterable[Dict]): target_table sheet rows
+            joins_and_filters (Iterable[Dict]): joins_and_filters sheet rows, in sheet order
+            select_sources (Iterable[Dict]): select_sources sheet rows
+
+        Returns:
+            MetadataMapping
+        """
+        return cls.from_sheets(TargetTable.from_records(target_table),
+                               JoinsAndFilters.from_records(joins_and_filters),
+                               SelectColumn.from_records(select_sources))
+
+    @classmethod
+    def from_sheets(cls, target_table: TargetTable, joins_and_filters: JoinsAndFilters,
+                    select_columns: Tuple[SelectColumn, ...]) -> 'MetadataMapping':
+        """method to assemble the mapping model from the models of each sheet
+
+        Args:
+            target_table (TargetTable): target_table sheet model
+            joins_and_filters (JoinsAndFilters): joins_and_filters sheet model
+            select_columns (Tuple[SelectColumn, ...]): select_sources sheet model
+
+        Returns:
+            MetadataMapping
+        """
+        return cls(*joins_and_filters, select_columns, target_table)
+
+    @classmethod
+    def __get_validators__(cls) -> Iterator[Callable[[Any], 'MetadataMapping']]:
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value: Any) -> 'MetadataMapping':
+        """method validating the mapping field of the pydantic dataclasses, e.g. the dialects
+
+        The loaders build the models from cells normalised by `_text`, so a
+        MetadataMapping is passed through as is instead of being validated and
+        copied again row by row each time a dialect is constructed. Any other
+        value is validated against the schema compiled from the annotations.
+
+        Args:
+            value (Any): MetadataMapping, or a tuple of its fields
+
+        Returns:
+            MetadataMapping
+        """
+        if isinstance(value, cls):
+            return value
+        return _mapping_validator()(value)
+
+
+@functools.lru_cache(maxsize=None)
+def _mapping_validator() -> Callable[[Any], MetadataMapping]:
+    from pydantic import BaseConfig
+    from pydantic.validators import make_namedtuple_validator, tuple_validator
+
+    validator = make_namedtuple_validator(MetadataMapping, BaseConfig)
+    return lambda value: validator(tuple_validator(value))
@@ -1,23 +1,35 @@
 import json
 import logging
-from typing import Any
+import zipfile
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Optional
 
-import pandas as pd
 from pydantic.dataclasses import dataclass
 
 from app.etl_exceptions import AutoETLException
-from app.utils import is_valid_file
+from app.utils import is_valid_file, sheet_to_records
+
+from .models import JoinsAndFilters, MetadataMapping, SelectColumn, TargetTable
+from .sources import XLSX_EXTENSION, mapping_extension, read_sheets
+from .workbook import SheetState, WorkbookIndex
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 
-sheet_names = ["target_table", "joins_and_filters"]
+sheet_names = ["target_table", "joins_and_filters", "select_sources"]
+sheet_models: Dict[str, Callable[[Iterable[Dict]], Any]] = {
+    "target_table": TargetTable.from_records,
+    "joins_and_filters": JoinsAndFilters.from_records,
+    "select_sources": SelectColumn.from_records,
+}
 
 
 @dataclass
 class MetadataParser:
     metadata_file_path: str
 
-    def validate_file(self) -> pd.ExcelFile:
+    def validate_file(self) -> 'pd.ExcelFile':
         """method to validate the metadata excel file
 
         Raises:
@@ -26,6 +38,8 @@ class MetadataParser:
         Returns:
             ExcelFile
         """
+        import pandas as pd
+
         logger.info("Validating the metadata file")
         if not is_valid_file(self.metadata_file_path):
             logger.error("File path not correct - %s", self.metadata_file_path)
@@ -41,6 +55,81 @@ class MetadataParser:
                 "Sheet names not set properly in metadata excel file")
         return meta_xls
 
+    def is_workbook(self) -> bool:
+        """method to check if the metadata file is an excel workbook rather than another mapping source
+
+        Returns:
+            bool
+        """
+        return mapping_extension(self.metadata_file_path, sheet_names) == XLSX_EXTENSION
+
+    def load_mapping(self, sheet_states: Optional[Dict[str, SheetState]] = None) -> MetadataMapping:
+        """method to load the mapping sheets of the metadata file in a single pass
+
+        The workbook is opened once in read only mode and the rows are streamed
+        straight into the mapping model, without going through DataFrames.
+        Given the sheet states of a previous build, the sheets left unchanged
+        reuse their parsed model and only the edited sheets are read, the
+        states are updated in place. The other mapping sources (json, csv and
+        parquet, see `sources.py`) are read by the reader of their extension.
+
+        Args:
+            sheet_states (Optional[Dict[str, SheetState]]): sheet states of the previous build
+
+        Raises:
+            AutoETLException: Exception if sheet names not found in the file
+
+        Returns:
+            MetadataMapping
+        """
+        logger.info("Loading the metadata file")
+        if not is_valid_file(self.metadata_file_path):
+            logger.error("File path not correct - %s", self.metadata_file_path)
+            raise AutoETLException(
+                f"File path not correct - {self.metadata_file_path}")
+        if not self.is_workbook():
+            records = read_sheets(self.metadata_file_path, sheet_names)
+            return MetadataMapping.from_sheets(*(sheet_models[sheet](records[sheet])
+                                                 for sheet in sheet_names))
+
+        import openpyxl
+
+        index = None
+        if sheet_states is not None:
+            try:
+                index = WorkbookIndex(self.metadata_file_path)
+            except zipfile.BadZipFile:
+                logger.debug("No sheet states for %s, not a zip archive",
+                             self.metadata_file_path)
+        try:
+            models = {sheet: sheet_states[sheet].model for sheet in sheet_names
+                      if index is not None and index.is_unchanged(sheet, sheet_states.get(sheet))}
+            stale = [sheet for sheet in sheet_names if sheet not in models]
+            if models:
+                logger.info("Reusing the unchanged sheets - %s", list(models))
+            if stale:
+                workbook = openpyxl.load_workbook(
+                    self.metadata_file_path, read_only=True, data_only=True)
+                try:
+                    if not all(sheet in workbook.sheetnames for sheet in sheet_names):
+                        logger.error(
+                            "Sheet names not set properly in metadata excel file")
+                        raise AutoETLException(
+                            "Sheet names not set properly in metadata excel file")
+                    for sheet in stale:
+                        models[sheet] = sheet_models[sheet](
+                            sheet_to_records(workbook[sheet]))
+                finally:
+                    workbook.close()
+            if index is not None:
+                for sheet in stale:
+                    sheet_states[sheet] = index.state(sheet, models[sheet])
+        finally:
+            if index is not None:
+                index.close()
+        return MetadataMapping.from_sheets(models["target_table"], models["joins_and_filters"],
+                                           models["select_sources"])
+
     @classmethod
     def get_metadata_parser(cls,
                             file_path: str) -> 'MetadataParser':
@@ -0,0 +1,134 @@
+import csv
+import json
+import logging
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+from app.etl_exceptions import AutoETLException
+from app.utils import SHEET_ROW_KEY
+
+logger = logging.getLogger(__name__)
+
+XLSX_EXTENSION = '.xlsx'
+
+SheetReader = Callable[[str, Sequence[str]], Dict[str, Iterable[Dict]]]
+
+
+class MappingSource(NamedTuple):
+    read: SheetReader
+    # the mapping is a directory holding one `<sheet><extension>` file per sheet
+    directory: bool
+
+
+MAPPING_SOURCES: Dict[str, MappingSource] = {}
+
+
+def register_mapping_source(extension: str, directory: bool = False) -> Callable[[SheetReader], SheetReader]:
+    """decorator registering the sheet reader of a mapping file format
+
+    Args:
+        extension (str): file extension of the format, e.g. `.json`
+        directory (bool): the mapping is a directory of one file per sheet
+    """
+    def _register(read: SheetReader) -> SheetReader:
+        MAPPING_SOURCES[extension] = MappingSource(read, directory)
+        return read
+    return _register
+
+
+def mapping_extension(metadata_path: str, sheets: Sequence[str]) -> Optional[str]:
+    """method to find the format of a mapping from its extension
+
+    Args:
+        metadata_path (str): mapping file, or directory of sheet files
+        sheets (Sequence[str]): sheet names of a mapping
+
+    Returns:
+        Optional[str]: registered extension, `.xlsx`, or None if the format is unknown
+    """
+    if os.path.isdir(metadata_path):
+        for extension, source in MAPPING_SOURCES.items():
+            if source.directory and all(os.path.isfile(os.path.join(metadata_path, sheet + extension))
+                                        for sheet in sheets):
+                return extension
+        return None
+    extension = os.path.splitext(metadata_path)[1].lower()
+    if extension == XLSX_EXTENSION or (extension in MAPPING_SOURCES
+                                       and not MAPPING_SOURCES[extension].directory):
+        return extension
+    return None
+
+
+def sheet_files(metadata_path: str, sheets: Sequence[str]) -> List[str]:
+    """method to list the files a mapping is read from
+
+    Args:
+        metadata_path (str): mapping file, or directory of sheet files
+        sheets (Sequence[str]): sheet names of a mapping
+
+    Returns:
+        List[str]: the mapping file, or the sheet files of a mapping directory
+    """
+    extension = mapping_extension(metadata_path, sheets)
+    if os.path.isdir(metadata_path) and extension is not None:
+        return [os.path.join(metadata_path, sheet + extension) for sheet in sheets]
+    return [metadata_path]
+
+
+def read_sheets(metadata_path: str, sheets: Sequence[str]) -> Dict[str, Iterable[Dict]]:
+    """method to read the sheet rows of a non excel mapping
+
+    Args:
+        metadata_path (str): mapping file, or directory of sheet files
+        sheets (Sequence[str]): sheet names of a mapping
+
+    Raises:
+        AutoETLException: Exception if the format is not supported or a sheet is missing
+
+    Returns:
+        Dict[str, Iterable[Dict]]: rows of each sheet
+    """
+    extension = mapping_extension(metadata_path, sheets)
+    if extension is None or extension not in MAPPING_SOURCES:
+        logger.error("Mapping format not supported - %s", metadata_path)
+        raise AutoETLException(f"Mapping format not supported - {metadata_path}")
+    return MAPPING_SOURCES[extension].read(metadata_path, sheets)
+
+
+@register_mapping_source('.json')
+def read_json_sheets(metadata_path: str, sheets: Sequence[str]) -> Dict[str, Iterable[Dict]]:
+    """one json object holding a list of row objects per sheet"""
+    with open(metadata_path) as fp:
+        document = json.load(fp)
+    if not isinstance(document, dict) or not all(isinstance(document.get(sheet), list) for sheet in sheets):
+        logger.error("Sheet names not set properly in metadata json file")
+        raise AutoETLException("Sheet names not set properly in metadata json file")
+    return {sheet: document[sheet] for sheet in sheets}
+
+
+@register_mapping_source('.csv', directory=True)
+def read_csv_sheets(metadata_path: str, sheets: Sequence[str]) -> Dict[str, Iterable[Dict]]:
+    """one csv file with a header row per sheet, the rows are streamed"""
+    def _rows(path: str) -> Iterator[Dict]:
+        with open(path, newline='', encoding='utf-8-sig') as fp:
+            reader = csv.DictReader(fp)
+            for row in reader:
+                # same as the excel readers, blank rows are not mapping rows
+                if any(value for value in row.values()):
+                    row[SHEET_ROW_KEY] = reader.line_num
+                    yield row
+    return {sheet: _rows(os.path.join(metadata_path, sheet + '.csv')) for sheet in sheets}
+
+
+@register_mapping_source('.parquet', directory=True)
+def read_parquet_sheets(metadata_path: str, sheets: Sequence[str]) -> Dict[str, Iterable[Dict]]:
+    """one parquet file per sheet, memory mapped through pyarrow"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as excep:
+        logger.error("Reading parquet mappings needs pyarrow, install the parquet extra")
+        raise AutoETLException(
+            "Reading parquet mappings needs pyarrow, install the parquet extra", excep.args)
+    return {sheet: pq.read_table(os.path.join(metadata_path, sheet + '.parquet'),
+                                 memory_map=True).to_pylist()
+            for sheet in sheets}
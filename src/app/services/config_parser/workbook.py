@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import posixpath
+import re
+import zipfile
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+WORKBOOK_PART = 'xl/workbook.xml'
+WORKBOOK_RELS_PART = 'xl/_rels/workbook.xml.rels'
+SHARED_STRINGS_PART = 'xl/sharedStrings.xml'
+STYLES_PART = 'xl/styles.xml'
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+_shared_cell_pattern = re.compile(rb'<c\b[^>]*\bt="s"')
+_shared_value_pattern = re.compile(rb'<c\b[^>]*\bt="s"[^>]*>\s*<v>(\d+)</v>')
+
+
+class SheetState(NamedTuple):
+    # crc of the sheet part and of the styles part, from the zip directory
+    crc: Tuple[int, int]
+    # number of leading shared strings the sheet can reference and their digest
+    strings_count: int
+    strings_digest: str
+    # parsed model of the sheet
+    model: Any
+
+
+class WorkbookIndex:
+    """Reads the zip directory of an xlsx workbook to tell which sheets changed since a build
+
+    A sheet is unchanged when its xml part and the styles part have the same
+    crc, and the shared strings it references are the same. The shared
+    strings table is only read when its own crc changed.
+    """
+
+    def __init__(self, metadata_file_path: str) -> None:
+        self.archive = zipfile.ZipFile(metadata_file_path)
+        self.crcs = {info.filename: info.CRC for info in self.archive.infolist()}
+        self.parts = self._sheet_parts()
+        self._strings: Optional[List[str]] = None
+
+    def close(self) -> None:
+        self.archive.close()
+
+    def crc(self, sheet_name: str) -> Tuple[int, int]:
+        """method to get the crc pair a sheet state is compared on"""
+        return self.crcs.get(self.parts.get(sheet_name, ''), 0), self.crcs.get(STYLES_PART, 0)
+
+    def is_unchanged(self, sheet_name: str, state: Optional[SheetState]) -> bool:
+        """method to check if a sheet still holds the values it had when its state was taken
+
+        Args:
+            sheet_name (str)
+            state (Optional[SheetState]): state of the previous build
+
+        Returns:
+            bool
+        """
+        if state is None or sheet_name not in self.parts or state.crc != self.crc(sheet_name):
+            return False
+        return self._strings_digest(state.strings_count) == state.strings_digest
+
+    def state(self, sheet_name: str, model: Any) -> SheetState:
+        """method to take the state of a freshly parsed sheet
+
+        Args:
+            sheet_name (str)
+            model (Any): parsed model of the sheet
+
+        Returns:
+            SheetState
+        """
+        data = self.archive.read(self.parts[sheet_name])
+        indexes = [int(index) for index in _shared_value_pattern.findall(data)]
+        if len(indexes) == len(_shared_cell_pattern.findall(data)):
+            strings_count = max(indexes, default=-1) + 1
+        else:
+            # a shared string cell not written as <v>index</v>, depend on the whole table
+            strings_count = len(self._shared_strings())
+        return SheetState(self.crc(sheet_name), strings_count,
+                          self._strings_digest(strings_count), model)
+
+    def _strings_digest(self, count: int) -> str:
+        if count == 0:
+            return ''
+        strings = self._shared_strings()
+        if len(strings) < count:
+            return ''
+        return hashlib.sha256('\x00'.join(strings[:count]).encode()).hexdigest()
+
+    def _shared_strings(self) -> List[str]:
+        if self._strings is None:
+            self._strings = []
+            if SHARED_STRINGS_PART in self.crcs:
+                root = ElementTree.fromstring(
+                    self.archive.read(SHARED_STRINGS_PART))
+                self._strings = [''.join(text.text or '' for text in item.iter(f'{_MAIN_NS}t'))
+                                 for item in root.iter(f'{_MAIN_NS}si')]
+        return self._strings
+
+    def _sheet_parts(self) -> Dict[str, str]:
+        try:
+            workbook = ElementTree.fromstring(self.archive.read(WORKBOOK_PART))
+            rels = ElementTree.fromstring(self.archive.read(WORKBOOK_RELS_PART))
+        except KeyError:
+            return {}
+        targets = {rel.get('Id'): rel.get('Target', '')
+                   for rel in rels.iter(f'{_PACKAGE_REL_NS}Relationship')}
+        parts = {}
+        for sheet in workbook.iter(f'{_MAIN_NS}sheet'):
+            target = targets.get(sheet.get(f'{_REL_NS}id'), '')
+            # targets are relative to xl/ unless they start from the package root
+            parts[sheet.get('name')] = target.lstrip('/') if target.startswith('/') \
+                else posixpath.normpath(posixpath.join('xl', target))
+        return parts
@@ -0,0 +1 @@
+from .lineage import DEFAULT_INDEX_PATH, LineageIndex, LineageRow, column_lineage, target_table_name
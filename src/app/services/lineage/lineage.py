@@ -0,0 +1,280 @@
+import logging
+import os
+import sqlite3
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from app.services.compile_cache import CompileCache
+from app.services.config_parser import MetadataMapping, MetadataParser
+from app.services.query_builder.hoisting import unqualified_columns
+from app.utils import file_signature, referenced_columns, referenced_tables
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = '.auto_etl_lineage.db'
+# what a source column is read for
+SELECT_USAGE = 'select'
+JOIN_USAGE = 'join'
+FILTER_USAGE = 'filter'
+
+_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS mappings (
+        metadata_file TEXT PRIMARY KEY,
+        mtime_ns INTEGER,
+        size INTEGER,
+        digest TEXT,
+        target_table TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS lineage (
+        metadata_file TEXT NOT NULL,
+        target_table TEXT,
+        target_column TEXT,
+        usage TEXT NOT NULL,
+        source_table TEXT NOT NULL,
+        source_column TEXT NOT NULL,
+        expression TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS lineage_source ON lineage (source_table, source_column)',
+    'CREATE INDEX IF NOT EXISTS lineage_target ON lineage (target_table, target_column)',
+    'CREATE INDEX IF NOT EXISTS lineage_file ON lineage (metadata_file)',
+)
+
+
+class LineageRow(NamedTuple):
+    # None for the columns read by joins and filters
+    target_column: Optional[str]
+    usage: str
+    source_table: str
+    source_column: str
+    expression: Optional[str]
+
+
+def column_lineage(mapping: MetadataMapping) -> List[LineageRow]:
+    """method to resolve the source columns each target column and each join/filter reads
+
+    Qualified columns are resolved through the driving table and join
+    aliases, a column read through a reference_subquery is attributed to
+    every table the subquery reads. Unqualified columns of a select row are
+    attributed to its table_alias, or to its source_table.
+
+    Args:
+        mapping (MetadataMapping): mapping as read from the metadata file, before the optimizer
+
+    Returns:
+        List[LineageRow]: lower cased tables and columns, one row per source column
+    """
+    tables: Dict[str, List[str]] = {}
+    if mapping.driving_table_alias and mapping.driving_table:
+        tables[mapping.driving_table_alias.lower()] = [mapping.driving_table.lower()]
+    for _step in mapping.joins:
+        if not _step.reference_table_alias:
+            continue
+        if _step.reference_subquery:
+            sources = referenced_tables(_step.reference_subquery)
+        else:
+            sources = [_step.reference_table] if _step.reference_table else []
+        tables[_step.reference_table_alias.lower()] = [source.lower() for source in sources]
+
+    rows: List[LineageRow] = []
+
+    def _add(target_column: Optional[str], usage: str, text: str, default: List[str]) -> None:
+        columns: Set[Tuple[str, str]] = set()
+        for alias, column in referenced_columns(text):
+            for table in tables.get(alias.lower(), ()):
+                columns.add((table, column.lower()))
+        for column in unqualified_columns(text):
+            for table in default:
+                columns.add((table, column))
+        rows.extend(LineageRow(target_column, usage, table, column, text) for table, column in sorted(columns))
+
+    for _select in mapping.select_columns:
+        if _select.table_alias and _select.table_alias.lower() in tables:
+            default = tables[_select.table_alias.lower()]
+        else:
+            default = [_select.source_table.lower()] if _select.source_table else []
+        _add((_select.column_alias or '').lower() or None, SELECT_USAGE, _select.expression, default)
+    for _step in mapping.joins:
+        if _step.join_condition:
+            _add(None, JOIN_USAGE, _step.join_condition, [])
+    for _filter in mapping.filters:
+        _add(None, FILTER_USAGE, _filter.condition, [])
+    return rows
+
+
+def target_table_name(mapping: MetadataMapping) -> Optional[str]:
+    """lower cased `schema.table` of the target table"""
+    target = mapping.target_table
+    return '.'.join(part for part in (target.schema_name, target.name) if part).lower() or None
+
+
+class LineageIndex:
+    """Persistent column lineage of many metadata files, kept in a SQLite file
+
+    Each metadata file is indexed with the content digest it was read from,
+    so updating the index only parses the files added or changed since.
+    """
+
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH) -> None:
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            for statement in _SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def update(self, metadata_files: Iterable[str]) -> Dict[str, int]:
+        """method to index the metadata files added or changed since the last update
+
+        A file whose mtime and size are unchanged is skipped without being
+        read, a touched file is only parsed again when its content changed.
+
+        Args:
+            metadata_files (Iterable[str]): metadata file paths
+
+        Returns:
+            Dict[str, int]: number of `indexed`, `unchanged` and `failed` files
+        """
+        stale, counts = self.changed(metadata_files)
+        lineage: Dict[str, Tuple[Optional[str], List[LineageRow]]] = {}
+        for path in stale:
+            try:
+                mapping = MetadataParser.get_metadata_parser(path).load_mapping()
+            except Exception as excep:
+                logger.error("Failed to index lineage of %s - %s", path, excep.args)
+                continue
+            lineage[path] = (target_table_name(mapping), column_lineage(mapping))
+        return self.store(stale, lineage, counts)
+
+    def changed(self, metadata_files: Iterable[str]) -> Tuple[Dict[str, Tuple[int, int, str]], Dict[str, int]]:
+        """method to find the metadata files added or changed since the last update, without parsing them
+
+        Args:
+            metadata_files (Iterable[str]): metadata file paths
+
+        Returns:
+            Tuple[Dict[str, Tuple[int, int, str]], Dict[str, int]]: mtime_ns, size and content digest
+                of each file to index again by absolute path, and the number of `unchanged` and
+                `failed` files
+        """
+        stale: Dict[str, Tuple[int, int, str]] = {}
+        counts = {'indexed': 0, 'unchanged': 0, 'failed': 0}
+        for metadata_file in metadata_files:
+            path = os.path.abspath(metadata_file)
+            try:
+                mtime_ns, size = file_signature(path)
+                known = self.connection.execute(
+                    'SELECT mtime_ns, size, digest FROM mappings WHERE metadata_file = ?', (path,)).fetchone()
+                if known is not None and (known['mtime_ns'], known['size']) == (mtime_ns, size):
+                    counts['unchanged'] += 1
+                    continue
+                digest = CompileCache.get_keys(path, [{}])[0]
+                if known is not None and known['digest'] == digest:
+                    with self.connection:
+                        self.connection.execute('UPDATE mappings SET mtime_ns = ?, size = ? WHERE metadata_file = ?',
+                                                (mtime_ns, size, path))
+                    counts['unchanged'] += 1
+                    continue
+            except Exception as excep:
+                logger.error("Failed to index lineage of %s - %s", metadata_file, excep.args)
+                counts['failed'] += 1
+                continue
+            stale[path] = (mtime_ns, size, digest)
+        return stale, counts
+
+    def store(self, stale: Dict[str, Tuple[int, int, str]],
+              lineage: Dict[str, Tuple[Optional[str], List[LineageRow]]], counts: Dict[str, int]) -> Dict[str, int]:
+        """method to replace the lineage of the files found by `changed`
+
+        Args:
+            stale (Dict[str, Tuple[int, int, str]]): versions of the files to index, from `changed`
+            lineage (Dict[str, Tuple[Optional[str], List[LineageRow]]]): target table and lineage rows
+                by absolute path, a stale file without lineage failed to be read
+            counts (Dict[str, int]): counts returned by `changed`, updated in place
+
+        Returns:
+            Dict[str, int]: number of `indexed`, `unchanged` and `failed` files
+        """
+        for path, version in stale.items():
+            if path not in lineage:
+                counts['failed'] += 1
+                continue
+            self.index_rows(path, *lineage[path], version)
+            counts['indexed'] += 1
+        logger.info('lineage index %s - %s', self.index_path, counts)
+        return counts
+
+    def index_mapping(self, metadata_file: str, mapping: MetadataMapping,
+                      version: Tuple[int, int, str] = (0, 0, '')) -> None:
+        """method to replace the lineage of one metadata file
+
+        Args:
+            metadata_file (str): path of the metadata file
+            mapping (MetadataMapping): mapping as read from the metadata file
+            version (Tuple[int, int, str]): mtime_ns, size and content digest of the file
+        """
+        self.index_rows(metadata_file, target_table_name(mapping), column_lineage(mapping), version)
+
+    def index_rows(self, metadata_file: str, target_table: Optional[str], rows: Iterable[LineageRow],
+                   version: Tuple[int, int, str] = (0, 0, '')) -> None:
+        """method to replace the lineage of one metadata file with rows resolved beforehand
+
+        Args:
+            metadata_file (str): path of the metadata file
+            target_table (Optional[str]): `schema.table` of the target table
+            rows (Iterable[LineageRow]): lineage rows, from `column_lineage`
+            version (Tuple[int, int, str]): mtime_ns, size and content digest of the file
+        """
+        path = os.path.abspath(metadata_file)
+        with self.connection:
+            self.connection.execute('DELETE FROM lineage WHERE metadata_file = ?', (path,))
+            self.connection.execute('INSERT OR REPLACE INTO mappings VALUES (?, ?, ?, ?, ?)',
+                                    (path, *version, target_table))
+            self.connection.executemany(
+                'INSERT INTO lineage VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(path, target_table, *row) for row in rows])
+
+    def prune(self) -> int:
+        """method to drop the metadata files that no longer exist
+
+        Returns:
+            int: number of metadata files dropped
+        """
+        missing = [(row['metadata_file'],) for row in self.connection.execute('SELECT metadata_file FROM mappings')
+                   if not os.path.exists(row['metadata_file'])]
+        with self.connection:
+            self.connection.executemany('DELETE FROM lineage WHERE metadata_file = ?', missing)
+            self.connection.executemany('DELETE FROM mappings WHERE metadata_file = ?', missing)
+        return len(missing)
+
+    def readers(self, source: str) -> List[Dict]:
+        """method to find the mappings reading a source column, or any column of a source table
+
+        Args:
+            source (str): `schema.table.column`, or `schema.table`
+
+        Returns:
+            List[Dict]: lineage rows, by metadata file and target column
+        """
+        table, _, column = source.lower().rpartition('.')
+        return self._query('(source_table = ? AND source_column = ?) OR source_table = ?',
+                           (table, column, source.lower()))
+
+    def sources(self, target: str) -> List[Dict]:
+        """method to find the source columns a target column, or every column of a target table, reads
+
+        Args:
+            target (str): `schema.table.column`, or `schema.table`
+
+        Returns:
+            List[Dict]: lineage rows, by metadata file and target column
+        """
+        table, _, column = target.lower().rpartition('.')
+        return self._query('(target_table = ? AND target_column = ?) OR '
+                           f"(target_table = ? AND usage = '{SELECT_USAGE}')", (table, column, target.lower()))
+
+    def _query(self, condition: str, parameters: Tuple) -> List[Dict]:
+        return [dict(row) for row in self.connection.execute(
+            f'SELECT * FROM lineage WHERE {condition} '
+            'ORDER BY metadata_file, target_column, source_table, source_column', parameters)]
@@ -0,0 +1 @@
+from .pipeline_builder import PipelineBuilder
@@ -0,0 +1,181 @@
+import logging
+from typing import Any, ClassVar, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from pydantic.dataclasses import dataclass
+
+from app.etl_exceptions import AutoETLException
+from app.services.config_parser import GENERATED_FILTER_STEP, Filter, MetadataMapping
+from app.services.query_builder import QueryBuilder
+from app.services.query_builder.ddl import (CREATE_INSERT_OUTPUT, DATE_TYPES, NUMERIC_TYPES, SELECT_OUTPUT,
+                                            TableDesign, base_type, create_table)
+from app.services.query_builder.dialect import BaseDialect
+from app.services.query_builder.query_builder import Config
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_STRATEGIES = ('merge', 'delete-insert')
+KEY_CONSTRAINTS = ('primary key', 'unique')
+# watermark of an empty target, by type of the target watermark column
+DATE_LOW_WATERMARK = "'1900-01-01'"
+NUMERIC_LOW_WATERMARK = '-9223372036854775808'
+# the pipeline loads the target itself, it can only be preceded by its CREATE TABLE
+PIPELINE_OUTPUT_MODES = (SELECT_OUTPUT, CREATE_INSERT_OUTPUT)
+
+
+class PipelineConf(NamedTuple):
+    target_table: str
+    delta_table: str
+    keys: List[str]
+    columns: List[str]
+    watermark_column: str
+    target_watermark_column: str
+    strategy: str
+    # sql literal the watermark of an empty target falls back to
+    low_watermark: str
+
+    @classmethod
+    def from_config(cls, mapping: MetadataMapping, _config: Dict) -> 'PipelineConf':
+        """method to resolve the `pipeline` config section against the mapping
+
+        Args:
+            mapping (MetadataMapping)
+            _config (Dict): validated config
+
+        Raises:
+            AutoETLException: Exception if the pipeline can not be derived
+
+        Returns:
+            PipelineConf
+        """
+        conf = _config.get('pipeline') or {}
+        errors = []
+        target = mapping.target_table
+        if not target.name:
+            errors.append('target_table sheet has no Target_Table_Name')
+        target_table = '.'.join(
+            part for part in (target.schema_name, target.name) if part)
+
+        columns = [_select.column_alias for _select in mapping.select_columns]
+        keys = conf.get('keys') or [column.name for column in target.columns
+                                    if column.name and column.constraint
+                                    and column.constraint.lower() in KEY_CONSTRAINTS]
+        if not keys:
+            errors.append('no key columns, set a primary key Constraint in the target_table '
+                          'sheet or pipeline.keys in the config')
+        errors.extend(f'key column {key!r} is not a column_alias of the select_sources sheet'
+                      for key in keys if key not in columns)
+
+        watermark_column = conf.get('watermark_column')
+        if not watermark_column:
+            errors.append('pipeline.watermark_column is not set')
+        target_watermark_column = conf.get('target_watermark_column')
+        if target_watermark_column is None:
+            target_watermark_column = next((_select.column_alias for _select in mapping.select_columns
+                                            if _select.expression == watermark_column), None)
+        if not target_watermark_column:
+            errors.append('pipeline.target_watermark_column is not set and no select column '
+                          'reads the watermark_column as is')
+        low_watermark = _low_watermark(mapping, conf.get('low_watermark'), target_watermark_column)
+        if low_watermark is None and target_watermark_column:
+            errors.append(f'the DataType of {target_watermark_column!r} in the target_table sheet is not a date, '
+                          'timestamp or numeric type, set pipeline.low_watermark')
+
+        strategy = conf.get('strategy', 'merge')
+        if strategy not in PIPELINE_STRATEGIES:
+            errors.append(f'pipeline.strategy {strategy!r} is not one of {PIPELINE_STRATEGIES}')
+        output_mode = _config.get('output_mode', SELECT_OUTPUT)
+        if output_mode not in PIPELINE_OUTPUT_MODES:
+            errors.append(f'output_mode {output_mode!r} is not one of {PIPELINE_OUTPUT_MODES} '
+                          'with the pipeline builder')
+
+        if errors:
+            for error in errors:
+                logger.error('pipeline config - %s', error)
+            raise AutoETLException(
+                'Incremental pipeline can not be generated, please check the config', errors)
+        delta_table = conf.get('delta_table') or f'{target.name}_delta'
+        return cls(target_table, delta_table, keys, columns, watermark_column,
+                   target_watermark_column, strategy, low_watermark)
+
+
+def _low_watermark(mapping: MetadataMapping, configured: Any,
+                   target_watermark_column: Optional[str]) -> Optional[str]:
+    """sql literal of the configured low watermark, else the one of the target watermark column type"""
+    if isinstance(configured, (int, float)) and not isinstance(configured, bool):
+        return str(configured)
+    if isinstance(configured, str):
+        return "'" + configured.replace("'", "''") + "'"
+    data_type = next((base_type(column.data_type) for column in mapping.target_table.columns
+                      if column.name and target_watermark_column
+                      and column.name.lower() == target_watermark_column.lower()), None)
+    if data_type in DATE_TYPES:
+        return DATE_LOW_WATERMARK
+    if data_type in NUMERIC_TYPES:
+        return NUMERIC_LOW_WATERMARK
+    return None
+
+
+@dataclass(config=Config)
+class PipelineBuilder(QueryBuilder):
+    """Builds incremental load pipelines: the mapping query restricted to the rows past the
+    target's high watermark is staged in a delta table, then merged into the target
+    """
+    tool: ClassVar[str] = 'pipeline-builder'
+
+    def render(self, dialect: BaseDialect, _config: Dict) -> Iterable[str]:
+        """ Method to render the incremental load statements of one target
+
+        Args:
+            dialect (BaseDialect): dialect of the target, holding the mapping model
+            _config (Dict): validated config
+
+        Returns:
+            Iterable[str]: sql fragments
+        """
+        conf = PipelineConf.from_config(dialect.mapping, _config)
+        watermark_filter = Filter(
+            f"{conf.watermark_column} > (SELECT COALESCE(MAX({conf.target_watermark_column}), "
+            f"{conf.low_watermark}) FROM {conf.target_table})", GENERATED_FILTER_STEP)
+        dialect.mapping = dialect.mapping._replace(
+            filters=dialect.mapping.filters + (watermark_filter,))
+        create_statement = None
+        if _config.get('output_mode', SELECT_OUTPUT) == CREATE_INSERT_OUTPUT:
+            create_statement = create_table(TableDesign.from_config(dialect.mapping, _config, CREATE_INSERT_OUTPUT),
+                                            dialect.physical_design)
+        return self._statements(self.clause_cache.render(dialect), conf, create_statement)
+
+    def _statements(self, delta_query: Iterable[str], conf: PipelineConf,
+                    create_statement: Optional[str] = None) -> Iterator[str]:
+        strategy = conf.strategy
+        if strategy == 'merge' and all(column in conf.keys for column in conf.columns):
+            # a MERGE needs a WHEN MATCHED clause, and there is no column left to update
+            logger.info('every column of %s is a key, loading it with delete-insert instead of merge',
+                        conf.target_table)
+            strategy = 'delete-insert'
+        if create_statement:
+            yield create_statement + '\n'
+        yield f'-- incremental {strategy} load of {conf.target_table} on {conf.watermark_column}\n'
+        yield f'CREATE TEMP TABLE {conf.delta_table} AS\n'
+        yield from delta_query
+        yield ';\n\n'
+
+        join_condition = ' AND '.join(f'{conf.target_table}.{key} = {conf.delta_table}.{key}'
+                                      for key in conf.keys)
+        column_list = ', '.join(conf.columns)
+        delta_columns = ', '.join(
+            f'{conf.delta_table}.{column}' for column in conf.columns)
+
+        if strategy == 'merge':
+            updates = ',\n'.join(f'   {column} = {conf.delta_table}.{column}'
+                                 for column in conf.columns if column not in conf.keys)
+            yield f'MERGE INTO {conf.target_table}\nUSING {conf.delta_table}\n ON {join_condition}\n'
+            yield f'WHEN MATCHED THEN UPDATE SET\n{updates}\n'
+            yield f'WHEN NOT MATCHED THEN INSERT ({column_list})\n   VALUES ({delta_columns});\n\n'
+        else:
+            yield 'BEGIN;\n'
+            yield f'DELETE FROM {conf.target_table}\nUSING {conf.delta_table}\nWHERE {join_condition};\n'
+            yield f'INSERT INTO {conf.target_table} ({column_list})\nSELECT {column_list}\n' \
+                f'FROM {conf.delta_table};\n'
+            yield 'COMMIT;\n\n'
+
+        yield f'DROP TABLE {conf.delta_table};\n'
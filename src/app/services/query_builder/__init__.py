@@ -1,2 +1,27 @@
-from .dialect import RedshiftDialect
-from .query_builder import QueryBuilder
+import importlib
+from typing import Any
+
+# resolved on first access (PEP 562), so importing one submodule does not load
+# the builder and its parsers, cache and profiler
+_EXPORTS = {
+    'BaseDialect': '.dialect',
+    'PostgresDialect': '.dialect',
+    'RedshiftDialect': '.dialect',
+    'QueryBuilder': '.query_builder',
+    'get_dialect': '.registry',
+    'register_dialect': '.registry',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
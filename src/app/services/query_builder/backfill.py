@@ -0,0 +1,246 @@
+import calendar
+import datetime
+import logging
+import re
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from app.etl_exceptions import AutoETLException
+from app.services.config_parser import FLAG_VALUES, GENERATED_FILTER_STEP, Filter, MetadataMapping
+from app.utils import equi_join_pattern
+
+from .hoisting import AGGREGATE_FUNCTIONS, NULL_EXTENDING_JOIN_TYPES, conjuncts, tokenize
+from .optimizer import restrict_step
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_UNITS = ('day', 'week', 'month', 'year')
+DEFAULT_INTERVAL = '1 month'
+
+_interval_pattern = re.compile(r'\s*(\d+)\s*(day|week|month|year)s?\s*', re.IGNORECASE)
+
+
+class BackfillChunk(NamedTuple):
+    # `chunk_001`, names the output of the chunk
+    name: str
+    # sql literals of the inclusive lower and exclusive upper bound of a range chunk
+    lower: Optional[str] = None
+    upper: Optional[str] = None
+    # hash bucket of a bucket chunk
+    bucket: Optional[int] = None
+
+
+class Backfill(NamedTuple):
+    # configured driving table column, the PartitionKey column of the target_table sheet when None
+    column: Optional[str]
+    buckets: Optional[int]
+    chunks: Tuple[BackfillChunk, ...]
+    # chunks of a mapping aggregating its select list aggregate their own rows only
+    allow_aggregates: bool = False
+
+    @classmethod
+    def from_config(cls, _config: Dict) -> Optional['Backfill']:
+        """method to split the backfill of the `backfill` config section into chunks
+
+        A `start`/`end` range is cut into chunks of `interval`, a number of
+        days, weeks, months or years for dates (default `1 month`), a number
+        for integers (required). `buckets` instead chunks by hash bucket of the
+        partition column. `allow_aggregates` accepts mappings aggregating their
+        select list, each chunk then returns its own aggregates.
+
+        Args:
+            _config (Dict): validated config
+
+        Raises:
+            AutoETLException: Exception if the section does not describe a backfill
+
+        Returns:
+            Optional[Backfill]: None without a `backfill` section
+        """
+        conf = _config.get('backfill')
+        if not conf:
+            return None
+        buckets, start, end = conf.get('buckets'), conf.get('start'), conf.get('end')
+        allow_aggregates = conf.get('allow_aggregates', False)
+        errors = []
+        if not isinstance(allow_aggregates, bool):
+            errors.append(f'allow_aggregates {allow_aggregates!r} is not true or false')
+        chunks: List[BackfillChunk] = []
+        if buckets is not None:
+            if start is not None or end is not None:
+                errors.append('set either buckets or start/end')
+            elif not isinstance(buckets, int) or isinstance(buckets, bool) or buckets < 1:
+                errors.append(f'buckets {buckets!r} is not a positive integer')
+            else:
+                chunks = [BackfillChunk('', bucket=bucket) for bucket in range(buckets)]
+        elif start is None or end is None:
+            errors.append('start and end of the backfill range are missing')
+        else:
+            try:
+                chunks = [BackfillChunk('', lower, upper)
+                          for lower, upper in _range_bounds(start, end, conf.get('interval'))]
+            except ValueError as excep:
+                errors.append(str(excep))
+        if errors:
+            for error in errors:
+                logger.error('backfill - %s', error)
+            raise AutoETLException("Backfill chunks can not be generated, please check the backfill config", errors)
+
+        width = max(3, len(str(len(chunks))))
+        return cls(conf.get('column'), buckets,
+                   tuple(chunk._replace(name=f'chunk_{number:0{width}d}') for number, chunk in enumerate(chunks, 1)),
+                   allow_aggregates)
+
+    def partition_column(self, mapping: MetadataMapping) -> Tuple[str, str]:
+        """method to resolve the driving table column the chunks are bounded on
+
+        Args:
+            mapping (MetadataMapping)
+
+        Raises:
+            AutoETLException: Exception if the column is not a driving table column, or the
+                select list aggregates without `allow_aggregates`
+
+        Returns:
+            Tuple[str, str]: driving table alias and column
+        """
+        driving = mapping.driving_table_alias or ''
+        errors = []
+        if any(_step.join_type in NULL_EXTENDING_JOIN_TYPES for _step in mapping.joins):
+            errors.append('a right/full outer join keeps rows without a driving table row, '
+                          'they would be in no chunk')
+        column = self.column
+        if column is None:
+            flagged = [target.name for target in mapping.target_table.columns
+                       if target.name and (target.partition_key or '').lower() in FLAG_VALUES]
+            column = _driving_column(mapping, flagged[0]) if len(flagged) == 1 else None
+            if column is None:
+                errors.append('set backfill.column, or PartitionKey on one target_table column '
+                              'reading a driving table column as is')
+        if column is not None:
+            alias, _, column = column.rpartition('.')
+            if alias and alias.lower() != driving.lower():
+                errors.append(f'backfill column {alias}.{column} is not a column of the driving table {driving!r}')
+        # the select list is never grouped, its aggregates cover every row the query reads
+        if not self.allow_aggregates and any(token.text.lower() in AGGREGATE_FUNCTIONS
+                                             for _select in mapping.select_columns
+                                             for token in tokenize(_select.expression)):
+            errors.append('the select list aggregates every row, each chunk would return its own aggregates, '
+                          'set backfill.allow_aggregates to load them anyway')
+        if errors:
+            for error in errors:
+                logger.error('backfill - %s', error)
+            raise AutoETLException("Backfill chunks can not be generated, please check the backfill config", errors)
+        return driving, column
+
+    def chunk_mapping(self, mapping: MetadataMapping, chunk: BackfillChunk, partition: Tuple[str, str],
+                      hash_bucket: str) -> MetadataMapping:
+        """method to bound the mapping to the rows of one chunk
+
+        The chunk predicate filters the driving table. The bounds of a range
+        chunk also restrict the inner and left joins equal on the partition
+        column, in their reference_subquery or ON clause, so the joined
+        tables are read for the range only. Hash buckets of equal values
+        depend on the column types, bucket predicates stay on the driving table.
+
+        Args:
+            mapping (MetadataMapping)
+            chunk (BackfillChunk): one of `chunks`
+            partition (Tuple[str, str]): driving table alias and column, from `partition_column`
+            hash_bucket (str): bucket expression of the dialect
+
+        Returns:
+            MetadataMapping
+        """
+        driving, column = partition
+        filters = mapping.filters + (Filter(self._predicate(chunk, driving, column, hash_bucket),
+                                            GENERATED_FILTER_STEP),)
+        if chunk.bucket is not None:
+            return mapping._replace(filters=filters)
+
+        counts = Counter((_step.reference_table_alias or '').lower() for _step in mapping.joins)
+        equal: Set[Tuple[str, str]] = {(driving.lower(), column.lower())}
+        joins = list(mapping.joins)
+        for index, _step in enumerate(mapping.joins):
+            alias = (_step.reference_table_alias or '').lower()
+            if _step.join_type not in ('inner join', 'left join') or counts[alias] > 1 \
+                    or alias == driving.lower() or not _step.join_condition:
+                continue
+            predicates = []
+            for predicate in conjuncts(_step.join_condition):
+                match = equi_join_pattern.fullmatch(predicate.strip())
+                if not match:
+                    continue
+                sides = [(match.group(1), match.group(2)), (match.group(3), match.group(4))]
+                for (known, known_column), (other, other_column) in (sides, sides[::-1]):
+                    if (known.lower(), known_column.lower()) in equal and other.lower() == alias:
+                        equal.add((alias, other_column.lower()))
+                        predicates.append(self._predicate(chunk, _step.reference_table_alias, other_column,
+                                                          hash_bucket))
+            if predicates:
+                joins[index] = restrict_step(_step, list(dict.fromkeys(predicates)))
+        return mapping._replace(joins=tuple(joins), filters=filters)
+
+    def _predicate(self, chunk: BackfillChunk, alias: str, column: str, hash_bucket: str) -> str:
+        qualified = f'{alias}.{column}'
+        if chunk.bucket is not None:
+            # a NULL key hashes to NULL on some engines, it goes to the first bucket
+            bucket = hash_bucket.format(column=qualified, buckets=self.buckets)
+            return f'COALESCE({bucket}, 0) = {chunk.bucket}'
+        return f'{qualified} >= {chunk.lower} AND {qualified} < {chunk.upper}'
+
+
+def _driving_column(mapping: MetadataMapping, column_alias: str) -> Optional[str]:
+    """driving table column a select column reads as is"""
+    driving = (mapping.driving_table_alias or '').lower()
+    for _select in mapping.select_columns:
+        if (_select.column_alias or '').lower() != column_alias.lower():
+            continue
+        alias, _, column = _select.expression.strip().rpartition('.')
+        if re.fullmatch(r'[A-Za-z_]\w*', column) and \
+                (alias or _select.table_alias or '').lower() == driving:
+            return column
+    return None
+
+
+def _range_bounds(start: Any, end: Any, interval: Any) -> List[Tuple[str, str]]:
+    """sql literals of the bounds of each chunk of the range, `interval` is None when not configured"""
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in (start, end)):
+        # no default fits every integer range, a key range may hold ten values or ten billions
+        if interval is None:
+            raise ValueError('interval of an integer range is missing, set the number of values per chunk')
+        if not isinstance(interval, int) or isinstance(interval, bool) or interval < 1:
+            raise ValueError(f'interval {interval!r} of an integer range is not a positive integer')
+        if start >= end:
+            raise ValueError(f'start {start} is not before end {end}')
+        return [(str(lower), str(min(lower + interval, end))) for lower in range(start, end, interval)]
+
+    try:
+        first, last = datetime.date.fromisoformat(str(start)), datetime.date.fromisoformat(str(end))
+    except ValueError:
+        raise ValueError(f'start {start!r} and end {end!r} are neither integers nor YYYY-MM-DD dates')
+    if interval is None:
+        interval = DEFAULT_INTERVAL
+    match = _interval_pattern.fullmatch(str(interval))
+    if not match or int(match.group(1)) < 1:
+        raise ValueError(f'interval {interval!r} is not `<n> {"|".join(INTERVAL_UNITS)}`')
+    if first >= last:
+        raise ValueError(f'start {first} is not before end {last}')
+    count, unit = int(match.group(1)), match.group(2).lower()
+    bounds, lower, step = [], first, 1
+    while lower < last:
+        if unit in ('day', 'week'):
+            upper = first + datetime.timedelta(days=count * step * (7 if unit == 'week' else 1))
+        else:
+            upper = _add_months(first, count * step * (12 if unit == 'year' else 1))
+        upper = min(upper, last)
+        bounds.append((f"'{lower.isoformat()}'", f"'{upper.isoformat()}'"))
+        lower, step = upper, step + 1
+    return bounds
+
+
+def _add_months(day: datetime.date, months: int) -> datetime.date:
+    # the 31st of a month steps to the last day of shorter months
+    year, month = divmod(day.month - 1 + months, 12)
+    year, month = day.year + year, month + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
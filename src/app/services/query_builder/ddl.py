@@ -0,0 +1,249 @@
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.etl_exceptions import AutoETLException
+from app.services.config_parser import FLAG_VALUES, MetadataMapping, TargetColumn
+from app.utils import equi_join_pattern
+
+from .hoisting import conjuncts
+
+logger = logging.getLogger(__name__)
+
+SELECT_OUTPUT = 'select'
+CREATE_INSERT_OUTPUT = 'create_insert'
+CTAS_OUTPUT = 'ctas'
+INSERT_OUTPUT = 'insert'
+OUTPUT_MODES = (SELECT_OUTPUT, CREATE_INSERT_OUTPUT, CTAS_OUTPUT, INSERT_OUTPUT)
+DIST_STYLES = ('auto', 'even', 'key', 'all')
+SORT_STYLES = ('compound', 'interleaved')
+# az64 compresses numeric and date/time columns best, zstd the others
+AZ64_TYPES = ('smallint', 'int2', 'integer', 'int', 'int4', 'bigint', 'int8', 'decimal', 'numeric',
+              'date', 'timestamp', 'timestamptz', 'time', 'timetz')
+RAW_TYPES = ('boolean', 'bool')
+DATE_TYPES = ('date', 'timestamp', 'timestamptz')
+NUMERIC_TYPES = ('smallint', 'int2', 'integer', 'int', 'int4', 'bigint', 'int8', 'decimal', 'numeric',
+                 'real', 'float4', 'float', 'float8', 'double')
+
+
+class TableDesign(NamedTuple):
+    table: str
+    # target_table sheet columns, created by `create_insert`
+    columns: Tuple[TargetColumn, ...]
+    # column_alias of the select columns, in select order
+    insert_columns: Tuple[str, ...]
+    dist_style: str
+    dist_key: Optional[str]
+    sort_style: str
+    sort_keys: Tuple[str, ...]
+    # lower cased column -> encoding
+    encodings: Dict[str, str]
+
+    @classmethod
+    def from_config(cls, mapping: MetadataMapping, _config: Dict, output_mode: str) -> 'TableDesign':
+        """method to resolve the physical design of the target table
+
+        Settings of the `ddl` config section win over the target_table sheet,
+        missing ones are inferred: the distribution key from the driving table
+        column the joins use most, the sort keys from the pipeline watermark,
+        a date column or the primary key, the encodings from the data types.
+
+        Args:
+            mapping (MetadataMapping)
+            _config (Dict): validated config
+            output_mode (str): one of `OUTPUT_MODES`
+
+        Raises:
+            AutoETLException: Exception if the DDL can not be derived
+
+        Returns:
+            TableDesign
+        """
+        conf = _config.get('ddl') or {}
+        errors = []
+        target = mapping.target_table
+        if output_mode not in OUTPUT_MODES:
+            errors.append(f'output_mode {output_mode!r} is not one of {OUTPUT_MODES}')
+        if not target.name:
+            errors.append('target_table sheet has no Target_Table_Name')
+        table = '.'.join(part for part in (target.schema_name, target.name) if part)
+
+        columns = tuple(column for column in target.columns if column.name)
+        insert_columns = tuple(_select.column_alias for _select in mapping.select_columns
+                               if _select.column_alias)
+        if output_mode == CREATE_INSERT_OUTPUT:
+            declared = {column.name.lower() for column in columns}
+            errors.extend(f'column {column.name!r} of the target_table sheet has no DataType'
+                          for column in columns if not column.data_type)
+            errors.extend(f'column_alias {alias!r} is not a column of the target_table sheet'
+                          for alias in insert_columns if alias.lower() not in declared)
+            names = [column.name for column in columns]
+        else:
+            names = list(insert_columns)
+        by_name = {name.lower(): name for name in names}
+
+        dist_style = (conf.get('dist_style') or target.dist_style or '').lower()
+        dist_key = conf.get('dist_key') or next(
+            (column.name for column in columns if (column.dist_key or '').lower() in FLAG_VALUES), None)
+        if dist_key is None and dist_style in ('', 'key'):
+            dist_key = _join_key_column(mapping)
+            if dist_key is not None and dist_key.lower() not in by_name:
+                dist_key = None
+        dist_style = dist_style or ('key' if dist_key else 'auto')
+        if dist_style not in DIST_STYLES:
+            errors.append(f'dist style {dist_style!r} is not one of {DIST_STYLES}')
+        if dist_style == 'key' and not dist_key:
+            errors.append('DISTSTYLE KEY needs a DistKey column or ddl.dist_key')
+        if dist_style != 'key':
+            dist_key = None
+
+        sort_style = (conf.get('sort_style') or 'compound').lower()
+        if sort_style not in SORT_STYLES:
+            errors.append(f'ddl.sort_style {sort_style!r} is not one of {SORT_STYLES}')
+        sort_keys = list(conf.get('sort_keys') or _sheet_sort_keys(columns)) or \
+            _inferred_sort_keys(columns, _config, by_name)
+
+        for key in [dist_key, *sort_keys]:
+            if key and key.lower() not in by_name:
+                errors.append(f'key column {key!r} is not a column of the target table')
+
+        if errors:
+            for error in errors:
+                logger.error('target table ddl - %s', error)
+            raise AutoETLException(
+                "Target table DDL can not be generated, please check the target_table sheet and the ddl config",
+                errors)
+
+        sort_key_names = {key.lower() for key in sort_keys}
+        declared_encodings = {column.lower(): encoding for column, encoding in (conf.get('encodings') or {}).items()}
+        encodings = {}
+        for column in columns:
+            name = column.name.lower()
+            encodings[name] = (declared_encodings.get(name) or column.encoding
+                               or _inferred_encoding(column.data_type, name in sort_key_names)).lower()
+        return cls(table, columns, insert_columns, dist_style, by_name.get((dist_key or '').lower(), dist_key),
+                   sort_style, tuple(by_name[key.lower()] for key in sort_keys), encodings)
+
+
+def _join_key_column(mapping: MetadataMapping) -> Optional[str]:
+    """column_alias reading as is the driving table column the equi joins use most"""
+    driving = (mapping.driving_table_alias or '').lower()
+    counts: Counter = Counter()
+    for _step in mapping.joins:
+        for predicate in conjuncts(_step.join_condition or ''):
+            match = equi_join_pattern.fullmatch(predicate.strip())
+            if not match:
+                continue
+            sides = [(match.group(1).lower(), match.group(2).lower()), (match.group(3).lower(), match.group(4).lower())]
+            for (alias, column), (other, _) in (sides, sides[::-1]):
+                if alias == driving and other != driving:
+                    counts[column] += 1
+    for column, _ in counts.most_common():
+        for _select in mapping.select_columns:
+            expression = _select.expression.strip().lower()
+            if expression == f'{driving}.{column}' or \
+                    (expression == column and (_select.table_alias or '').lower() == driving):
+                return _select.column_alias
+    return None
+
+
+def _sheet_sort_keys(columns: Iterable[TargetColumn]) -> List[str]:
+    """columns with a SortKey, by their position number, flagged ones in sheet order"""
+    keyed = []
+    for index, column in enumerate(columns):
+        value = (column.sort_key or '').strip().lower()
+        if value.isdigit() and int(value) > 0:
+            keyed.append((int(value), index, column.name))
+        elif value in FLAG_VALUES:
+            keyed.append((math.inf, index, column.name))
+    return [name for _, _, name in sorted(keyed)]
+
+
+def _inferred_sort_keys(columns: Tuple[TargetColumn, ...], _config: Dict, by_name: Dict[str, str]) -> List[str]:
+    """the watermark column of the pipeline, else the first date column, else the primary key"""
+    watermark = (_config.get('pipeline') or {}).get('target_watermark_column')
+    if watermark and watermark.lower() in by_name:
+        return [watermark]
+    for column in columns:
+        if base_type(column.data_type) in DATE_TYPES and column.name.lower() in by_name:
+            return [column.name]
+    return [column.name for column in columns
+            if (column.constraint or '').lower() == 'primary key' and column.name.lower() in by_name]
+
+
+def base_type(data_type: Optional[str]) -> str:
+    """lower cased data type without its length, precision or time zone, e.g. `timestamp`"""
+    return re.split(r'[\s(]', (data_type or '').strip().lower(), maxsplit=1)[0]
+
+
+def _inferred_encoding(data_type: Optional[str], sort_key: bool) -> str:
+    # compressed sort key columns make range restricted scans read more blocks
+    if sort_key or base_type(data_type) in RAW_TYPES:
+        return 'raw'
+    if base_type(data_type) in AZ64_TYPES:
+        return 'az64'
+    return 'zstd'
+
+
+def create_table(design: TableDesign, physical_design: bool, if_not_exists: bool = True) -> str:
+    """method to generate the CREATE TABLE statement of the target table
+
+    Args:
+        design (TableDesign)
+        physical_design (bool): add the DISTSTYLE/DISTKEY/SORTKEY and ENCODE clauses
+        if_not_exists (bool): keep an existing table
+
+    Returns:
+        str: statement, ending with `;`
+    """
+    definitions = []
+    for column in design.columns:
+        definition = f'   {column.name} {column.data_type}'
+        if physical_design:
+            definition += f' ENCODE {design.encodings[column.name.lower()]}'
+        if column.constraint:
+            definition += f' {column.constraint.upper()}'
+        definitions.append(definition)
+    exists = 'IF NOT EXISTS ' if if_not_exists else ''
+    lines = [f'CREATE TABLE {exists}{design.table} (', ',\n'.join(definitions), ')',
+             *_table_attributes(design, physical_design)]
+    return '\n'.join(lines) + ';\n'
+
+
+def _table_attributes(design: TableDesign, physical_design: bool) -> List[str]:
+    if not physical_design:
+        return []
+    lines = [f'DISTSTYLE {design.dist_style.upper()}']
+    if design.dist_key:
+        lines.append(f'DISTKEY ({design.dist_key})')
+    if design.sort_keys:
+        lines.append(f'{design.sort_style.upper()} SORTKEY ({", ".join(design.sort_keys)})')
+    return lines
+
+
+def table_statements(select_query: Iterable[str], design: TableDesign, output_mode: str,
+                     physical_design: bool) -> Iterator[str]:
+    """method to wrap the generated select into the statements loading the target table
+
+    Args:
+        select_query (Iterable[str]): sql fragments of the select
+        design (TableDesign)
+        output_mode (str): `create_insert`, `ctas` or `insert`
+        physical_design (bool): add the DISTSTYLE/DISTKEY/SORTKEY and ENCODE clauses
+
+    Returns:
+        Iterator[str]: sql fragments
+    """
+    column_list = ', '.join(design.insert_columns)
+    if output_mode == CTAS_OUTPUT:
+        yield f'CREATE TABLE {design.table}\n'
+        yield ''.join(line + '\n' for line in _table_attributes(design, physical_design))
+        yield 'AS\n'
+    else:
+        if output_mode == CREATE_INSERT_OUTPUT:
+            yield create_table(design, physical_design) + '\n'
+        yield f'INSERT INTO {design.table} ({column_list})\n'
+    yield from select_query
+    yield ';\n'
@@ -1,13 +1,17 @@
 import functools
 import logging
+import re
 import textwrap
 from collections import defaultdict
-from typing import (Any, Callable, Dict, Iterable, List, Mapping, NamedTuple,
-                    Optional, Sequence, Tuple, TypeVar, Union)
+from typing import (Any, Callable, ClassVar, Dict, Iterable, List, Mapping,
+                    NamedTuple, Optional, Sequence, Tuple, TypeVar, Union)
 
 from pydantic.dataclasses import dataclass
 
 from app.etl_exceptions import AutoETLException
+from app.services.config_parser import MetadataMapping, SelectColumn
+
+from .registry import register_dialect
 
 logger = logging.getLogger(__name__)
 
@@ -56,9 +60,18 @@ class _FlagList(List[_T]):
 
 
 def _clean_up(thing: str) -> str:
+    # dedent only matters for multiline values, most values are single line
+    if '\n' not in thing:
+        return thing.strip()
     return textwrap.dedent(thing.rstrip()).strip()
 
 
+def _indent(text: str, prefix: str) -> str:
+    if '\n' not in text:
+        return prefix + text if text.strip() else text
+    return textwrap.indent(text=text, prefix=prefix)
+
+
 class BaseQuery:
 
     keywords = [
@@ -175,62 +188,113 @@ class BaseQuery:
                 yield from self._lines_keyword(keyword, group)
 
     def _lines_keyword(self, keyword: str, things: Sequence[QueryValue]) -> Iterable[str]:
-        for i, thing in enumerate(things):
-            last = i + 1 == len(things)
-
-            if thing.keyword:
-                yield thing.keyword + '\n'
+        """yields one fragment per value, the formats and separator are resolved once per keyword
+        """
+        if not things:
+            return
+        formats = (self.formats[0][keyword], self.formats[1][keyword])
+        try:
+            separator = ' ' + self.separators[keyword] + '\n'
+        except KeyError:
+            separator = self.default_separator + '\n'
+        last = len(things) - 1
 
-            _format = self.formats[bool(thing.alias)][keyword]
+        for i, thing in enumerate(things):
             value = thing.value
-
             if thing.is_subquery:
-                value = f'(\n{textwrap.indent(text=value, prefix="    ")}\n)'
+                value = '(\n' + _indent(value, '    ') + '\n)'
 
-            yield textwrap.indent(text=_format.format(value=value, alias=thing.alias), prefix='   ')
+            _format = formats[bool(thing.alias)]
+            if _format == '{value}':
+                text = value
+            elif _format == '{value} AS {alias}':
+                text = value + ' AS ' + thing.alias
+            else:
+                text = _format.format(value=value, alias=thing.alias)
+            text = _indent(text, '   ')
 
+            if thing.keyword:
+                text = thing.keyword + '\n' + text
             if thing.on_condn:
-                yield '\n ON '+thing.on_condn
+                text += '\n ON ' + thing.on_condn
 
-            if not last and not thing.keyword:
-                try:
-                    yield ' ' + self.separators[keyword]
-                except KeyError:
-                    yield self.default_separator
-
-            yield '\n'
+            if i != last and not thing.keyword:
+                yield text + separator
+            else:
+                yield text + '\n'
 
 
 @dataclass()
-class RedshiftDialect:
-    target_table_conf: List[Dict]
-    joins_and_filters_conf: Dict[str, Dict]
-    select_sources: List[Dict]
+class BaseDialect:
+    """Walks the mapping model into a BaseQuery, subclasses adapt the sql text to their engine
+    """
+    name: ClassVar[str] = ''
+    # the engine takes DISTSTYLE/DISTKEY/SORTKEY and column ENCODE clauses
+    physical_design: ClassVar[bool] = False
+    # expression placing a row in one of `buckets` hash buckets of a column
+    hash_bucket: ClassVar[str] = 'MOD(ABS(FNV_HASH({column})), {buckets})'
+    mapping: MetadataMapping
+
+    def get_sql(self) -> str:
+        """Method to trrigger the query builder
 
-    def get_sql(self) -> None:
-        """Method to trrigger Redshift query builder
+        Returns:
+            str: generated sql statement
         """
-        logger.info('building Redshift query from the mappings file')
+        return str(self.get_query())
+
+    def get_query(self) -> BaseQuery:
+        """Method to build the query, to be rendered or streamed by the caller
+
+        Returns:
+            BaseQuery
+        """
+        logger.info('building %s query from the mappings file', self.name)
 
         _query = BaseQuery()
-        _query = self.get_select(_query, self.select_sources)
+        _query = self.get_with(_query)
+        _query = self.get_select(_query, self.mapping.select_columns)
         _query = self.get_join(_query)
-        print(str(_query))
+        return _query
+
+    def translate(self, text: str) -> str:
+        """method to adapt an expression or condition written in the mapping to the dialect
+
+        Args:
+            text (str): sql text from the mapping
+
+        Returns:
+            str
+        """
+        return text
+
+    def get_with(self, _query: BaseQuery) -> BaseQuery:
+        """method to generate the WITH clauses hoisted by the optimizer
+
+        Args:
+            _query (BaseQuery)
 
-    def get_select(self, _query: BaseQuery, select_sources: List[Dict]) -> BaseQuery:
+        Returns:
+            BaseQuery
+        """
+        for name, text in self.mapping.ctes:
+            _query = _query.WITH((name, self.translate(text)))
+        return _query
+
+    def get_select(self, _query: BaseQuery, select_columns: Sequence[SelectColumn]) -> BaseQuery:
         """method to generate the select sql
 
         Args:
             _query (BaseQuery)
-            select_sources (List[Dict]): mapping file dictionary
+            select_columns (Sequence[SelectColumn]): select columns of the mapping
 
         Returns:
             BaseQuery
         """
         try:
-            for _select in select_sources:
+            for _select in select_columns:
                 _query = _query.SELECT(
-                    (_select['column_alias'], _select['transformation']))
+                    (_select.column_alias, self.translate(_select.expression)))
 
             return _query
         except Exception as excep:
@@ -247,38 +311,54 @@ class RedshiftDialect:
         Returns:
             BaseQuery
         """
-        for _index in self.joins_and_filters_conf:
-
-            _map = self.joins_and_filters_conf[_index]
-
-            if int(_index) == 0:
+        _query = _query.FROM(
+            (self.mapping.driving_table_alias, self.mapping.driving_table))
 
-                _query = _query.FROM(
-                    (_map['driving_table_alias'], _map['driving_table']))
+        for _step in self.mapping.joins:
+            _join = (_step.reference_table_alias,
+                     _step.reference, self.translate(_step.join_condition or ''))
 
-            if _map['reference_subquery']:
-                ref_table = '('+_map['reference_subquery']+')'
-            else:
-                ref_table = _map['reference_table']
-
-            match _map['join_type']:
+            match _step.join_type:
                 case "left join":
-                    _query = _query.LEFT_JOIN(
-                        (_map['reference_table_alias'], ref_table, _map['join_condition']))
+                    _query = _query.LEFT_JOIN(_join)
                 case "right join":
-                    _query = _query.RIGHT_JOIN(
-                        (_map['reference_table_alias'], ref_table, _map['join_condition']))
+                    _query = _query.RIGHT_JOIN(_join)
                 case "inner join":
-                    _query = _query.INNER_JOIN(
-                        (_map['reference_table_alias'], ref_table, _map['join_condition']))
+                    _query = _query.INNER_JOIN(_join)
                 case "full outer join":
-                    _query = _query.FULL_OUTER_JOIN(
-                        (_map['reference_table_alias'], ref_table, _map['join_condition']))
+                    _query = _query.FULL_OUTER_JOIN(_join)
                 case "cross join":
-                    _query = _query.CROSS_JOIN(
-                        (_map['reference_table_alias'], ref_table, _map['join_condition']))
+                    _query = _query.CROSS_JOIN(_join)
 
-            if _map['filter_condition']:
-                _query = _query.WHERE(_map['filter_condition'])
+        for _filter in self.mapping.filters:
+            _query = _query.WHERE(self.translate(_filter.condition))
 
         return _query
+
+
+@register_dialect('redshift')
+@dataclass()
+class RedshiftDialect(BaseDialect):
+    """The mappings are written in Redshift sql, the text is used as is
+    """
+    physical_design: ClassVar[bool] = True
+
+
+@register_dialect('postgres')
+@dataclass()
+class PostgresDialect(BaseDialect):
+    """Rewrites the Redshift specific functions of the mappings to their Postgres equivalents
+    """
+    functions: ClassVar[Mapping[str, str]] = {
+        'nvl': 'coalesce',
+        'getdate': 'now',
+        'len': 'length',
+    }
+    _function_pattern: ClassVar[re.Pattern] = re.compile(
+        r'\b(' + '|'.join(functions) + r')\s*\(', re.IGNORECASE)
+    # the modulo is taken first, ABS of the smallest integer overflows
+    hash_bucket: ClassVar[str] = 'ABS(MOD(HASHTEXT(CAST({column} AS TEXT)), {buckets}))'
+
+    def translate(self, text: str) -> str:
+        return self._function_pattern.sub(
+            lambda match: self.functions[match.group(1).lower()] + '(', text)
@@ -0,0 +1,335 @@
+import logging
+import re
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from app.services.config_parser import MetadataMapping
+
+from .dialect import BaseQuery
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_REPEATS = 2
+# WITH clauses holding a reference_subquery used by several joins
+SUBQUERY_CTE_PREFIX = '_subquery_'
+
+_token_pattern = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[A-Za-z_][\w$]*|\d+(?:\.\d*)?|::|\S")
+
+# computed over many rows, they can not move into a per row derived column
+AGGREGATE_FUNCTIONS = {
+    'sum', 'avg', 'count', 'min', 'max', 'any_value', 'listagg', 'median', 'percentile_cont',
+    'percentile_disc', 'approximate', 'stddev', 'stddev_samp', 'stddev_pop', 'variance',
+    'var_samp', 'var_pop', 'bool_and', 'bool_or', 'bit_and', 'bit_or', 'string_agg', 'array_agg',
+}
+# evaluated once per reference, sharing one value would change the result
+VOLATILE_FUNCTIONS = {'random', 'rand', 'newid', 'uuid', 'gen_random_uuid', 'nextval'}
+SQL_KEYWORDS = {
+    'case', 'when', 'then', 'else', 'end', 'and', 'or', 'not', 'null', 'is', 'in', 'like',
+    'ilike', 'similar', 'to', 'escape', 'between', 'as', 'distinct', 'true', 'false', 'interval',
+}
+# a derived column of a null extended table would read NULL where the inline
+# expression is evaluated on NULL inputs, e.g. coalesce(t.col, 0)
+NULL_EXTENDED_JOIN_TYPES = ('left join',)
+# these null extend the tables joined before them, including the driving table
+NULL_EXTENDING_JOIN_TYPES = ('right join', 'full outer join')
+
+
+class Token(NamedTuple):
+    text: str
+    start: int
+    end: int
+
+
+def tokenize(text: str) -> List[Token]:
+    """method to split sql text into quoted strings, identifiers, numbers and symbols
+
+    Args:
+        text (str): sql expression or condition
+
+    Returns:
+        List[Token]
+    """
+    return [Token(match.group(), match.start(), match.end()) for match in _token_pattern.finditer(text)]
+
+
+class _Span(NamedTuple):
+    start: int
+    end: int
+    key: str
+    # lower cased alias of the only table the span reads, None when it can not be hoisted
+    alias: Optional[str]
+
+
+def hoist_subqueries(mapping: MetadataMapping) -> MetadataMapping:
+    """method to move the reference subqueries used by several joins into WITH clauses
+
+    Subqueries calling volatile functions are left in place, each join reads
+    its own evaluation of them.
+
+    Args:
+        mapping (MetadataMapping)
+
+    Returns:
+        MetadataMapping
+    """
+    counts = Counter(' '.join(_step.reference_subquery.split())
+                     for _step in mapping.joins if _step.reference_subquery
+                     and not any(token.text.lower() in VOLATILE_FUNCTIONS
+                                 for token in tokenize(_step.reference_subquery)))
+    names: Dict[str, str] = {}
+    ctes = list(mapping.ctes)
+    for _step in mapping.joins:
+        if not _step.reference_subquery:
+            continue
+        key = ' '.join(_step.reference_subquery.split())
+        if counts[key] > 1 and key not in names:
+            names[key] = f'{SUBQUERY_CTE_PREFIX}{len(names) + 1}'
+            ctes.append((names[key], _step.reference_subquery))
+    if not names:
+        return mapping
+    logger.info('hoisted %d repeated reference subqueries into WITH clauses', len(names))
+    joins = tuple(_step._replace(reference_table=names[' '.join(_step.reference_subquery.split())],
+                                 reference_subquery=None)
+                  if _step.reference_subquery and ' '.join(_step.reference_subquery.split()) in names
+                  else _step
+                  for _step in mapping.joins)
+    return mapping._replace(joins=joins, ctes=tuple(ctes))
+
+
+def hoist_expressions(mapping: MetadataMapping, min_repeats: int = DEFAULT_MIN_REPEATS) -> MetadataMapping:
+    """method to compute the expressions repeated across the select list once per row
+
+    A repeated, row level expression reading a single table is moved into a
+    WITH clause selecting the table with the expression as a derived column,
+    and the select list reads the derived column. Only tables whose rows are
+    never null extended by an outer join are rewritten, aggregates, window
+    and volatile functions are left in place.
+
+    Args:
+        mapping (MetadataMapping)
+        min_repeats (int): occurrences from which an expression is hoisted
+
+    Returns:
+        MetadataMapping
+    """
+    references = _hoistable_references(mapping)
+    if not references:
+        return mapping
+
+    spans = [_spans(_select.expression, set(references)) for _select in mapping.select_columns]
+    counts = Counter(span.key for expression_spans in spans for span in expression_spans
+                     if span.alias is not None)
+
+    # outermost expressions first, an inner one only counts where it is not hoisted as part of another
+    covered: List[List[Tuple[int, int]]] = [[] for _ in spans]
+    columns: Dict[str, Tuple[str, str, str]] = {}
+    for key in sorted(counts, key=len, reverse=True):
+        if counts[key] < min_repeats:
+            continue
+        free = [(index, span) for index, expression_spans in enumerate(spans)
+                for span in expression_spans
+                if span.key == key and not _overlaps(span, covered[index])]
+        if len(free) < min_repeats:
+            continue
+        index, first = free[0]
+        columns[key] = (first.alias, f'_cse_{len(columns) + 1}',
+                        mapping.select_columns[index].expression[first.start:first.end])
+        for index, span in free:
+            covered[index].append((span.start, span.end))
+
+    if not columns:
+        return mapping
+
+    select_columns = []
+    for index, (_select, expression_spans) in enumerate(zip(mapping.select_columns, spans)):
+        expression = _select.expression
+        replaced = sorted((span for span in expression_spans
+                           if span.key in columns and (span.start, span.end) in covered[index]),
+                          key=lambda span: span.start, reverse=True)
+        for span in replaced:
+            alias, column, _ = columns[span.key]
+            expression = expression[:span.start] + \
+                f'{references[alias][0]}.{column}' + expression[span.end:]
+        select_columns.append(_select._replace(expression=expression) if replaced else _select)
+
+    ctes = list(mapping.ctes)
+    cte_names: Dict[str, str] = {}
+    for alias in dict.fromkeys(alias for alias, _, _ in columns.values()):
+        written_alias, reference = references[alias]
+        _query = BaseQuery().SELECT(f'{written_alias}.*', *[(column, text) for key_alias, column, text
+                                                            in columns.values() if key_alias == alias])
+        cte_names[alias] = f'_cse_{written_alias}'
+        ctes.append((cte_names[alias], str(_query.FROM((written_alias, reference))).rstrip('\n')))
+    logger.info('hoisted %d repeated expressions into WITH clauses of %s',
+                len(columns), list(cte_names.values()))
+
+    driving_table = mapping.driving_table
+    if (mapping.driving_table_alias or '').lower() in cte_names:
+        driving_table = cte_names[mapping.driving_table_alias.lower()]
+    joins = tuple(_step._replace(reference_table=cte_names[(_step.reference_table_alias or '').lower()],
+                                 reference_subquery=None)
+                  if (_step.reference_table_alias or '').lower() in cte_names else _step
+                  for _step in mapping.joins)
+    return mapping._replace(driving_table=driving_table, joins=joins,
+                            select_columns=tuple(select_columns), ctes=tuple(ctes))
+
+
+def _hoistable_references(mapping: MetadataMapping) -> Dict[str, Tuple[str, str]]:
+    # lower cased alias -> (alias as written, table or parenthesised subquery)
+    if any(_step.join_type in NULL_EXTENDING_JOIN_TYPES for _step in mapping.joins):
+        return {}
+    references = {}
+    if mapping.driving_table_alias and mapping.driving_table:
+        references[mapping.driving_table_alias.lower()] = (mapping.driving_table_alias, mapping.driving_table)
+    for _step in mapping.joins:
+        if _step.reference_table_alias and _step.reference and _step.join_type not in NULL_EXTENDED_JOIN_TYPES:
+            references[_step.reference_table_alias.lower()] = (_step.reference_table_alias, _step.reference)
+    return references
+
+
+def _overlaps(span: _Span, ranges: List[Tuple[int, int]]) -> bool:
+    return any(span.start < end and start < span.end for start, end in ranges)
+
+
+def _spans(expression: str, aliases: Set[str]) -> List[_Span]:
+    """method to list the function calls, CASE expressions and the whole expression as hoisting candidates"""
+    tokens = tokenize(expression)
+    bounds = [(0, len(tokens) - 1)] if tokens else []
+    for i, token in enumerate(tokens):
+        lowered = token.text.lower()
+        if i + 1 < len(tokens) and tokens[i + 1].text == '(' and token.text[0].isalpha():
+            close = _matching(tokens, i + 1, '(', ')')
+        elif lowered == 'case':
+            close = _matching(tokens, i, 'case', 'end')
+        else:
+            continue
+        if close is not None and (i, close) not in bounds:
+            bounds.append((i, close))
+
+    spans = []
+    for first, last in bounds:
+        followed_by = tokens[last + 1].text.lower() if last + 1 < len(tokens) else ''
+        # a bare `alias.column` is as cheap to read as the derived column
+        alias = None if followed_by == 'over' or last - first < 3 else \
+            single_alias(tokens[first:last + 1], aliases)
+        spans.append(_Span(tokens[first].start, tokens[last].end,
+                           ' '.join(token.text for token in tokens[first:last + 1]), alias))
+    return spans
+
+
+def _matching(tokens: List[Token], start: int, opening: str, closing: str) -> Optional[int]:
+    depth = 0
+    for i in range(start, len(tokens)):
+        lowered = tokens[i].text.lower()
+        if lowered == opening:
+            depth += 1
+        elif lowered == closing:
+            depth -= 1
+            if depth == 0:
+                return i
+    return None
+
+
+def unqualified_columns(text: str) -> Set[str]:
+    """lower cased identifiers read as columns without an alias"""
+    tokens = tokenize(text)
+    columns = set()
+    for i, token in enumerate(tokens):
+        if not (token.text[0].isalpha() or token.text[0] == '_'):
+            continue
+        lowered = token.text.lower()
+        previous = tokens[i - 1].text.lower() if i > 0 else ''
+        following = tokens[i + 1].text if i + 1 < len(tokens) else ''
+        if following in ('(', '.') or previous in ('.', 'as', '::') or lowered in SQL_KEYWORDS:
+            continue
+        columns.add(lowered)
+    return columns
+
+
+def single_alias(tokens: List[Token], aliases: Set[str]) -> Optional[str]:
+    """alias of the only table the tokens read, None if they read anything else or can not be hoisted"""
+    found: Set[str] = set()
+    for i, token in enumerate(tokens):
+        if not (token.text[0].isalpha() or token.text[0] in '_"'):
+            continue
+        lowered = token.text.lower()
+        previous = tokens[i - 1].text.lower() if i > 0 else ''
+        following = tokens[i + 1].text if i + 1 < len(tokens) else ''
+        if following == '(':
+            if lowered in AGGREGATE_FUNCTIONS or lowered in VOLATILE_FUNCTIONS:
+                return None
+        elif following == '.':
+            found.add(lowered)
+        elif previous in ('.', 'as', '::') or lowered in SQL_KEYWORDS:
+            continue
+        else:
+            # window clause, subquery or column of an unknown table
+            return None
+    if len(found) != 1 or not found <= aliases:
+        return None
+    return found.pop()
+
+
+def conjuncts(condition: str) -> List[str]:
+    """method to split a condition into the predicates it ANDs together at its top level
+
+    The AND of a BETWEEN does not split, parentheses around a whole predicate are dropped.
+
+    Args:
+        condition (str): filter or join condition
+
+    Returns:
+        List[str]: predicates, the whole condition when it can not be split
+    """
+    tokens = tokenize(condition)
+    parts, start, depth, between = [], 0, 0, False
+    for token in tokens:
+        lowered = token.text.lower()
+        if token.text == '(':
+            depth += 1
+        elif token.text == ')':
+            depth -= 1
+        elif depth == 0 and lowered == 'between':
+            between = True
+        elif depth == 0 and lowered == 'and':
+            if between:
+                between = False
+                continue
+            parts.append(condition[start:token.start].strip())
+            start = token.end
+    parts.append(condition[start:].strip())
+    if any(not part for part in parts):
+        return [condition.strip()]
+    return [_unwrapped(part) for part in parts]
+
+
+def _unwrapped(predicate: str) -> str:
+    """predicate without the parentheses around all of it"""
+    tokens = tokenize(predicate)
+    while len(tokens) > 2 and tokens[0].text == '(' and tokens[-1].text == ')':
+        depth = 0
+        for i, token in enumerate(tokens):
+            depth += token.text == '('
+            depth -= token.text == ')'
+            if depth == 0:
+                break
+        if i != len(tokens) - 1:
+            break
+        predicate = predicate[tokens[0].end:tokens[-1].start].strip()
+        tokens = tokenize(predicate)
+    return predicate
+
+
+def grouped(predicate: str) -> str:
+    """method to parenthesise a predicate with an OR that an added AND would bind into
+
+    Args:
+        predicate (str)
+
+    Returns:
+        str
+    """
+    if any(token.text.lower() == 'or' for token in tokenize(predicate)):
+        return f'({predicate})'
+    return predicate
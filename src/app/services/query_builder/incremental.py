@@ -0,0 +1,95 @@
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from .dialect import BaseDialect, BaseQuery
+
+logger = logging.getLogger(__name__)
+
+# clauses rendering to more characters are streamed through and rendered again on the next build
+MAX_CACHED_CLAUSE_SIZE = 1 << 20
+
+
+def _digest(parts: Iterable[Any]) -> str:
+    """digest of the mapping parts of a clause, one sequence of rows per part hashed row by row"""
+    digest = hashlib.sha256()
+    for part in parts:
+        rows = part if isinstance(part, tuple) and not hasattr(part, '_fields') else (part,)
+        for row in rows:
+            digest.update(repr(row).encode())
+            digest.update(b'\0')
+        digest.update(b'\1')
+    return digest.hexdigest()
+
+
+class ClauseCache:
+    """Keeps the rendered fragments of each clause with a digest of the mapping parts they were rendered from
+
+    BaseQuery renders every keyword on its own, so the statement is the WITH,
+    SELECT and FROM/JOIN/WHERE clauses one after the other. After an edit only
+    the clauses whose mapping parts changed are rendered again and spliced
+    between the cached ones. The fragments are yielded as they are rendered,
+    and only clauses up to `MAX_CACHED_CLAUSE_SIZE` characters are kept, so
+    neither the statement nor the persisted state grows with the output size.
+    """
+
+    def __init__(self) -> None:
+        # (dialect class, clause) -> (digest of the mapping parts, rendered fragments, None when too large)
+        self.clauses: Dict[Tuple[type, str], Tuple[str, Optional[Tuple[str, ...]]]] = {}
+        # mapping parts of the last render of each clause, unchanged sheets keep their model
+        # objects, so an identical part is not hashed again
+        self._parts: Dict[Tuple[type, str], Tuple[Any, str]] = {}
+
+    def render(self, dialect: BaseDialect) -> Iterator[str]:
+        """method to render the query of a dialect, reusing the clauses of the previous render
+
+        Dialects overriding `get_query` build their own statement and are
+        always rendered whole.
+
+        Args:
+            dialect (BaseDialect)
+
+        Returns:
+            Iterator[str]: sql fragments
+        """
+        if type(dialect).get_query is not BaseDialect.get_query:
+            yield from dialect.get_query()._lines()
+            return
+
+        logger.info('building %s query from the mappings file', dialect.name)
+        mapping = dialect.mapping
+        clauses: Tuple[Tuple[str, Tuple[Any, ...], Callable[[], BaseQuery]], ...] = (
+            ('WITH', (mapping.ctes,), lambda: dialect.get_with(BaseQuery())),
+            ('SELECT', (mapping.select_columns,),
+             lambda: dialect.get_select(BaseQuery(), mapping.select_columns)),
+            ('FROM', (mapping.driving_table, mapping.driving_table_alias, mapping.joins, mapping.filters),
+             lambda: dialect.get_join(BaseQuery())),
+        )
+        for clause, parts, build in clauses:
+            key = (type(dialect), clause)
+            known = self._parts.get(key)
+            if known is not None and len(known[0]) == len(parts) \
+                    and all(part is old for part, old in zip(parts, known[0])):
+                digest = known[1]
+            else:
+                digest = _digest(parts)
+                self._parts[key] = (parts, digest)
+            cached = self.clauses.get(key)
+            if cached is not None and cached[0] == digest and cached[1] is not None:
+                logger.debug('reusing the rendered %s clause', clause)
+                yield from cached[1]
+                continue
+            yield from self._render_clause(key, digest, build())
+
+    def _render_clause(self, key: Tuple[type, str], digest: str, query: BaseQuery) -> Iterator[str]:
+        """yields the fragments of a clause, keeping them while the clause stays under the size cap"""
+        kept, size = [], 0
+        for fragment in query._lines():
+            if kept is not None:
+                size += len(fragment)
+                if size > MAX_CACHED_CLAUSE_SIZE:
+                    kept = None
+                else:
+                    kept.append(fragment)
+            yield fragment
+        self.clauses[key] = (digest, tuple(kept) if kept is not None else None)
@@ -0,0 +1,409 @@
+import heapq
+import logging
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+from app.services.config_parser import Filter, JoinStep, MetadataMapping
+from app.utils import equi_join_pattern, referenced_aliases
+
+from .hoisting import (DEFAULT_MIN_REPEATS, NULL_EXTENDING_JOIN_TYPES, SQL_KEYWORDS, Token, conjuncts,
+                       grouped, hoist_expressions, hoist_subqueries, single_alias, tokenize,
+                       unqualified_columns)
+from .sharing import share_subqueries
+
+logger = logging.getLogger(__name__)
+
+_plain_column_pattern = re.compile(r'(?:[A-Za-z_]\w*\s*\.\s*)?([A-Za-z_]\w*)')
+
+# reordering joins around right/full outer joins changes which rows are preserved
+REORDERABLE_JOIN_TYPES = ('inner join', 'left join', 'cross join')
+# inner joins can only remove rows, so they are placed first when the order is free
+JOIN_TYPE_PRIORITY = {'inner join': 0, 'cross join': 1, 'left join': 2}
+# clauses of a select, split to find the columns a reference_subquery is unique on
+CLAUSE_KEYWORDS = ('select', 'from', 'where', 'group', 'having', 'qualify', 'window', 'order', 'limit', 'offset')
+SET_OPERATIONS = ('union', 'intersect', 'except', 'minus')
+# a predicate reading any of these can hold on the NULL row of an unmatched left join
+NULL_TOLERANT_TOKENS = {'null', 'is', 'coalesce', 'nvl', 'nvl2', 'isnull', 'ifnull', 'decode', 'case',
+                        'or', 'greatest', 'least'}
+
+
+class AliasGraph(NamedTuple):
+    driving_alias: str
+    # alias of each join step -> aliases its join condition reads
+    dependencies: Dict[str, Set[str]]
+    # aliases read by the select list and the filters
+    used: Set[str]
+    select_all: bool
+
+    @classmethod
+    def from_mapping(cls, mapping: MetadataMapping) -> 'AliasGraph':
+        """method to build the alias dependency graph of a mapping
+
+        Aliases are compared lower cased. The unqualified columns of a select
+        column are attributed to the table_alias of its select_sources row.
+        Without a table_alias, and in the filters, an unqualified column may
+        belong to any table, so it reads every alias.
+
+        Args:
+            mapping (MetadataMapping)
+
+        Returns:
+            AliasGraph
+        """
+        dependencies = {}
+        for _step in mapping.joins:
+            alias = (_step.reference_table_alias or '').lower()
+            dependencies[alias] = {ref.lower() for ref in
+                                   referenced_aliases(_step.join_condition)} - {alias}
+
+        every_alias = {(mapping.driving_table_alias or '').lower(), *dependencies}
+        used: Set[str] = set()
+        select_all = False
+        for _select in mapping.select_columns:
+            refs = referenced_aliases(_select.expression)
+            if _select.table_alias and (not refs or unqualified_columns(_select.expression)):
+                refs.add(_select.table_alias)
+            elif unqualified_columns(_select.expression):
+                refs.update(every_alias)
+            used.update(ref.lower() for ref in refs)
+            select_all = select_all or _select.expression.strip() == '*'
+        for _filter in mapping.filters:
+            used.update(ref.lower()
+                        for ref in referenced_aliases(_filter.condition))
+            if unqualified_columns(_filter.condition):
+                used.update(every_alias)
+        return cls((mapping.driving_table_alias or '').lower(), dependencies, used, select_all)
+
+    def required_aliases(self, kept: Iterable[str] = ()) -> Set[str]:
+        """method to find the aliases needed by the select list, the filters and the kept joins
+
+        The aliases the join condition of a needed alias reads are needed
+        too, until no alias is added.
+
+        Args:
+            kept (Iterable[str]): aliases of the join steps kept whether read or not
+
+        Returns:
+            Set[str]
+        """
+        required = {self.driving_alias}
+        pending = [*self.used, *kept]
+        while pending:
+            alias = pending.pop()
+            if alias in required:
+                continue
+            required.add(alias)
+            pending.extend(self.dependencies.get(alias, ()))
+        return required
+
+
+def prune_unused_joins(mapping: MetadataMapping,
+                       unique_keys: Optional[Mapping[str, Sequence[Union[str, Sequence[str]]]]] = None
+                       ) -> MetadataMapping:
+    """method to drop LEFT JOIN steps whose alias is never read
+
+    A left join never removes driving rows, so dropping an unreferenced one
+    keeps the result when it matches at most one row per driving row: its
+    join condition equates every column of a unique key of the reference
+    side, a key of `unique_keys` for a table, the DISTINCT or GROUP BY
+    columns for a reference_subquery. Every other step is kept, along with
+    the joins its condition reads.
+
+    Args:
+        mapping (MetadataMapping)
+        unique_keys (Optional[Mapping[str, Sequence[Union[str, Sequence[str]]]]]): table, as written
+            in the mapping -> its unique columns, or lists of columns of a composite key
+
+    Returns:
+        MetadataMapping
+    """
+    graph = AliasGraph.from_mapping(mapping)
+    if graph.select_all:
+        return mapping
+    declared = {table.lower(): [{key.lower()} if isinstance(key, str) else {column.lower() for column in key}
+                                for key in keys]
+                for table, keys in (unique_keys or {}).items()}
+    prunable = {(_step.reference_table_alias or '').lower() for _step in mapping.joins
+                if _step.join_type == 'left join' and _matches_one_row(_step, declared)}
+    required = graph.required_aliases(alias for alias in graph.dependencies if alias not in prunable)
+    kept = [_step for _step in mapping.joins
+            if (_step.reference_table_alias or '').lower() not in prunable - required]
+    if len(kept) != len(mapping.joins):
+        logger.info('pruned unused left joins - %s',
+                    [_step.reference_table_alias for _step in mapping.joins if _step not in kept])
+    return mapping._replace(joins=tuple(kept))
+
+
+def _matches_one_row(_step: JoinStep, declared: Dict[str, List[Set[str]]]) -> bool:
+    """the join condition equates all the columns of a unique key of the reference side"""
+    alias = (_step.reference_table_alias or '').lower()
+    key_columns = set()
+    for predicate in conjuncts(_step.join_condition or ''):
+        match = equi_join_pattern.fullmatch(predicate.strip())
+        if not match:
+            continue
+        sides = [(match.group(1).lower(), match.group(2).lower()), (match.group(3).lower(), match.group(4).lower())]
+        for (side, column), (other, _) in (sides, sides[::-1]):
+            if side == alias and other != alias:
+                key_columns.add(column)
+    if not key_columns:
+        return False
+    if _step.reference_subquery:
+        keys = _unique_columns(_step.reference_subquery)
+    else:
+        keys = declared.get((_step.reference_table or '').lower(), [])
+    return any(key <= key_columns for key in keys)
+
+
+def _unique_columns(query: str) -> List[Set[str]]:
+    """sets of output columns a query returns at most one row per value of, from its DISTINCT or GROUP BY"""
+    clauses = _top_level_clauses(query)
+    if clauses is None or not clauses.get('select'):
+        return []
+    items = list(clauses['select'])
+    distinct = re.match(r'distinct\b', items[0], re.IGNORECASE)
+    if distinct:
+        items[0] = items[0][distinct.end():].strip()
+        if items[0].lower().startswith('on'):
+            # DISTINCT ON keeps one row per its own columns only
+            return []
+    outputs = [_output_column(item) for item in items]
+
+    keys = []
+    if distinct and all(name is not None for name, _ in outputs):
+        keys.append({name for name, _ in outputs})
+    grouped_columns = set()
+    for item in clauses.get('group', ()):
+        if item.isdigit() and 0 < int(item) <= len(outputs):
+            name = outputs[int(item) - 1][0]
+        else:
+            match = _plain_column_pattern.fullmatch(item)
+            column = match.group(1).lower() if match else None
+            name = next((name for name, source in outputs if column is not None and source == column), None)
+        if name is None:
+            return keys
+        grouped_columns.add(name)
+    if grouped_columns:
+        keys.append(grouped_columns)
+    return keys
+
+
+def _top_level_clauses(query: str) -> Optional[Dict[str, List[str]]]:
+    """comma separated items of each clause of a query, outside parentheses, None for a set operation"""
+    tokens = tokenize(query)
+    clauses: Dict[str, List[str]] = {}
+    clause, start, depth = None, 0, 0
+    for index, token in enumerate(tokens):
+        lowered = token.text.lower()
+        if token.text in ('(', ')'):
+            depth += 1 if token.text == '(' else -1
+        elif depth:
+            continue
+        elif lowered in SET_OPERATIONS:
+            return None
+        elif lowered in CLAUSE_KEYWORDS:
+            if lowered in clauses:
+                return None
+            if clause is not None:
+                clauses[clause].append(query[start:token.start].strip())
+            clause, start = lowered, token.end
+            clauses[clause] = []
+            if lowered in ('group', 'order') and index + 1 < len(tokens) and tokens[index + 1].text.lower() == 'by':
+                start = tokens[index + 1].end
+        elif token.text == ',' and clause is not None:
+            clauses[clause].append(query[start:token.start].strip())
+            start = token.end
+    if clause is not None:
+        clauses[clause].append(query[start:].strip())
+    if any(text.lower() in ('rollup', 'cube', 'grouping') for item in clauses.get('group', ()) for text in item.split()):
+        return None
+    return clauses
+
+
+def _output_column(item: str) -> Tuple[Optional[str], Optional[str]]:
+    """output name of a select item, and the column it reads when it reads one as is"""
+    match = _plain_column_pattern.fullmatch(item)
+    if match:
+        return match.group(1).lower(), match.group(1).lower()
+    tokens = tokenize(item)
+    if len(tokens) < 2 or not (tokens[-1].text[0].isalpha() or tokens[-1].text[0] == '_') \
+            or tokens[-1].text.lower() in SQL_KEYWORDS:
+        return None, None
+    previous = tokens[-2].text.lower()
+    # `expr AS name` or `expr name`, not the last operand of `a + b` or `a and b`
+    if previous != 'as' and (previous in SQL_KEYWORDS and previous != 'end'
+                             or not (previous == ')' or previous[0].isalnum() or previous[0] in '_\'"')):
+        return None, None
+    expression = item[:tokens[-2].end if previous != 'as' else tokens[-2].start].strip()
+    source = _plain_column_pattern.fullmatch(expression)
+    return tokens[-1].text.lower(), source.group(1).lower() if source else None
+
+
+def order_joins(mapping: MetadataMapping) -> MetadataMapping:
+    """method to order the join steps so every join follows the aliases its condition reads
+
+    The order is a stable topological sort of the alias graph. When only
+    inner, left and cross joins are present, ready inner joins are placed
+    before left joins so rows are filtered out as early as possible.
+
+    Args:
+        mapping (MetadataMapping)
+
+    Returns:
+        MetadataMapping
+    """
+    graph = AliasGraph.from_mapping(mapping)
+    steps = list(mapping.joins)
+    aliases = [(_step.reference_table_alias or '').lower() for _step in steps]
+    declared = set(aliases)
+    prioritise = all(
+        _step.join_type in REORDERABLE_JOIN_TYPES for _step in steps)
+
+    def _key(index: int) -> tuple:
+        if prioritise:
+            return JOIN_TYPE_PRIORITY[steps[index].join_type], index
+        return 0, index
+
+    waiting = {index: graph.dependencies.get(alias, set()) & declared - {graph.driving_alias}
+               for index, alias in enumerate(aliases)}
+    placed: Set[str] = set()
+    ready = [_key(index) for index, deps in waiting.items() if not deps]
+    heapq.heapify(ready)
+    ordered: List[JoinStep] = []
+    while ready:
+        _, index = heapq.heappop(ready)
+        ordered.append(steps[index])
+        placed.add(aliases[index])
+        del waiting[index]
+        for other, deps in waiting.items():
+            # cleared once pushed, so a step is only made ready once
+            if deps and deps <= placed:
+                heapq.heappush(ready, _key(other))
+                deps.clear()
+
+    if waiting:
+        logger.warning(
+            'join conditions depend on each other in a cycle, keeping the sheet order')
+        return mapping
+    return mapping._replace(joins=tuple(ordered))
+
+
+def push_down_filters(mapping: MetadataMapping) -> MetadataMapping:
+    """method to move the filters reading a single joined table next to that table
+
+    Each filter is split on its top level ANDs. A predicate reading only the
+    alias of an inner join goes into the reference_subquery of the step, or
+    into its ON clause when the step joins a table, so rows are removed
+    before the join. A predicate on a left joined alias that is never true on
+    NULL columns already drops the unmatched rows, so the step becomes an
+    inner join and the predicate moves the same way. Filters on the driving
+    table, reading several tables, or of a mapping with a right/full outer
+    join stay in the WHERE clause.
+
+    Args:
+        mapping (MetadataMapping)
+
+    Returns:
+        MetadataMapping
+    """
+    if any(_step.join_type in NULL_EXTENDING_JOIN_TYPES for _step in mapping.joins):
+        return mapping
+    counts = Counter((_step.reference_table_alias or '').lower() for _step in mapping.joins)
+    steps = {(_step.reference_table_alias or '').lower(): index for index, _step in enumerate(mapping.joins)
+             if _step.reference_table_alias and counts[_step.reference_table_alias.lower()] == 1
+             and _step.join_type in ('inner join', 'left join')
+             and (_step.join_condition or _step.reference_subquery)}
+    steps.pop((mapping.driving_table_alias or '').lower(), None)
+    if not steps:
+        return mapping
+
+    pushed: Dict[int, List[str]] = {}
+    inner: Set[int] = set()
+    filters = []
+    for _filter in mapping.filters:
+        predicates, kept = conjuncts(_filter.condition), []
+        for predicate in predicates:
+            tokens = tokenize(predicate)
+            alias = single_alias(tokens, set(steps))
+            index = steps.get(alias) if alias else None
+            if index is not None and (mapping.joins[index].join_type == 'inner join'
+                                      or _rejects_nulls(tokens)):
+                pushed.setdefault(index, []).append(predicate)
+                inner.add(index)
+            else:
+                kept.append(predicate)
+        if len(kept) == len(predicates):
+            filters.append(_filter)
+        elif kept:
+            filters.append(Filter(' AND '.join(kept), _filter.step))
+    if not pushed:
+        return mapping
+
+    joins = list(mapping.joins)
+    for index, predicates in pushed.items():
+        _step = restrict_step(joins[index], predicates)
+        joins[index] = _step._replace(join_type='inner join') if index in inner else _step
+    logger.info('pushed filters down into the joins of %s',
+                [mapping.joins[index].reference_table_alias for index in pushed])
+    return mapping._replace(joins=tuple(joins), filters=tuple(filters))
+
+
+def restrict_step(_step: JoinStep, predicates: List[str]) -> JoinStep:
+    """method to add predicates reading only the alias of a join step to the step
+
+    Args:
+        _step (JoinStep): join step with a join_condition or a reference_subquery
+        predicates (List[str]): predicates on `reference_table_alias`
+
+    Returns:
+        JoinStep: step filtering its reference_subquery, or with the predicates ANDed to its ON clause
+    """
+    condition = ' AND '.join(grouped(predicate) for predicate in predicates)
+    if _step.reference_subquery:
+        return _step._replace(reference_subquery=f'SELECT * FROM ({_step.reference_subquery}) '
+                                                 f'AS {_step.reference_table_alias} WHERE {condition}')
+    return _step._replace(join_condition=f'{grouped(_step.join_condition)} AND {condition}')
+
+
+def _rejects_nulls(tokens: List[Token]) -> bool:
+    """the predicate is never true when the columns it reads are NULL"""
+    lowered = [token.text.lower() for token in tokens]
+    for i, text in enumerate(lowered):
+        # `IS NOT NULL` is the one IS test that is false on NULL
+        if lowered[i:i + 3] == ['is', 'not', 'null'] or lowered[i - 1:i + 2] == ['is', 'not', 'null'] \
+                or lowered[i - 2:i + 1] == ['is', 'not', 'null']:
+            continue
+        if text in NULL_TOLERANT_TOKENS:
+            return False
+    return True
+
+
+def optimize_mapping(mapping: MetadataMapping, options: Mapping[str, Any],
+                     shared_tables: Optional[Mapping[str, str]] = None) -> MetadataMapping:
+    """method to apply the optimisations enabled in the `optimizer` config section
+
+    Args:
+        mapping (MetadataMapping)
+        options (Mapping[str, Any]): `optimizer` config section
+        shared_tables (Optional[Mapping[str, str]]): fingerprint -> table materialising a subquery
+            or filtered table shared across a batch, read instead of computing it again
+
+    Returns:
+        MetadataMapping
+    """
+    if options.get('prune_unused_joins', False):
+        mapping = prune_unused_joins(mapping, options.get('unique_keys'))
+    if options.get('push_down_filters', False):
+        mapping = push_down_filters(mapping)
+    if options.get('reorder_joins', False):
+        mapping = order_joins(mapping)
+    if shared_tables:
+        # before hoisting, so the shared subqueries are matched as written in the joins
+        mapping = share_subqueries(mapping, shared_tables)
+    if options.get('hoist_subqueries', False):
+        mapping = hoist_subqueries(mapping)
+    if options.get('hoist_expressions', False):
+        mapping = hoist_expressions(
+            mapping, options.get('hoist_min_repeats', DEFAULT_MIN_REPEATS))
+    return mapping
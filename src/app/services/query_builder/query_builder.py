@@ -1,16 +1,36 @@
 import dataclasses
+import io
+import json
 import logging
 import os
+import sys
+from contextlib import contextmanager
+from typing import (Any, Callable, ClassVar, ContextManager, Dict, Iterable,
+                    Iterator, Optional, TextIO, Tuple)
 
 from pydantic.dataclasses import dataclass
 
 from app.etl_exceptions import AutoETLException
-from app.services.config_parser import ConfigParser, MetadataParser
-from app.services.query_builder import RedshiftDialect
-from app.utils import excel_to_json, validate_joins_mapping
+from app.profiler import StageProfiler
+from app.services.compile_cache import CompileCache
+from app.services.compile_cache.cache import DEFAULT_MAX_SIZE_MB
+from app.services.config_parser import (ConfigParser, MetadataMapping,
+                                       MetadataParser)
+from app.services.query_builder.backfill import Backfill, BackfillChunk
+from app.services.query_builder.ddl import SELECT_OUTPUT, TableDesign, table_statements
+from app.services.query_builder.dialect import BaseDialect
+from app.services.query_builder.incremental import ClauseCache
+from app.services.query_builder.optimizer import optimize_mapping
+from app.services.query_builder.registry import get_dialect
+from app.services.query_builder.writer import SqlWriter
+from app.services.query_explainer import QueryExplainer
+from app.utils import (excel_to_json, file_signature, is_valid_file,
+                       validate_joins_mapping)
 
 logger = logging.getLogger(__name__)
 
+TargetOpener = Callable[[str, bool], ContextManager[TextIO]]
+
 
 class Config:
     arbitrary_types_allowed = True
@@ -18,19 +38,113 @@ class Config:
 
 @dataclass(config=Config)
 class QueryBuilder:
+    tool: ClassVar[str] = 'query-builder'
     metadata_file_path: str
     config_file_path: str
+    cache_dir: Optional[str] = None
+    profile: bool = False
+    profile_stats_path: Optional[str] = None
+    explain: bool = False
+    # fingerprint -> table materialising a subquery shared across a batch
+    shared_tables: Optional[Dict[str, str]] = None
     metadata_parser: MetadataParser = dataclasses.field(init=False)
     config_parser: ConfigParser = dataclasses.field(init=False)
+    profiler: StageProfiler = dataclasses.field(init=False)
+    profile_report: Optional[Dict[str, Any]] = dataclasses.field(init=False)
+    explain_report: Optional[Dict[str, Any]] = dataclasses.field(init=False)
+    # (file signature, parsed value) of the last build, reused while the file is unchanged
+    warm_config: Optional[Tuple[Any, Dict]] = dataclasses.field(init=False)
+    warm_mapping: Optional[Tuple[Any, MetadataMapping]] = dataclasses.field(init=False)
+    # per sheet states and rendered clauses of the last build, so an edit only
+    # parses the changed sheets and renders the changed clauses again
+    sheet_states: Optional[Dict[str, Any]] = dataclasses.field(init=False)
+    clause_cache: ClauseCache = dataclasses.field(init=False)
 
     def __post_init__(self):
         self.metadata_parser: MetadataParser = MetadataParser.get_metadata_parser(
             self.metadata_file_path)
         self.config_parser: ConfigParser = ConfigParser.get_config_parser(
             self.config_file_path)
+        self.profiler = StageProfiler()
+        self.profile_report = None
+        self.explain_report = None
+        self.warm_config = None
+        self.warm_mapping = None
+        self.sheet_states = None
+        self.clause_cache = ClauseCache()
+
+    def run(self, output_file_path: Optional[str] = None) -> None:
+        """ Method to trigger the build and stream the generated sql
+
+        Args:
+            output_file_path (Optional[str]): file the sql is written to, stdout when None.
+                With several targets one `<name>.<target>.sql` file is written per target, a chunked
+                backfill writes one `<name>.<chunk>.sql` file per chunk.
+        """
+        if output_file_path is None:
+            self.write(sys.stdout)
+            return
+
+        @contextmanager
+        def _open_target(target: str, several: bool) -> Iterator[TextIO]:
+            path = output_file_path
+            if several:
+                root, ext = os.path.splitext(output_file_path)
+                path = f'{root}.{target}{ext}'
+            with open(path, 'w') as fp:
+                fp.write(self._shared_tables_header())
+                yield fp
+
+        self._run(_open_target)
+
+    def build(self) -> str:
+        """ Method to build the sql for the metadata file as a string
+
+        Returns:
+            str: generated sql statement
+        """
+        buffer = io.StringIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+    def write(self, output: TextIO) -> None:
+        """ Method to build the sql for the metadata file and stream it to an output
 
-    def run(self) -> None:
-        """ Method to trigger the build
+        With several targets or backfill chunks the statements follow each
+        other, each headed by a `-- target: <name>` comment.
+
+        Args:
+            output (TextIO): output the sql is written to
+        """
+        @contextmanager
+        def _open_target(target: str, several: bool) -> Iterator[TextIO]:
+            if several:
+                output.write(f'-- target: {target}\n')
+            output.write(self._shared_tables_header())
+            yield output
+
+        self._run(_open_target)
+
+    def _shared_tables_header(self) -> str:
+        """comment naming the shared tables the sql reads, they are created by another file of the batch"""
+        if not self.shared_tables:
+            return ''
+        # temp tables are dropped with the session, a new session would not see them
+        return (f'-- reads the shared tables {", ".join(sorted(set(self.shared_tables.values())))}, '
+                'run the shared subqueries file of the batch first, in the same session for temp tables\n')
+
+    def _run(self, open_target: TargetOpener) -> None:
+        """ Method to build the sql of every configured target
+
+        The metadata file is parsed and validated once and the mapping model is
+        rendered by the dialect of each target. With profiling enabled the per
+        stage report is kept in `profile_report`.
+
+        Args:
+            open_target (TargetOpener): context manager factory giving the output of a target
+
+        Raises:
+            AutoETLException: Exception if a target system is not supported
         """
         logger.info("Initialising Auto ETL")
         logger.info("Found metadata file - %s",
@@ -38,25 +152,198 @@ class QueryBuilder:
         logger.info("Found config file - %s",
                     os.path.basename(self.config_file_path))
 
-        meta_xls = self.metadata_parser.validate_file()
+        self.profiler = StageProfiler(self.profile, self.profile_stats_path)
+        cache_hit = False
+        try:
+            cache_hit = self._build(open_target)
+        finally:
+            self.profile_report = self.profiler.finish(
+                metadata_file=self.metadata_file_path, cache_hit=cache_hit)
+
+    def _build(self, open_target: TargetOpener) -> bool:
+        with self.profiler.stage('validate_config'):
+            _config = self._load_config()
+            targets = _config['target'] if isinstance(
+                _config['target'], list) else [_config['target']]
+            dialects = {target: get_dialect(target, _config.get('dialects'))
+                        for target in targets}
+            # a chunked backfill renders one statement per target and chunk
+            backfill = Backfill.from_config(_config)
+            units = [(target, chunk) for target in targets
+                     for chunk in (backfill.chunks if backfill is not None else (None,))]
+
+        compile_cache, cache_keys = None, {}
+        if self.cache_dir and is_valid_file(self.metadata_file_path):
+            with self.profiler.stage('cache_lookup'):
+                compile_cache = CompileCache(
+                    self.cache_dir, _config.get('cache_max_size_mb', DEFAULT_MAX_SIZE_MB))
+                cache_keys = dict(zip(units, compile_cache.get_keys(
+                    self.metadata_file_path,
+                    [self._cache_config(_config, target, chunk) for target, chunk in units])))
+
+        mapping, partition = None, None
+        for target, chunk in units:
+            name = target if chunk is None else chunk.name if len(targets) == 1 else f'{target}.{chunk.name}'
+            with open_target(name, len(units) > 1) as output:
+                if compile_cache is not None and compile_cache.stream_sql(cache_keys[target, chunk], output):
+                    logger.info("Found cached %s build for meta_file -> %s",
+                                name, {self.metadata_file_path})
+                    continue
+
+                if mapping is None:
+                    if compile_cache is not None and self.sheet_states is None:
+                        self._restore_state(compile_cache)
+                    mapping = self._load_mapping(_config)
+
+                with self.profiler.stage('render') as counters:
+                    chunk_mapping = mapping
+                    if chunk is not None:
+                        partition = partition or backfill.partition_column(mapping)
+                        chunk_mapping = backfill.chunk_mapping(mapping, chunk, partition,
+                                                               dialects[target].hash_bucket)
+                    fragments = self.render(
+                        dialects[target](chunk_mapping), _config)
+                    if compile_cache is not None:
+                        with compile_cache.sql_writer(cache_keys[target, chunk], mapping) as cache_fp:
+                            SqlWriter(output, cache_fp).write(fragments)
+                    else:
+                        SqlWriter(output).write(fragments)
+                    counters.update(target=target,
+                                    columns=len(mapping.select_columns))
+
+        cache_hit = mapping is None
+        if self.explain:
+            if mapping is None:
+                if compile_cache is not None and self.sheet_states is None:
+                    self._restore_state(compile_cache)
+                mapping = self._load_mapping(_config)
+            with self.profiler.stage('explain') as counters:
+                self.explain_report = QueryExplainer(_config.get('explain', {})).explain(
+                    mapping, ''.join(self.clause_cache.render(dialects[targets[0]](mapping))))
+                counters.update(rows=len(mapping.joins))
+
+        if mapping is not None and compile_cache is not None:
+            with self.profiler.stage('store_state'):
+                compile_cache.put_state(
+                    CompileCache.get_state_key(self.metadata_file_path, self.tool),
+                    {'sheets': self.sheet_states, 'clauses': self.clause_cache.clauses})
+        return cache_hit
+
+    def render(self, dialect: BaseDialect, _config: Dict) -> Iterable[str]:
+        """ Method to render the sql of one target, overridden by the other build tools
+
+        Args:
+            dialect (BaseDialect): dialect of the target, holding the mapping model
+            _config (Dict): validated config
+
+        Returns:
+            Iterable[str]: sql fragments
+        """
+        output_mode = _config.get('output_mode', SELECT_OUTPUT)
+        if output_mode == SELECT_OUTPUT:
+            return self.clause_cache.render(dialect)
+        design = TableDesign.from_config(dialect.mapping, _config, output_mode)
+        return table_statements(self.clause_cache.render(dialect), design, output_mode,
+                                dialect.physical_design)
+
+    def load_mapping(self) -> MetadataMapping:
+        """ Method to get the optimised mapping model of the metadata file without rendering it
+
+        The mapping parsed by the last build, or else the model stored with a
+        cached build, is reused, otherwise the metadata file is parsed.
+
+        Returns:
+            MetadataMapping
+        """
+        _config = self._load_config()
+        if self.warm_mapping is None and self.cache_dir and is_valid_file(self.metadata_file_path):
+            compile_cache = CompileCache(self.cache_dir, _config.get('cache_max_size_mb', DEFAULT_MAX_SIZE_MB))
+            target = _config['target'][0] if isinstance(_config['target'], list) else _config['target']
+            backfill = Backfill.from_config(_config)
+            key = compile_cache.get_keys(self.metadata_file_path, [self._cache_config(
+                _config, target, backfill.chunks[0] if backfill is not None else None)])[0]
+            model = compile_cache.get_model(key)
+            if model is not None:
+                return model
+        return self._load_mapping(_config)
+
+    def _cache_config(self, _config: Dict, target: str, chunk: Optional[BackfillChunk]) -> Dict:
+        """config a build of one target and chunk is cached under"""
+        cache_config = {**_config, 'target': target, 'tool': self.tool}
+        if chunk is not None:
+            cache_config['chunk'] = chunk.name
+        if self.shared_tables:
+            cache_config['shared_tables'] = self.shared_tables
+        return cache_config
+
+    def _restore_state(self, compile_cache: CompileCache) -> None:
+        with self.profiler.stage('restore_state'):
+            state = compile_cache.get_state(
+                CompileCache.get_state_key(self.metadata_file_path, self.tool))
+            self.sheet_states = {}
+            if state is not None:
+                self.sheet_states = state['sheets'] or {}
+                self.clause_cache.clauses = state['clauses']
+
+    def _load_config(self) -> Dict:
+        signature = file_signature(self.config_file_path) \
+            if is_valid_file(self.config_file_path) else None
+        if signature is not None and self.warm_config is not None and self.warm_config[0] == signature:
+            return self.warm_config[1]
         _config = self.config_parser.validate_file()
+        self.warm_config = (signature, _config)
+        return _config
+
+    def _load_mapping(self, _config: Dict) -> MetadataMapping:
+        # a builder kept alive, e.g. in watch mode, only parses the metadata file again once it changed
+        key = (file_signature(self.metadata_file_path) if is_valid_file(self.metadata_file_path) else None,
+               _config.get('metadata_loader', 'openpyxl'),
+               json.dumps(_config.get('optimizer', {}), sort_keys=True),
+               json.dumps(self.shared_tables, sort_keys=True))
+        if key[0] is not None and self.warm_mapping is not None and self.warm_mapping[0] == key:
+            logger.info("reusing the parsed mapping of meta_file -> %s",
+                        {self.metadata_file_path})
+            return self.warm_mapping[1]
+        mapping = self._parse_mapping(_config)
+        self.warm_mapping = (key, mapping)
+        return mapping
 
+    def _parse_mapping(self, _config: Dict) -> MetadataMapping:
         logger.info("building query from meta_file -> %s",
                     {self.metadata_file_path})
 
-        target_table_json = excel_to_json(meta_xls, 'target_table', 'records')
-        joins_and_filters = excel_to_json(
-            meta_xls, 'joins_and_filters', 'index')
-        select_sources = excel_to_json(meta_xls, 'select_sources', 'records')
-
-        validate_joins_mapping(joins_and_filters)
-        match _config['target']:
-            case 'redshift':
-                RedshiftDialect(target_table_json,
-                                joins_and_filters, select_sources).get_sql()
-
-            case _:
-                logger.error(
-                    "Target system - %s not supported yet.", _config.get('target', 'None'))
-                raise AutoETLException(
-                    f"Target system - {_config['target']} not supported yet.")
+        with self.profiler.stage('load_mapping') as counters:
+            loader = _config.get('metadata_loader', 'openpyxl')
+            if loader == 'pandas' and not self.metadata_parser.is_workbook():
+                # the loader only picks the excel reader, other sources have their own
+                loader = 'openpyxl'
+            match loader:
+                case 'openpyxl':
+                    if self.sheet_states is None:
+                        self.sheet_states = {}
+                    mapping = self.metadata_parser.load_mapping(
+                        self.sheet_states)
+                case 'pandas':
+                    meta_xls = self.metadata_parser.validate_file()
+                    mapping = MetadataMapping.from_records(
+                        excel_to_json(meta_xls, 'target_table', 'records'),
+                        excel_to_json(
+                            meta_xls, 'joins_and_filters', 'records'),
+                        excel_to_json(meta_xls, 'select_sources', 'records'))
+                case _:
+                    logger.error(
+                        "Metadata loader - %s not supported.", _config['metadata_loader'])
+                    raise AutoETLException(
+                        f"Metadata loader - {_config['metadata_loader']} not supported.")
+            counters.update(rows=len(mapping.target_table.columns) + len(mapping.joins)
+                            + len(mapping.select_columns),
+                            columns=len(mapping.select_columns))
+
+        with self.profiler.stage('validate_joins_mapping') as counters:
+            validate_joins_mapping(mapping)
+            counters.update(rows=len(mapping.joins))
+
+        with self.profiler.stage('optimize') as counters:
+            mapping = optimize_mapping(mapping, _config.get('optimizer', {}), self.shared_tables)
+            counters.update(rows=len(mapping.joins))
+        return mapping
@@ -0,0 +1,68 @@
+import importlib
+import logging
+from typing import Callable, Dict, Mapping, Optional, Type, TypeVar
+
+from app.etl_exceptions import AutoETLException
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'auto_etl.dialects'
+
+_D = TypeVar('_D', bound=type)
+
+DIALECTS: Dict[str, type] = {}
+
+
+def register_dialect(name: str) -> Callable[[_D], _D]:
+    """decorator registering a dialect class under a target name
+
+    Args:
+        name (str): target name used in the `target` config
+    """
+    def _register(cls: _D) -> _D:
+        DIALECTS[name] = cls
+        cls.name = name
+        return cls
+    return _register
+
+
+def get_dialect(name: str, custom_dialects: Optional[Mapping[str, str]] = None) -> Type:
+    """method to resolve the dialect class of a target
+
+    Dialects are looked up in the `dialects` config section (`module:Class`
+    paths), then in the built in registry, then in the `auto_etl.dialects`
+    entry point group of the installed packages.
+
+    Args:
+        name (str): target name
+        custom_dialects (Optional[Mapping[str, str]]): `dialects` config section
+
+    Raises:
+        AutoETLException: Exception if no dialect is found for the target
+
+    Returns:
+        Type: dialect class
+    """
+    if custom_dialects and name in custom_dialects:
+        module_name, _, class_name = custom_dialects[name].partition(':')
+        try:
+            return getattr(importlib.import_module(module_name), class_name)
+        except (ImportError, AttributeError) as excep:
+            logger.error("Dialect %s could not be loaded from %s",
+                         name, custom_dialects[name])
+            raise AutoETLException(
+                f"Dialect {name} could not be loaded from {custom_dialects[name]}", excep.args)
+
+    if name in DIALECTS:
+        return DIALECTS[name]
+
+    # scanning the installed distributions is slow, only done for unknown targets
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name == name:
+            DIALECTS[name] = entry_point.load()
+            return DIALECTS[name]
+
+    logger.error("Target system - %s not supported yet.", name)
+    raise AutoETLException(f"Target system - {name} not supported yet.")
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+from typing import Iterable, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from app.services.config_parser import MetadataMapping
+from app.utils import referenced_tables
+
+from .hoisting import (NULL_EXTENDING_JOIN_TYPES, SUBQUERY_CTE_PREFIX, VOLATILE_FUNCTIONS, conjuncts,
+                       grouped, single_alias, tokenize)
+
+logger = logging.getLogger(__name__)
+
+SUBQUERY_CANDIDATE = 'subquery'
+FILTERED_TABLE_CANDIDATE = 'filtered_table'
+TEMP_TABLE = 'temp_table'
+MATERIALIZED_VIEW = 'materialized_view'
+MATERIALIZE_MODES = (TEMP_TABLE, MATERIALIZED_VIEW)
+SHARED_TABLE_PREFIX = 'shared_'
+# alias of the reference table inside the select of a filtered table
+_SHARED_ALIAS = '_shared'
+
+
+class SharedCandidate(NamedTuple):
+    # digest of the normalised sql, equal for the same rows across mappings
+    fingerprint: str
+    kind: str
+    # standalone select computing the rows, to be materialised once
+    sql: str
+
+
+def normalised_sql(text: str) -> str:
+    """method to write sql text in one canonical form, to compare it across mappings
+
+    Args:
+        text (str): sql query or condition
+
+    Returns:
+        str: tokens lower cased and separated by one space, quoted strings and identifiers kept as is
+    """
+    return ' '.join(token.text if token.text[0] in '\'"' else token.text.lower() for token in tokenize(text))
+
+
+def _candidate(kind: str, sql: str) -> SharedCandidate:
+    digest = hashlib.sha256(normalised_sql(sql).encode()).hexdigest()
+    return SharedCandidate(digest[:16], kind, sql.strip())
+
+
+def _shareable_steps(mapping: MetadataMapping) -> Iterator[Tuple[int, SharedCandidate]]:
+    """join steps whose rows can be read from a table computed once, with their candidate
+
+    A reference_subquery is shareable as is. A reference table is shareable
+    with the predicates reading only its alias: those of the ON clause, and
+    those of the WHERE clause for an inner join when no right/full outer
+    join keeps rows the WHERE clause would see differently. The predicates
+    stay in the query, the table only holds fewer rows.
+    """
+    cte_names = {name.lower() for name, _ in mapping.ctes}
+    aliases = {alias.lower() for alias in (mapping.driving_table_alias,
+                                           *(_step.reference_table_alias for _step in mapping.joins)) if alias}
+    where = [] if any(_step.join_type in NULL_EXTENDING_JOIN_TYPES for _step in mapping.joins) else \
+        [predicate for _filter in mapping.filters for predicate in conjuncts(_filter.condition)]
+    for index, _step in enumerate(mapping.joins):
+        if _step.reference_subquery:
+            if not _reads_ctes(_step.reference_subquery, cte_names) and not _volatile(_step.reference_subquery):
+                yield index, _candidate(SUBQUERY_CANDIDATE, _step.reference_subquery)
+            continue
+        if not _step.reference_table or not _step.reference_table_alias \
+                or _step.reference_table.lower() in cte_names or _step.join_type not in ('inner join', 'left join'):
+            continue
+        alias = _step.reference_table_alias.lower()
+        predicates = conjuncts(_step.join_condition or '') + (where if _step.join_type == 'inner join' else [])
+        predicates = [_realiased(predicate, alias) for predicate in predicates
+                      if single_alias(tokenize(predicate), aliases) == alias]
+        if predicates:
+            predicates = sorted(dict.fromkeys(predicates), key=normalised_sql)
+            yield index, _candidate(FILTERED_TABLE_CANDIDATE,
+                                    f'SELECT * FROM {_step.reference_table} AS {_SHARED_ALIAS} '
+                                    f'WHERE {" AND ".join(grouped(predicate) for predicate in predicates)}')
+
+
+def _reads_ctes(text: str, cte_names: Iterable[str]) -> bool:
+    return any(table.lower() in cte_names for table in referenced_tables(text))
+
+
+def _volatile(text: str) -> bool:
+    return any(token.text.lower() in VOLATILE_FUNCTIONS for token in tokenize(text))
+
+
+def _realiased(predicate: str, alias: str) -> str:
+    """predicate reading the columns of `alias` through the alias of the shared table"""
+    tokens = tokenize(predicate)
+    for i in reversed(range(len(tokens) - 1)):
+        if tokens[i].text.lower() == alias and tokens[i + 1].text == '.':
+            predicate = predicate[:tokens[i].start] + _SHARED_ALIAS + predicate[tokens[i].end:]
+    return predicate
+
+
+def shared_candidates(mapping: MetadataMapping) -> List[SharedCandidate]:
+    """method to list the subqueries and filtered reference tables of a mapping that other mappings may share
+
+    Reference subqueries hoisted into WITH clauses are listed by their text.
+
+    Args:
+        mapping (MetadataMapping): optimised mapping
+
+    Returns:
+        List[SharedCandidate]: one per join step, in join order
+    """
+    candidates = [_candidate(SUBQUERY_CANDIDATE, text) for name, text in mapping.ctes
+                  if name.startswith(SUBQUERY_CTE_PREFIX) and not _volatile(text)]
+    return candidates + [candidate for _, candidate in _shareable_steps(mapping)]
+
+
+def share_subqueries(mapping: MetadataMapping, shared_tables: Mapping[str, str]) -> MetadataMapping:
+    """method to read the shared subqueries and filtered tables of a mapping from their materialised tables
+
+    Args:
+        mapping (MetadataMapping)
+        shared_tables (Mapping[str, str]): fingerprint -> name of the table holding its rows
+
+    Returns:
+        MetadataMapping
+    """
+    joins = list(mapping.joins)
+    for index, candidate in _shareable_steps(mapping):
+        name = shared_tables.get(candidate.fingerprint)
+        if name is not None:
+            joins[index] = joins[index]._replace(reference_table=name, reference_subquery=None)
+    shared = [_step.reference_table_alias for _step, original in zip(joins, mapping.joins) if _step is not original]
+    if not shared:
+        return mapping
+    logger.info('reading joins %s from shared tables', shared)
+    return mapping._replace(joins=tuple(joins))
+
+
+def shared_table_name(fingerprint: str, materialize: str, schema: Optional[str] = None) -> str:
+    """method to name the table materialising a shared candidate
+
+    Args:
+        fingerprint (str)
+        materialize (str): one of `MATERIALIZE_MODES`
+        schema (Optional[str]): schema of the materialized views, temp tables have none
+
+    Returns:
+        str
+    """
+    name = SHARED_TABLE_PREFIX + fingerprint
+    return f'{schema}.{name}' if schema and materialize == MATERIALIZED_VIEW else name
+
+
+def shared_table_statements(shared: Iterable[Tuple[str, str]], materialize: str) -> Iterator[str]:
+    """method to generate the statements materialising the shared candidates once
+
+    Args:
+        shared (Iterable[Tuple[str, str]]): table name and select of each candidate
+        materialize (str): one of `MATERIALIZE_MODES`
+
+    Returns:
+        Iterator[str]: one statement per candidate, ending with `;`, after a comment for temp tables
+    """
+    if materialize == TEMP_TABLE:
+        yield ('-- temp tables only exist in the session creating them, run this file and then the files '
+               'reading the tables in one session\n')
+    create = 'CREATE TEMP TABLE' if materialize == TEMP_TABLE else 'CREATE MATERIALIZED VIEW'
+    for name, sql in shared:
+        yield f'{create} {name} AS\n{sql};\n'
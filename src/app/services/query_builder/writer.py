@@ -0,0 +1,47 @@
+import logging
+from typing import Iterable, List, TextIO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+
+class SqlWriter:
+    """Streams sql fragments to one or more text outputs in buffered chunks
+
+    The fragments are joined a chunk at a time, so the whole statement is never
+    held in memory.
+    """
+
+    def __init__(self, *outputs: TextIO, buffer_size: int = DEFAULT_BUFFER_SIZE) -> None:
+        self.outputs = outputs
+        self.buffer_size = buffer_size
+
+    def write(self, fragments: Iterable[str]) -> int:
+        """method to write the fragments to every output
+
+        Args:
+            fragments (Iterable[str]): sql fragments, e.g. `BaseQuery._lines()`
+
+        Returns:
+            int: number of characters written
+        """
+        buffer: List[str] = []
+        size, total = 0, 0
+        for fragment in fragments:
+            buffer.append(fragment)
+            size += len(fragment)
+            if size >= self.buffer_size:
+                self._flush(buffer)
+                total += size
+                buffer, size = [], 0
+        if buffer:
+            self._flush(buffer)
+            total += size
+        logger.debug('wrote %d characters of sql', total)
+        return total
+
+    def _flush(self, buffer: List[str]) -> None:
+        chunk = ''.join(buffer)
+        for output in self.outputs:
+            output.write(chunk)
@@ -0,0 +1 @@
+from .explainer import ExplainFlag, QueryExplainer, TableStats
@@ -0,0 +1,341 @@
+import logging
+import re
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from app.services.config_parser import MetadataMapping
+from app.services.query_builder.hoisting import Token, conjuncts, tokenize
+from app.utils import referenced_aliases, referenced_tables
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TABLE_ROWS = 1000
+DEFAULT_MAX_FAN_OUT = 10
+# unknown columns and functions are added to the stand-in database one error at a time
+MAX_EXPLAIN_ATTEMPTS = 50
+COMPARISON_TOKENS = {'=', '<', '>', '!', 'like', 'ilike', 'similar', 'in', 'between', 'is'}
+# sqlite has its own databases of these names, their tables are created in them
+SQLITE_SCHEMAS = ('main', 'temp')
+
+_missing_column_pattern = re.compile(r'no such column: (?:([\w$]+)\.)?([\w$]+)')
+_missing_function_pattern = re.compile(r'no such function: ([\w$]+)')
+
+
+class TableStats(NamedTuple):
+    rows: int
+    columns: Tuple[str, ...] = ()
+    # columns holding one row per value, e.g. the primary key
+    unique: Tuple[str, ...] = ()
+    # column -> number of distinct values
+    distinct: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, conf: Mapping[str, Any], default_rows: int) -> 'TableStats':
+        """method to read the statistics of one table of the `explain.tables` config section
+
+        Args:
+            conf (Mapping[str, Any]): `{"rows": ..., "columns": [...], "unique": [...], "distinct": {...}}`
+            default_rows (int): rows of the table when not set
+
+        Returns:
+            TableStats
+        """
+        return cls(int(conf.get('rows', default_rows)),
+                   tuple(column.lower() for column in conf.get('columns', ())),
+                   tuple(column.lower() for column in conf.get('unique', ())),
+                   {column.lower(): int(count) for column, count in conf.get('distinct', {}).items()})
+
+
+class ExplainFlag(NamedTuple):
+    check: str
+    alias: Optional[str]
+    detail: str
+
+
+class QueryExplainer:
+    """Estimates the cost of a generated statement without running it on the cluster
+
+    The statement is planned by an in memory SQLite database holding empty
+    stand-in tables of the tables it reads, with an index on the columns
+    each join looks rows up by. A join planned as a scan of its table has no
+    equality to hash on and runs as a nested loop on Redshift as well.
+    The mapping itself is checked for cartesian joins, non sargable
+    predicates and joins fanning out to many rows per key, using the table
+    statistics of the `explain` config section, and the cost score is the
+    number of rows the hash joins read and produce.
+    """
+
+    def __init__(self, options: Mapping[str, Any]) -> None:
+        self.default_rows = int(options.get('default_rows', DEFAULT_TABLE_ROWS))
+        self.max_fan_out = float(options.get('max_fan_out', DEFAULT_MAX_FAN_OUT))
+        self.tables = {name.lower(): TableStats.from_config(conf, self.default_rows)
+                       for name, conf in (options.get('tables') or {}).items()}
+
+    def explain(self, mapping: MetadataMapping, sql: str) -> Dict[str, Any]:
+        """method to plan a generated statement and flag the costly parts of its mapping
+
+        Args:
+            mapping (MetadataMapping): mapping the statement was rendered from
+            sql (str): generated statement
+
+        Returns:
+            Dict[str, Any]: `cost`, `rows`, `flags`, the sqlite `plan` lines and the `error`
+                the statement could not be planned with, if any
+        """
+        base_tables = self._base_tables(mapping)
+        keys = {_step.reference_table_alias.lower(): self._join_keys(_step.join_condition,
+                                                                     _step.reference_table_alias.lower())
+                for _step in mapping.joins if _step.reference_table_alias}
+
+        flags: List[ExplainFlag] = []
+        cartesian: Set[str] = set()
+        for _step in mapping.joins:
+            alias = (_step.reference_table_alias or '').lower()
+            if not alias or not _step.join_type:
+                continue
+            if _step.join_type == 'cross join':
+                cartesian.add(alias)
+                flags.append(ExplainFlag('cartesian_join', _step.reference_table_alias, 'cross join'))
+            elif not {ref.lower() for ref in referenced_aliases(_step.join_condition)} - {alias}:
+                cartesian.add(alias)
+                flags.append(ExplainFlag('cartesian_join', _step.reference_table_alias,
+                                         'the join condition does not read any other table'))
+            fan_out = self._fan_out(base_tables.get(alias), keys[alias])
+            if alias not in cartesian and fan_out is not None and fan_out > self.max_fan_out:
+                flags.append(ExplainFlag('join_fan_out', _step.reference_table_alias,
+                                         f'about {fan_out:.0f} rows per join key'))
+
+        conditions = [(_step.reference_table_alias, _step.join_condition) for _step in mapping.joins
+                      if _step.join_condition] + [(None, _filter.condition) for _filter in mapping.filters]
+        for alias, condition in conditions:
+            for predicate in conjuncts(condition):
+                reason = _non_sargable(tokenize(predicate))
+                if reason:
+                    flags.append(ExplainFlag('non_sargable_predicate', alias, f'{predicate} - {reason}'))
+
+        plan, error = self._plan(sql, mapping, base_tables, keys)
+        nested: Set[str] = set()
+        if plan is not None:
+            nested = self._nested_loops(plan, mapping, base_tables) - cartesian
+            flags.extend(ExplainFlag('nested_loop_join', _step.reference_table_alias,
+                                     'no equality join condition to hash the join on')
+                         for _step in mapping.joins
+                         if (_step.reference_table_alias or '').lower() in nested)
+
+        cost, rows = self._cost(mapping, base_tables, keys, cartesian, nested)
+        for flag in flags:
+            logger.warning('explain %s - %s %s', flag.check, flag.alias or '', flag.detail)
+        logger.info('estimated query cost %d for %d rows', cost, rows)
+        return {'cost': cost, 'rows': rows, 'flags': [flag._asdict() for flag in flags],
+                'plan': [row[3] for row in plan] if plan is not None else None, 'error': error}
+
+    def _rows(self, table: Optional[str]) -> int:
+        stats = self.tables.get((table or '').lower())
+        return stats.rows if stats is not None else self.default_rows
+
+    def _fan_out(self, table: Optional[str], keys: Set[str]) -> Optional[float]:
+        """rows of the table per value of its join keys, None when the statistics do not tell"""
+        stats = self.tables.get((table or '').lower())
+        if stats is None or not keys:
+            return None
+        if keys & set(stats.unique):
+            return 1.0
+        counts = [stats.distinct[key] for key in keys if stats.distinct.get(key)]
+        if not counts:
+            return None
+        return max(1.0, stats.rows / max(counts))
+
+    def _cost(self, mapping: MetadataMapping, base_tables: Dict[str, str], keys: Dict[str, Set[str]],
+              cartesian: Set[str], nested: Set[str]) -> Tuple[int, int]:
+        """rows read and produced by the joins in sheet order, and the rows of the result"""
+        rows = self._rows(base_tables.get((mapping.driving_table_alias or '').lower()))
+        cost = float(rows)
+        for _step in mapping.joins:
+            alias = (_step.reference_table_alias or '').lower()
+            if not alias or not _step.join_type:
+                continue
+            table_rows = self._rows(base_tables.get(alias))
+            if alias in cartesian:
+                cost += rows * table_rows
+                rows *= table_rows
+            elif alias in nested:
+                cost += rows * table_rows
+            else:
+                # build a hash table over the joined table and probe it once per row
+                cost += table_rows + rows
+                rows = int(rows * (self._fan_out(base_tables.get(alias), keys[alias]) or 1.0))
+        return int(cost), int(rows)
+
+    def _base_tables(self, mapping: MetadataMapping) -> Dict[str, str]:
+        """lower cased alias -> table it reads, the first table read by a subquery or WITH clause"""
+        ctes = {name.lower(): text for name, text in mapping.ctes}
+
+        def _table(reference: Optional[str]) -> Optional[str]:
+            seen = set()
+            while reference:
+                if reference.lower() in ctes and reference.lower() not in seen:
+                    seen.add(reference.lower())
+                    reference = _first_table(ctes[reference.lower()])
+                elif reference.lstrip().startswith('('):
+                    reference = _first_table(reference)
+                else:
+                    return reference
+            return None
+
+        tables = {}
+        if mapping.driving_table_alias:
+            tables[mapping.driving_table_alias.lower()] = _table(mapping.driving_table)
+        for _step in mapping.joins:
+            if _step.reference_table_alias:
+                tables[_step.reference_table_alias.lower()] = _table(_step.reference)
+        return {alias: table for alias, table in tables.items() if table}
+
+    def _join_keys(self, condition: Optional[str], alias: str) -> Set[str]:
+        """lower cased columns of the alias the condition compares for equality with other tables"""
+        keys = set()
+        for predicate in conjuncts(condition or ''):
+            comparison = _comparison(tokenize(predicate))
+            if comparison is None or comparison[1] != '=':
+                continue
+            left, _, right = comparison
+            for side, other in ((left, right), (right, left)):
+                column = _bare_column(side)
+                others = {token.text.lower() for i, token in enumerate(other[:-1]) if other[i + 1].text == '.'}
+                if column and column[0] == alias and others - {alias}:
+                    keys.add(column[1])
+        return keys
+
+    def _plan(self, sql: str, mapping: MetadataMapping, base_tables: Dict[str, str],
+              keys: Dict[str, Set[str]]) -> Tuple[Optional[List[Tuple]], Optional[str]]:
+        """method to run EXPLAIN QUERY PLAN over stand-in tables of the tables the statement reads"""
+        from sqlalchemy import create_engine, exc
+
+        cte_names = {name.lower() for name, _ in mapping.ctes}
+        columns: Dict[str, Set[str]] = {}
+        for table in referenced_tables(sql):
+            if table.lower() not in cte_names:
+                stats = self.tables.get(table.lower())
+                columns.setdefault(table.lower(), set(stats.columns if stats else ()))
+        indexes: Dict[str, Set[str]] = {}
+        for alias, table in base_tables.items():
+            if table.lower() not in columns:
+                continue
+            columns[table.lower()].update(column.lower() for column in re.findall(
+                rf'\b{re.escape(alias)}\.([A-Za-z_][\w$]*)', sql, re.IGNORECASE))
+            indexes.setdefault(table.lower(), set()).update(keys.get(alias, ()))
+        for table, stats in self.tables.items():
+            if table in columns:
+                indexes.setdefault(table, set()).update(stats.unique, stats.distinct)
+        driving_table = base_tables.get((mapping.driving_table_alias or '').lower(), '').lower()
+
+        functions: Set[str] = set()
+        error = None
+        for _ in range(MAX_EXPLAIN_ATTEMPTS):
+            engine = create_engine('sqlite://')
+            try:
+                with engine.connect() as connection:
+                    for name in functions:
+                        connection.connection.driver_connection.create_function(name, -1, _null)
+                    _create_stubs(connection, columns, indexes, self.tables)
+                    return connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).fetchall(), None
+            except exc.DBAPIError as excep:
+                message = str(excep.orig)
+                if message == error:
+                    break
+                error = message
+                if (match := _missing_function_pattern.search(message)):
+                    functions.add(match.group(1))
+                    continue
+                match = _missing_column_pattern.search(message)
+                if not match:
+                    break
+                qualifier, column = (match.group(1) or '').lower(), match.group(2).lower()
+                table = base_tables.get(qualifier, qualifier).lower() if qualifier else driving_table
+                if table not in columns:
+                    break
+                columns[table].add(column)
+            finally:
+                engine.dispose()
+        logger.warning('explain - the statement could not be planned by sqlite - %s', error)
+        return None, error
+
+    def _nested_loops(self, plan: List[Tuple], mapping: MetadataMapping, base_tables: Dict[str, str]) -> Set[str]:
+        """lower cased aliases the plan scans in full once per row of the tables before them"""
+        aliases = {alias for alias in base_tables} | {(mapping.driving_table_alias or '').lower()}
+        by_table: Dict[str, str] = {}
+        for alias, table in base_tables.items():
+            by_table.setdefault(table.lower(), alias)
+        loops = [row[3].split() for row in plan if row[1] == 0 and row[3].startswith(('SCAN ', 'SEARCH '))]
+        nested = set()
+        for words in loops[1:]:
+            name = words[1].lower()
+            alias = name if name in aliases else by_table.get(name)
+            if words[0] == 'SCAN' and alias:
+                nested.add(alias)
+        return nested
+
+
+def _null(*_: Any) -> None:
+    return None
+
+
+def _first_table(text: str) -> Optional[str]:
+    return next(iter(referenced_tables(text)), None)
+
+
+def _create_stubs(connection: Any, columns: Dict[str, Set[str]], indexes: Dict[str, Set[str]],
+                  tables: Dict[str, TableStats]) -> None:
+    """method to create the empty stand-in tables and their indexes"""
+    schemas = {table.split('.')[0] for table in columns if '.' in table} - set(SQLITE_SCHEMAS)
+    for schema in sorted(schemas):
+        connection.exec_driver_sql(f"ATTACH DATABASE ':memory:' AS \"{schema}\"")
+    for table, table_columns in columns.items():
+        schema, _, name = table.rpartition('.')
+        qualified = f'"{schema}"."{name}"' if schema else f'"{name}"'
+        definition = ', '.join(f'"{column}"' for column in sorted(table_columns | indexes.get(table, set())))
+        connection.exec_driver_sql(f'CREATE TABLE {qualified} ({definition or "_stub"})')
+        stats = tables.get(table)
+        for column in sorted(indexes.get(table, ())):
+            unique = 'UNIQUE ' if stats is not None and column in stats.unique else ''
+            index = f'"{schema}"."ix_{name}_{column}"' if schema else f'"ix_{name}_{column}"'
+            connection.exec_driver_sql(f'CREATE {unique}INDEX {index} ON "{name}" ("{column}")')
+
+
+def _comparison(tokens: List[Token]) -> Optional[Tuple[List[Token], str, List[Token]]]:
+    """left side, lower cased operator and right side of a comparison predicate"""
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token.text == '(':
+            depth += 1
+        elif token.text == ')':
+            depth -= 1
+        elif depth == 0 and token.text.lower() in COMPARISON_TOKENS:
+            end = i
+            while end + 1 < len(tokens) and tokens[end + 1].text in '=<>' and tokens[end + 1].end == tokens[end].end + 1:
+                end += 1
+            left = tokens[:i - 1] if i and tokens[i - 1].text.lower() == 'not' else tokens[:i]
+            return left, ''.join(token.text for token in tokens[i:end + 1]).lower(), tokens[end + 1:]
+    return None
+
+
+def _bare_column(tokens: List[Token]) -> Optional[Tuple[str, str]]:
+    """(lower cased alias, column) of a side that is a qualified column as is"""
+    while len(tokens) > 2 and tokens[0].text == '(' and tokens[-1].text == ')':
+        tokens = tokens[1:-1]
+    if len(tokens) == 3 and tokens[1].text == '.':
+        return tokens[0].text.lower(), tokens[2].text.strip('"').lower()
+    return None
+
+
+def _non_sargable(tokens: List[Token]) -> Optional[str]:
+    """why a predicate can not use the sort key or zone maps of the columns it reads, None if it can"""
+    comparison = _comparison(tokens)
+    if comparison is None:
+        return 'the columns are read through an expression' \
+            if any(token.text == '.' for token in tokens) else None
+    left, operator, right = comparison
+    if operator in ('like', 'ilike') and right and right[0].text.startswith(("'%", "'_")):
+        return 'a pattern starting with a wildcard'
+    sides = [side for side in (left, right) if any(token.text == '.' for token in side)]
+    if sides and not any(_bare_column(side) for side in sides):
+        return 'the columns are read through an expression'
+    return None
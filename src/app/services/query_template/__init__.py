@@ -0,0 +1 @@
+from .template import QueryTemplate, compile_template
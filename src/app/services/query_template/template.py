@@ -0,0 +1,152 @@
+import json
+import logging
+import re
+from typing import Any, Dict, Iterable, Iterator, Mapping, NamedTuple, Optional, Tuple
+
+from app.etl_exceptions import AutoETLException
+from app.services.query_builder import QueryBuilder
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_VERSION = 1
+# `${name}`, or `${name:default}`, written in the mapping cells
+_placeholder_pattern = re.compile(r'\$\{([A-Za-z_]\w*)(?::([^}]*))?\}')
+
+
+class QueryTemplate(NamedTuple):
+    # literal sql around the placeholders, one more chunk than placeholders
+    chunks: Tuple[str, ...]
+    names: Tuple[str, ...]
+    defaults: Dict[str, str]
+    # str.format string of the chunks, so an instance is filled in one C level call
+    format_string: str
+    # where the template was compiled from, e.g. the metadata file and the build tool
+    source: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def compile(cls, sql: str, parameters: Optional[Mapping[str, str]] = None,
+                defaults: Optional[Mapping[str, Any]] = None, **source: Any) -> 'QueryTemplate':
+        """method to compile generated sql into a template
+
+        Args:
+            sql (str): generated sql holding `${name}` or `${name:default}` placeholders
+            parameters (Optional[Mapping[str, str]]): placeholder name -> text of the sql it replaces,
+                e.g. `{"schema": "analytics_dev"}`, matched as a whole word
+            defaults (Optional[Mapping[str, Any]]): values of the placeholders left out when instantiating
+            **source (Any): where the template was compiled from, kept as is
+
+        Returns:
+            QueryTemplate
+        """
+        for name, text in (parameters or {}).items():
+            sql = re.sub(rf'(?<![\w$]){re.escape(text)}(?![\w$])', f'${{{name}}}', sql)
+
+        chunks, names, template_defaults, position = [], [], {}, 0
+        for match in _placeholder_pattern.finditer(sql):
+            chunks.append(sql[position:match.start()])
+            names.append(match.group(1))
+            if match.group(2) is not None:
+                template_defaults.setdefault(match.group(1), match.group(2))
+            position = match.end()
+        chunks.append(sql[position:])
+        template_defaults.update({name: str(value) for name, value in (defaults or {}).items()})
+
+        return cls(tuple(chunks), tuple(names), template_defaults, _format_string(chunks, names), source)
+
+    @property
+    def placeholders(self) -> Tuple[str, ...]:
+        """names of the placeholders, in order of first appearance"""
+        return tuple(dict.fromkeys(self.names))
+
+    def render(self, values: Optional[Mapping[str, Any]] = None) -> str:
+        """method to fill the placeholders of the template
+
+        Args:
+            values (Optional[Mapping[str, Any]]): placeholder name -> value, the defaults fill the others
+
+        Raises:
+            AutoETLException: Exception if a placeholder has no value
+
+        Returns:
+            str: sql
+        """
+        merged = {**self.defaults, **values} if values else self.defaults
+        try:
+            return self.format_string.format_map(merged)
+        except KeyError:
+            missing = [name for name in self.placeholders if name not in merged]
+            logger.error("No value for the template placeholders - %s", missing)
+            raise AutoETLException("No value for the template placeholders", missing)
+
+    def render_many(self, rows: Iterable[Mapping[str, Any]]) -> Iterator[str]:
+        """method to fill the template once per row of values
+
+        Args:
+            rows (Iterable[Mapping[str, Any]]): placeholder values of each instance
+
+        Returns:
+            Iterator[str]: sql of each instance
+        """
+        return (self.render(values) for values in rows)
+
+    def save(self, template_file_path: str) -> None:
+        """method to store the template as json
+
+        Args:
+            template_file_path (str): path of the template file
+        """
+        with open(template_file_path, 'w') as fp:
+            json.dump({'version': TEMPLATE_VERSION, 'chunks': self.chunks, 'names': self.names,
+                       'defaults': self.defaults, 'source': self.source or {}}, fp, indent=2)
+
+    @classmethod
+    def load(cls, template_file_path: str) -> 'QueryTemplate':
+        """method to read a template stored by `save`
+
+        Args:
+            template_file_path (str): path of the template file
+
+        Raises:
+            AutoETLException: Exception if the file is not a template
+
+        Returns:
+            QueryTemplate
+        """
+        try:
+            with open(template_file_path) as fp:
+                document = json.load(fp)
+            chunks, names = document['chunks'], document['names']
+        except (OSError, ValueError, KeyError, TypeError) as excep:
+            logger.error("Not a query template file - %s", template_file_path)
+            raise AutoETLException(f"Not a query template file - {template_file_path}", excep.args)
+        if document.get('version') != TEMPLATE_VERSION or len(chunks) != len(names) + 1:
+            logger.error("Query template file of another version - %s", template_file_path)
+            raise AutoETLException(f"Query template file of another version - {template_file_path}")
+        return cls(tuple(chunks), tuple(names), document.get('defaults') or {},
+                   _format_string(chunks, names), document.get('source') or {})
+
+
+def _format_string(chunks: Iterable[str], names: Iterable[str]) -> str:
+    chunks = [chunk.replace('{', '{{').replace('}', '}}') for chunk in chunks]
+    return ''.join(chunk + '{' + name + '}' for chunk, name in zip(chunks, names)) + chunks[-1]
+
+
+def compile_template(builder: QueryBuilder) -> QueryTemplate:
+    """method to build the sql of a metadata file once and compile it into a template
+
+    The `template` config section sets the `parameters` replaced by
+    placeholders and the `defaults` of the placeholders.
+
+    Args:
+        builder (QueryBuilder): builder of the metadata file, any build tool
+
+    Returns:
+        QueryTemplate
+    """
+    sql = builder.build()
+    conf = builder.config_parser.validate_file().get('template') or {}
+    template = QueryTemplate.compile(sql, conf.get('parameters'), conf.get('defaults'),
+                                     metadata_file=builder.metadata_file_path, tool=builder.tool)
+    logger.info("compiled query template of %s with placeholders %s",
+                builder.metadata_file_path, list(template.placeholders))
+    return template
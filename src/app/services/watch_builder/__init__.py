@@ -0,0 +1 @@
+from .watch_builder import WatchBuilder
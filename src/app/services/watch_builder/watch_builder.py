@@ -0,0 +1,151 @@
+import dataclasses
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic.dataclasses import dataclass
+
+from app.etl_exceptions import AutoETLException
+from app.services.batch_builder.batch_builder import (BUILDERS,
+                                                      metadata_root,
+                                                      output_file_names,
+                                                      resolve_metadata_files)
+from app.services.query_builder import QueryBuilder
+from app.utils import file_signature
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.5
+
+
+@dataclass
+class WatchBuilder:
+    """Keeps one warm builder per metadata file and rebuilds the files changed on disk
+
+    The builders stay in memory between builds, so the config and the parsed
+    mapping of a workbook are only read again once their file changed. The
+    sql file names are relative to a directory fixed on the first build, so
+    adding a workbook does not rename the sql files of the others.
+    """
+    metadata_path: str
+    config_file_path: str
+    output_dir: str
+    cache_dir: Optional[str] = None
+    tool: str = QueryBuilder.tool
+    interval: float = DEFAULT_INTERVAL
+    builders: Dict[str, Any] = dataclasses.field(init=False)
+    signatures: Dict[str, Tuple[int, int]] = dataclasses.field(init=False)
+    config_signature: Optional[Tuple[int, int]] = dataclasses.field(init=False)
+    base_dir: Optional[str] = dataclasses.field(init=False)
+
+    def __post_init__(self):
+        self.builders = {}
+        self.signatures = {}
+        self.config_signature = None
+        self.base_dir = None
+
+    def run(self, max_polls: Optional[int] = None) -> None:
+        """Method to build every metadata file, then rebuild them as they change
+
+        Args:
+            max_polls (Optional[int]): stop after this many polls, runs until interrupted when None
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        logger.info("Watching %s, rebuilding into %s",
+                    self.metadata_path, self.output_dir)
+        self.build(self.poll())
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            time.sleep(self.interval)
+            changed = self.poll()
+            if changed:
+                self.build(changed)
+            polls += 1
+
+    def poll(self) -> List[str]:
+        """Method to find the metadata files added or modified since the last poll
+
+        A file is only reported once its signature holds still for one
+        interval, so workbooks are not read half written. Every file is
+        reported when the config changed.
+
+        Returns:
+            List[str]: changed metadata file paths
+        """
+        current = self._scan()
+        changed = [path for path, signature in current.items()
+                   if self.signatures.get(path) != signature]
+        if changed:
+            time.sleep(self.interval)
+            settled = self._scan()
+            changed = [path for path in changed
+                       if path in settled and settled[path] == current[path]]
+
+        for path in set(self.signatures) - set(current):
+            logger.info("Metadata file removed - %s", path)
+            self.builders.pop(path, None)
+        self.signatures = {**{path: signature for path, signature in self.signatures.items()
+                              if path in current},
+                           **{path: current[path] for path in changed}}
+
+        config_signature = file_signature(self.config_file_path) \
+            if os.path.exists(self.config_file_path) else None
+        if config_signature != self.config_signature:
+            self.config_signature = config_signature
+            changed = sorted(self.signatures)
+        return changed
+
+    def build(self, metadata_files: List[str]) -> List[Dict]:
+        """Method to rebuild the sql files of the given metadata files
+
+        A failing metadata file is logged and reported, the others are still built.
+
+        Args:
+            metadata_files (List[str]): metadata file paths
+
+        Returns:
+            List[Dict]: result of each build, as in the batch summary
+        """
+        if self.base_dir is None:
+            self.base_dir = os.path.commonpath(
+                [metadata_root(self.metadata_path),
+                 *(os.path.dirname(os.path.abspath(path)) for path in self.signatures)])
+        names = dict(zip(sorted(self.signatures),
+                     output_file_names(sorted(self.signatures), self.base_dir)))
+        results = []
+        for metadata_file in metadata_files:
+            output_file = os.path.join(self.output_dir, names[metadata_file])
+            builder = self.builders.get(metadata_file)
+            if builder is None:
+                builder = self.builders[metadata_file] = BUILDERS[self.tool](
+                    metadata_file, self.config_file_path, self.cache_dir)
+            started = time.perf_counter()
+            try:
+                builder.run(output_file)
+            except Exception as excep:
+                logger.error("Failed to build query for %s - %s",
+                             metadata_file, excep.args)
+                results.append({'metadata_file': metadata_file, 'status': 'failed',
+                                'error': ' '.join(str(arg) for arg in excep.args)
+                                or type(excep).__name__})
+                continue
+            logger.info("Rebuilt %s in %.0f ms", output_file,
+                        (time.perf_counter() - started) * 1000)
+            results.append({'metadata_file': metadata_file, 'status': 'success',
+                            'output_file': output_file})
+        return results
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        try:
+            metadata_files = resolve_metadata_files(self.metadata_path)
+        except AutoETLException:
+            return {}
+        signatures = {}
+        for path in metadata_files:
+            try:
+                signatures[path] = file_signature(path)
+            except FileNotFoundError:
+                # removed between the listing and the stat, picked up on the next poll
+                continue
+        return signatures
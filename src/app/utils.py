@@ -1,20 +1,40 @@
 import json
 import logging
 import os
-from typing import Dict, List
+import re
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
 
-import pandas as pd
 from pydantic import Json
 
 from app.etl_exceptions import AutoETLException
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from app.services.config_parser.models import MetadataMapping
+
 logger = logging.getLogger(__name__)
 
 JOIN_TYPES = ('inner join', 'left join', 'right join',
               'cross join', 'full outer join')
+# record key holding the sheet row number of a record, the header is row 1
+SHEET_ROW_KEY = '_sheet_row'
 
 transform_format = '{func}({exp})'
 
+alias_reference_pattern = re.compile(r'\b([A-Za-z_]\w*)\s*\.\s*[A-Za-z_"]')
+# `alias.column`, not `schema.function(...)`
+column_qualifier_pattern = re.compile(r'\b([A-Za-z_]\w*)\s*\.\s*(?![A-Za-z_]\w*\s*\()[A-Za-z_"]')
+subquery_start_pattern = re.compile(r'\(\s*(?:select|with)\b', re.IGNORECASE)
+string_literal_pattern = re.compile(r"'(?:[^']|'')*'")
+column_reference_pattern = re.compile(r'\b([A-Za-z_]\w*)\s*\.\s*([A-Za-z_]\w*|"(?:[^"]|"")*")')
+# `a.x = b.y`, as a whole predicate
+equi_join_pattern = re.compile(r'([A-Za-z_]\w*)\.([A-Za-z_]\w*)\s*=\s*([A-Za-z_]\w*)\.([A-Za-z_]\w*)')
+# a name read by FROM/JOIN, not a parenthesised subquery or a function call
+table_reference_pattern = re.compile(
+    r'\b(?:from|join)\s+([A-Za-z_][\w$]*(?:\.[A-Za-z_][\w$]*)?)\b(?!\s*\()', re.IGNORECASE)
+
 
 def is_valid_file(file_path: str) -> bool:
     """ method to check if a file path is valid or not
@@ -28,7 +48,24 @@ def is_valid_file(file_path: str) -> bool:
     return True
 
 
-def excel_to_json(excel_file: pd.ExcelFile, sheet_name: str, _orient) -> Json:
+def file_signature(file_path: str) -> Tuple[int, int]:
+    """method to get a cheap change marker of a file, without reading it
+
+    Args:
+        file_path (str): path to file
+
+    Returns:
+        Tuple[int, int]: modification time in ns and size of the file, for a directory the
+            latest modification time and total size of the files it holds
+    """
+    if os.path.isdir(file_path):
+        stats = [entry.stat() for entry in os.scandir(file_path) if entry.is_file()]
+        return max((stat.st_mtime_ns for stat in stats), default=0), sum(stat.st_size for stat in stats)
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def excel_to_json(excel_file: 'pd.ExcelFile', sheet_name: str, _orient) -> Json:
     """method to parse excel to json
 
     Args:
@@ -38,60 +75,187 @@ def excel_to_json(excel_file: pd.ExcelFile, sheet_name: str, _orient) -> Json:
     Returns:
         json: returns json object of the excel file
     """
+    # pandas is only needed by the pandas metadata loader and takes a while to import
+    import pandas as pd
+
     logger.debug('parsing excel to json')
-    if sheet_name == "select_sources":
-        select_conf = json.loads(pd.read_excel(
-            excel_file, sheet_name).to_json(orient=_orient))
-        return construct_select_transform(select_conf)
     return json.loads(pd.read_excel(excel_file, sheet_name).to_json(orient=_orient))
 
 
-def construct_select_transform(select_conf: List[Dict]) -> List[Dict]:
-    """method to construct the select transformation conf
+def sheet_to_records(worksheet: Any) -> List[Dict]:
+    """method to stream the rows of a worksheet into records keyed by the header row
+
+    Args:
+        worksheet (ReadOnlyWorksheet): openpyxl worksheet opened in read only mode
+
+    Returns:
+        List[Dict]: one record per non empty row, with its row number under `SHEET_ROW_KEY`
+    """
+    logger.debug('streaming rows of sheet %s', worksheet.title)
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return []
+    columns = [(_pos, _name) for _pos, _name in enumerate(header)
+               if _name is not None]
+    records = []
+    for row_number, row in enumerate(rows, 2):
+        if all(value is None for value in row):
+            continue
+        width = len(row)
+        record = {_name: row[_pos] if _pos < width else None
+                  for _pos, _name in columns}
+        record[SHEET_ROW_KEY] = row_number
+        records.append(record)
+    return records
+
+
+def referenced_aliases(text: Optional[str]) -> Set[str]:
+    """ method to find the table aliases a sql expression qualifies columns with
+
+    Args:
+        text (Optional[str]): sql expression or condition
+
+    Returns:
+        Set[str]: aliases referenced as `alias.column`, string literals are ignored
+    """
+    if not text:
+        return set()
+    return set(alias_reference_pattern.findall(string_literal_pattern.sub("''", text)))
+
+
+def qualified_aliases(text: Optional[str]) -> Set[str]:
+    """ method to find the aliases a condition qualifies columns with, outside of its subqueries
+
+    Unlike `referenced_aliases`, qualifiers inside a parenthesised subquery,
+    e.g. `schema` in `id in (select id from schema.dept)`, and of function
+    calls, e.g. `schema.fn(col)`, are not aliases of the mapping.
 
     Args:
-        select_conf (List[Dict]): select transformations from excel mapping
+        text (Optional[str]): sql condition
 
     Returns:
-        List[Dict]
+        Set[str]: aliases referenced as `alias.column`, string literals are ignored
     """
-    _conf = []
-    for _select in select_conf:
-        _select['transformation'] = transform_format.format(
-            func=_select['transformation'], exp=_select['arguments'])
-        _conf.append(_select)
-    return _conf
+    if not text:
+        return set()
+    text = string_literal_pattern.sub("''", text)
+    outer, position = [], 0
+    for match in subquery_start_pattern.finditer(text):
+        if match.start() < position:
+            continue
+        outer.append(text[position:match.start()])
+        depth, position = 0, match.start()
+        while position < len(text):
+            depth += {'(': 1, ')': -1}.get(text[position], 0)
+            position += 1
+            if depth == 0:
+                break
+    outer.append(text[position:])
+    return set(column_qualifier_pattern.findall(' '.join(outer)))
+
 
+def referenced_columns(text: Optional[str]) -> Set[Tuple[str, str]]:
+    """ method to find the qualified columns a sql expression reads
 
-def validate_joins_mapping(joins_and_filters_conf: Dict[str, Dict]) -> None:
+    Args:
+        text (Optional[str]): sql expression or condition
+
+    Returns:
+        Set[Tuple[str, str]]: (alias, column) of each `alias.column`, string literals are ignored
+    """
+    if not text:
+        return set()
+    return {(alias, column.strip('"')) for alias, column in
+            column_reference_pattern.findall(string_literal_pattern.sub("''", text))}
+
+
+def referenced_tables(text: Optional[str]) -> List[str]:
+    """ method to find the tables a query reads, in the order they appear
+
+    Args:
+        text (Optional[str]): sql query or subquery
+
+    Returns:
+        List[str]: names following FROM and JOIN, string literals are ignored
+    """
+    if not text:
+        return []
+    return table_reference_pattern.findall(string_literal_pattern.sub("''", text))
+
+
+def collect_joins_mapping_errors(mapping: 'MetadataMapping') -> List[str]:
+    """Method to check the joins mapping conf in one pass and report every problem found
+
+    The checks run over the sheet columns, so a mapping with hundreds of join
+    steps is fixed in one iteration instead of one rerun per bad row.
+
+    Args:
+        mapping (MetadataMapping): mapping model loaded from metadata excel file
+
+    Returns:
+        List[str]: one message per problem, with the excel row it was found on
+    """
+    errors: List[str] = []
+    if not mapping.joins:
+        return ['joins_and_filters sheet has no mappings']
+
+    aliases, join_types, ref_tables, ref_subqueries, join_conditions = zip(
+        *(_step[:5] for _step in mapping.joins))
+    # steps built without sheet rows are numbered as if no row was blank
+    rows = [_step.row or row for row, _step in enumerate(mapping.joins, 2)]
+
+    if mapping.driving_table is None:
+        errors.append(f'row {rows[0]}: driving_table is missing')
+    if mapping.driving_table_alias is None:
+        errors.append(f'row {rows[0]}: driving_table_alias is missing')
+
+    errors.extend(f'row {row}: join_type {join_type!r} is null or not supported'
+                  for row, join_type in zip(rows, join_types) if join_type not in JOIN_TYPES)
+    errors.extend(f'row {row}: reference_table or reference_subquery is missing'
+                  for row, table, subquery in zip(rows, ref_tables, ref_subqueries)
+                  if table is None and subquery is None)
+    errors.extend(f'row {row}: reference_table_alias is missing'
+                  for row, alias in zip(rows, aliases) if alias is None)
+    errors.extend(f'row {row}: join_condition is missing for {join_type}'
+                  for row, join_type, condition in zip(rows, join_types, join_conditions)
+                  if condition is None and join_type in JOIN_TYPES and join_type != 'cross join')
+
+    declared = Counter(alias.lower() for alias in (mapping.driving_table_alias, *aliases)
+                       if alias is not None)
+    errors.extend(f'alias {alias!r} is declared {count} times'
+                  for alias, count in declared.items() if count > 1)
+
+    filter_conditions = [None] * len(mapping.joins)
+    for _filter in mapping.filters:
+        filter_conditions[_filter.step] = _filter.condition
+    for row, join_condition, filter_condition in zip(rows, join_conditions, filter_conditions):
+        for column, condition in (('join_condition', join_condition),
+                                  ('filter_condition', filter_condition)):
+            errors.extend(f'row {row}: {column} references undeclared alias {alias!r}'
+                          for alias in sorted(qualified_aliases(condition))
+                          if alias.lower() not in declared)
+    return errors
+
+
+def validate_joins_mapping(mapping: 'MetadataMapping') -> None:
     """Method to validate the joins mapping conf
 
     Args:
-        joins_and_filters_conf (List): Joins configurations loaded from metadata excel file
+        mapping (MetadataMapping): mapping model loaded from metadata excel file
+
+    Raises:
+        AutoETLException: Exception listing every problem found in the mappings
     """
 
     logger.info('validating and processing joins mapping conf')
-    num_joins = len(joins_and_filters_conf)
+    num_joins = len(mapping.joins)
     logger.info(
         'found %d mappings in the configurations', num_joins)
-    for _index in joins_and_filters_conf:
-        _map = joins_and_filters_conf[_index]
-        if _index == 0:
-            if _map['driving_table'] is None or \
-                    (_map['reference_table'] is None and _map['reference_subquery'] is None):
-                logger.error(
-                    'joins and filters not provided properly. Please validate the mappings file')
-                raise AutoETLException(
-                    'joins and filters not provided properly. Please validate the mappings file')
-
-        else:
-            if _map['reference_table'] is None and _map['reference_subquery'] is None:
-                logger.error(
-                    'joins and filters not provided properly. Please validate the mappings file')
-                raise AutoETLException(
-                    'joins and filters not provided properly. Please validate the mappings file')
-        if _map['join_type'] is None or _map['join_type'] not in JOIN_TYPES:
-            logger.error(
-                'Either Join type is null or not supported. Please check the mappings file')
-            raise AutoETLException(
-                'Either Join type is null or not supported. Please check the mappings file')
+    errors = collect_joins_mapping_errors(mapping)
+    if errors:
+        for error in errors:
+            logger.error('joins and filters mapping - %s', error)
+        raise AutoETLException(
+            f'joins and filters not provided properly, found {len(errors)} errors. '
+            'Please validate the mappings file', errors)
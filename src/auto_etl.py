@@ -1,10 +1,13 @@
+import json
 import logging
 import sys
 from argparse import ArgumentParser
 
-from app.etl_exceptions import AutoETLException
 from app.logger import setup_logging
-from app.services.query_builder import QueryBuilder
+
+# the builders are imported once the arguments are parsed, so `--help` and
+# argument errors return without loading them
+TOOLS = ["query-builder", "pipeline-builder"]
 
 if __name__ == "__main__":
     setup_logging('logs')
@@ -13,20 +16,118 @@ if __name__ == "__main__":
     parser = ArgumentParser(description="Auto ETL")
 
     parser.add_argument("-t", "--tool", dest="tool", required=True,
-                        help="tool that needs to be used", choices=["query-builder", "pipeline-builder"])
-    parser.add_argument("-m", "--meta-file", dest="meta_file", required='query-builder' in sys.argv,
-                        help="absolute path of the meta file", metavar="<path to meta file>")
+                        help="tool that needs to be used", choices=TOOLS)
+    parser.add_argument("-m", "--meta-file", dest="meta_file", required='--serve' not in sys.argv,
+                        help="absolute path of the meta file, or a directory, glob pattern or manifest "
+                        "file listing meta files to build in batch", metavar="<path to meta file>")
     parser.add_argument("-c", "--config-file", dest="config_file", required=True,
                         help="absolute path of the config file", metavar="<path to config file>")
+    parser.add_argument("-o", "--output-dir", dest="output_dir", default="output",
+                        help="directory the sql files are written to in batch mode", metavar="<output dir>")
+    parser.add_argument("--output-file", dest="output_file", default=None,
+                        help="file the sql is streamed to, stdout when not set", metavar="<sql file>")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=None,
+                        help="number of worker processes used in batch mode", metavar="<workers>")
+    parser.add_argument("--cache-dir", dest="cache_dir", default=None,
+                        help="directory of the compilation cache, .auto_etl_cache by default",
+                        metavar="<cache dir>")
+    parser.add_argument("--no-cache", dest="no_cache", action="store_true",
+                        help="always rebuild, without reading or writing the compilation cache")
+    parser.add_argument("--profile", dest="profile", action="store_true",
+                        help="record per stage durations, counts and memory peaks as json")
+    parser.add_argument("--profile-stats", dest="profile_stats", default=None,
+                        help="with --profile, dump the cProfile stats of the hottest stage to this file "
+                        "(a directory of one file per meta file in batch mode)", metavar="<path>")
+    parser.add_argument("--explain", dest="explain", action="store_true",
+                        help="plan the generated sql against stand-in tables and report its cost and "
+                        "costly joins/filters as json")
+    parser.add_argument("--lineage", dest="lineage", default=None,
+                        help="update the column lineage index file with the built meta files, "
+                        "queried with src/lineage.py", metavar="<index file>")
+    parser.add_argument("--share-subqueries", dest="share_subqueries", action="store_true",
+                        help="in batch mode, report the subqueries and filtered tables several meta files "
+                        "compute, materialised once when shared_subqueries.materialize is configured. Temp tables only "
+                        "exist in one session: run the shared subqueries file and the files reading them in the same "
+                        "session")
+    parser.add_argument("--template", dest="template", default=None,
+                        help="compile the meta file into a query template file instead of writing the sql, "
+                        "instantiated with src/instantiate.py", metavar="<template file>")
+    parser.add_argument("--watch", dest="watch", action="store_true",
+                        help="keep running and rebuild the meta files into the output dir as they change")
+    parser.add_argument("--interval", dest="interval", type=float, default=0.5,
+                        help="seconds between two checks of the meta files in watch mode", metavar="<seconds>")
+    parser.add_argument("--serve", dest="serve", default=None,
+                        help="run a local compile service answering POST /compile requests",
+                        metavar="<host:port>")
+    parser.add_argument("--serve-root", dest="serve_root", default=None,
+                        help="directory the compile service reads meta files from, relative paths are "
+                        "resolved against it (default the working directory)", metavar="<dir>")
 
     args = parser.parse_args()
 
+    from app.etl_exceptions import AutoETLException
+    from app.services.batch_builder import BatchBuilder, is_batch_path
+    from app.services.batch_builder.batch_builder import BUILDERS
+    from app.services.compile_cache.cache import DEFAULT_CACHE_DIR
+
+    # batch builds write one sql file per meta file into the output dir
+    if args.meta_file and is_batch_path(args.meta_file):
+        for option, value in (('--output-file', args.output_file), ('--template', args.template)):
+            if value is not None:
+                parser.error(f"{option} needs a single meta file, a batch writes its sql files to --output-dir")
+
+    cache_dir = None if args.no_cache else args.cache_dir or DEFAULT_CACHE_DIR
+
     try:
-        if args.tool == 'query-builder':
-            if args.meta_file and args.config_file:
-                QueryBuilder(args.meta_file, args.config_file).run()
+        if args.serve:
+            from app.api.server import DEFAULT_HOST, CompileService, make_server
+
+            host, _, port = args.serve.rpartition(':')
+            server = make_server(CompileService(args.config_file, cache_dir, args.tool, args.serve_root),
+                                 host or DEFAULT_HOST, int(port))
+            logger.info("Compile service listening on %s:%d", *server.server_address[:2])
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                server.server_close()
+        elif args.watch:
+            from app.services.watch_builder import WatchBuilder
+
+            try:
+                WatchBuilder(args.meta_file, args.config_file, args.output_dir,
+                             cache_dir, args.tool, args.interval).run()
+            except KeyboardInterrupt:
+                logger.info("Stopped watching %s", args.meta_file)
+        elif is_batch_path(args.meta_file):
+            summary = BatchBuilder(args.meta_file, args.config_file, args.output_dir,
+                                   args.workers, cache_dir, args.profile,
+                                   args.profile_stats, args.tool, args.explain, args.lineage,
+                                   args.share_subqueries).run()
+            if summary['failed']:
+                sys.exit(1)
         else:
-            pass
+            builder = BUILDERS[args.tool](args.meta_file, args.config_file, cache_dir,
+                                          args.profile, args.profile_stats, args.explain)
+            try:
+                if args.template:
+                    from app.services.query_template import compile_template
+
+                    compile_template(builder).save(args.template)
+                else:
+                    builder.run(args.output_file)
+                if args.lineage:
+                    from app.services.lineage import LineageIndex
+
+                    index = LineageIndex(args.lineage)
+                    try:
+                        index.update([args.meta_file])
+                    finally:
+                        index.close()
+            finally:
+                if builder.profile_report is not None:
+                    print(json.dumps(builder.profile_report), file=sys.stderr)
+                if builder.explain_report is not None:
+                    print(json.dumps(builder.explain_report), file=sys.stderr)
     except AutoETLException as excep:
         logger.error("Auto ETL exception - %s", excep.args)
         sys.exit(1)
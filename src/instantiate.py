@@ -0,0 +1,75 @@
+import csv
+import json
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+
+# the sql goes to stdout, only warnings and errors are logged
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr,
+                        format='%(levelname)s:     %(name)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    parser = ArgumentParser(description="Auto ETL query template instantiation")
+    parser.add_argument("template", help="template file compiled with auto_etl.py --template",
+                        metavar="<template file>")
+    parser.add_argument("-p", "--param", dest="params", action="append", default=[],
+                        help="placeholder value shared by every instance", metavar="<name=value>")
+    parser.add_argument("--params-file", dest="params_file", default=None,
+                        help="json lines or csv file of placeholder values, one instance per row",
+                        metavar="<path>")
+    parser.add_argument("-o", "--output-dir", dest="output_dir", default=None,
+                        help="write one <n>.sql file per instance to this directory", metavar="<output dir>")
+    parser.add_argument("--output-file", dest="output_file", default=None,
+                        help="file the instances are written to, stdout when not set", metavar="<sql file>")
+    parser.add_argument("--list", dest="list", action="store_true",
+                        help="print the placeholders of the template and their defaults")
+
+    args = parser.parse_args()
+
+    from app.etl_exceptions import AutoETLException
+    from app.services.query_template import QueryTemplate
+
+    try:
+        template = QueryTemplate.load(args.template)
+        if args.list:
+            for name in template.placeholders:
+                print(f"{name}\t{template.defaults.get(name, '')}")
+            sys.exit(0)
+
+        shared = {}
+        for param in args.params:
+            name, separator, value = param.partition('=')
+            if not separator:
+                parser.error(f"--param {param!r} is not <name>=<value>")
+            shared[name] = value
+
+        rows = [{}]
+        if args.params_file:
+            with open(args.params_file, newline='') as fp:
+                if args.params_file.endswith('.csv'):
+                    rows = list(csv.DictReader(fp))
+                else:
+                    rows = [json.loads(line) for line in fp if line.strip()]
+
+        instances = template.render_many({**shared, **row} for row in rows)
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            width = len(str(len(rows)))
+            for number, sql in enumerate(instances, 1):
+                with open(os.path.join(args.output_dir, f'{number:0{width}d}.sql'), 'w') as fp:
+                    fp.write(sql)
+        else:
+            output = open(args.output_file, 'w') if args.output_file else sys.stdout
+            try:
+                for number, sql in enumerate(instances, 1):
+                    if len(rows) > 1:
+                        output.write(f'-- instance: {number}\n')
+                    output.write(sql)
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+    except AutoETLException as excep:
+        logger.error("Auto ETL exception - %s", excep.args)
+        sys.exit(1)
@@ -0,0 +1,57 @@
+import json
+import logging
+import sys
+from argparse import ArgumentParser
+
+# queries answer on stdout, only warnings and errors are logged
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr,
+                        format='%(levelname)s:     %(name)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    parser = ArgumentParser(description="Auto ETL column lineage index")
+    parser.add_argument("--index", dest="index", default=None,
+                        help="lineage index file, .auto_etl_lineage.db by default", metavar="<index file>")
+    parser.add_argument("--json", dest="json", action="store_true",
+                        help="print the lineage rows as json lines")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index the meta files added or changed since the last build")
+    build.add_argument("-m", "--meta-file", dest="meta_file", required=True,
+                       help="meta file, or a directory, glob pattern or manifest file listing meta files",
+                       metavar="<path to meta file>")
+    build.add_argument("--prune", dest="prune", action="store_true",
+                       help="also drop the meta files that no longer exist")
+    readers = commands.add_parser("readers", help="list the mappings reading a source column or table")
+    readers.add_argument("source", help="schema.table.column, or schema.table")
+    sources = commands.add_parser("sources", help="list the source columns a target column or table reads")
+    sources.add_argument("target", help="schema.table.column, or schema.table")
+
+    args = parser.parse_args()
+
+    from app.etl_exceptions import AutoETLException
+    from app.services.batch_builder import resolve_metadata_files
+    from app.services.lineage import DEFAULT_INDEX_PATH, LineageIndex
+
+    index = LineageIndex(args.index or DEFAULT_INDEX_PATH)
+    try:
+        if args.command == "build":
+            counts = index.update(resolve_metadata_files(args.meta_file))
+            if args.prune:
+                counts['pruned'] = index.prune()
+            print(json.dumps(counts))
+            if counts['failed']:
+                sys.exit(1)
+        else:
+            rows = index.readers(args.source) if args.command == "readers" else index.sources(args.target)
+            for row in rows:
+                if args.json:
+                    print(json.dumps(row))
+                else:
+                    target = '.'.join(part for part in (row['target_table'], row['target_column']) if part)
+                    print(f"{row['metadata_file']}\t{target}\t{row['usage']}\t"
+                          f"{row['source_table']}.{row['source_column']}")
+    except AutoETLException as excep:
+        logger.error("Auto ETL exception - %s", excep.args)
+        sys.exit(1)
+    finally:
+        index.close()
@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.etl_exceptions import AutoETLException  # noqa: E402
+from app.services.config_parser import (Filter, JoinStep, MetadataMapping,  # noqa: E402
+                                       SelectColumn, TargetColumn, TargetTable)
+from app.services.query_builder import get_dialect  # noqa: E402
+from app.services.query_builder.backfill import Backfill, _range_bounds  # noqa: E402
+
+
+def build_mapping(*joins: JoinStep, expression: str = 'a.day') -> MetadataMapping:
+    """method to build a mapping loading one driving table column flagged as partition key"""
+    return MetadataMapping(
+        's.a', 'a', joins, (Filter('a.id > 0', 0),), (SelectColumn('day', expression, None, 'a.day', 's.a', 'a'),),
+        TargetTable('target', 's', (TargetColumn('day', 'date', partition_key='Y'),)))
+
+
+class RangeBoundsTest(unittest.TestCase):
+
+    def test_cuts_dates_by_interval_with_a_shorter_last_chunk(self):
+        self.assertEqual(_range_bounds('2024-01-31', '2024-04-15', '1 month'),
+                         [("'2024-01-31'", "'2024-02-29'"), ("'2024-02-29'", "'2024-03-31'"),
+                          ("'2024-03-31'", "'2024-04-15'")])
+        self.assertEqual(_range_bounds('2024-01-01', '2024-01-10', '1 week'),
+                         [("'2024-01-01'", "'2024-01-08'"), ("'2024-01-08'", "'2024-01-10'")])
+
+    def test_cuts_integers_by_interval_with_a_shorter_last_chunk(self):
+        self.assertEqual(_range_bounds(0, 25, 10), [('0', '10'), ('10', '20'), ('20', '25')])
+
+    def test_refuses_integer_range_without_interval(self):
+        with self.assertRaises(ValueError):
+            _range_bounds(0, 25, None)
+
+    def test_last_chunk_is_half_open(self):
+        backfill = Backfill.from_config({'backfill': {'start': 0, 'end': 25, 'interval': 10}})
+        partition = backfill.partition_column(build_mapping())
+        last = backfill.chunk_mapping(build_mapping(), backfill.chunks[-1], partition, '')
+        self.assertEqual(last.filters[-1].condition, 'a.day >= 20 AND a.day < 25')
+        self.assertEqual([chunk.name for chunk in backfill.chunks], ['chunk_001', 'chunk_002', 'chunk_003'])
+
+
+class ChunkMappingTest(unittest.TestCase):
+
+    def test_bounds_left_join_equal_on_the_partition_column(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.day = a.day'),
+                                JoinStep('c', 'left join', 's.c', None, 'c.id = a.c_id'),
+                                JoinStep('d', 'inner join', None, 'select * from s.d', 'd.b_day = b.day'))
+        backfill = Backfill.from_config({'backfill': {'start': '2024-01-01', 'end': '2024-03-01'}})
+        chunked = backfill.chunk_mapping(mapping, backfill.chunks[0], backfill.partition_column(mapping), '')
+        self.assertEqual(chunked.joins[0].join_condition,
+                         "b.day = a.day AND b.day >= '2024-01-01' AND b.day < '2024-02-01'")
+        self.assertEqual(chunked.joins[1], mapping.joins[1])
+        self.assertEqual(chunked.joins[2].reference_subquery, "SELECT * FROM (select * from s.d) AS d "
+                                                              "WHERE d.b_day >= '2024-01-01' AND d.b_day < '2024-02-01'")
+        self.assertEqual(chunked.filters[-1].condition, "a.day >= '2024-01-01' AND a.day < '2024-02-01'")
+
+    def test_bounds_hash_buckets_on_the_driving_table_only(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.day = a.day'))
+        backfill = Backfill.from_config({'backfill': {'buckets': 4, 'column': 'day'}})
+        self.assertEqual([chunk.bucket for chunk in backfill.chunks], [0, 1, 2, 3])
+        chunked = backfill.chunk_mapping(mapping, backfill.chunks[2], backfill.partition_column(mapping),
+                                         get_dialect('redshift').hash_bucket)
+        self.assertEqual(chunked.filters[-1].condition, 'COALESCE(MOD(ABS(FNV_HASH(a.day)), 4), 0) = 2')
+        self.assertEqual(chunked.joins, mapping.joins)
+
+
+class PartitionColumnTest(unittest.TestCase):
+
+    def test_refuses_aggregating_select_list_unless_allowed(self):
+        mapping = build_mapping(expression='max(a.day)')
+        backfill = Backfill.from_config({'backfill': {'buckets': 2, 'column': 'day'}})
+        with self.assertRaises(AutoETLException):
+            backfill.partition_column(mapping)
+        allowed = Backfill.from_config({'backfill': {'buckets': 2, 'column': 'day', 'allow_aggregates': True}})
+        self.assertEqual(allowed.partition_column(mapping), ('a', 'day'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.etl_exceptions import AutoETLException  # noqa: E402
+from app.services.config_parser import (JoinStep, MetadataMapping, SelectColumn,  # noqa: E402
+                                       TargetColumn, TargetTable)
+from app.services.query_builder.ddl import (CREATE_INSERT_OUTPUT, CTAS_OUTPUT, TableDesign,  # noqa: E402
+                                            create_table, table_statements)
+
+COLUMNS = (TargetColumn('id', 'bigint', constraint='primary key'), TargetColumn('customer_id', 'integer'),
+           TargetColumn('created_at', 'timestamp'), TargetColumn('name', 'varchar(50)'),
+           TargetColumn('active', 'boolean'))
+
+
+def build_mapping(*select_columns: SelectColumn, columns=COLUMNS) -> MetadataMapping:
+    """method to build a mapping joining the customers and regions of the orders"""
+    select_columns = select_columns or tuple(SelectColumn(column.name, f'a.{column.name}') for column in columns)
+    return MetadataMapping(
+        's.orders', 'a',
+        (JoinStep('b', 'inner join', 's.customers', None, 'b.id = a.customer_id'),
+         JoinStep('c', 'left join', 's.regions', None, 'c.customer_id = a.customer_id AND c.id = b.region_id')),
+        (), select_columns, TargetTable('orders', 'dw', columns))
+
+
+class TableDesignTest(unittest.TestCase):
+
+    def test_infers_dist_key_sort_key_and_encodings(self):
+        design = TableDesign.from_config(build_mapping(), {}, CREATE_INSERT_OUTPUT)
+        self.assertEqual((design.dist_style, design.dist_key), ('key', 'customer_id'))
+        self.assertEqual(design.sort_keys, ('created_at',))
+        self.assertEqual(design.encodings, {'id': 'az64', 'customer_id': 'az64', 'created_at': 'raw',
+                                            'name': 'zstd', 'active': 'raw'})
+
+    def test_sheet_and_config_win_over_inference(self):
+        columns = (TargetColumn('id', 'bigint', sort_key='2'), TargetColumn('customer_id', 'integer', sort_key='1'),
+                   TargetColumn('created_at', 'timestamp', encoding='ZSTD', dist_key='Y'))
+        design = TableDesign.from_config(build_mapping(columns=columns), {'ddl': {'encodings': {'id': 'delta'}}},
+                                         CREATE_INSERT_OUTPUT)
+        self.assertEqual(design.dist_key, 'created_at')
+        self.assertEqual(design.sort_keys, ('customer_id', 'id'))
+        self.assertEqual(design.encodings, {'id': 'delta', 'customer_id': 'raw', 'created_at': 'zstd'})
+
+    def test_sorts_on_the_pipeline_watermark(self):
+        design = TableDesign.from_config(build_mapping(), {'pipeline': {'target_watermark_column': 'id'}},
+                                         CTAS_OUTPUT)
+        self.assertEqual(design.sort_keys, ('id',))
+
+    def test_create_insert_refuses_aliases_missing_from_the_target_table(self):
+        mapping = build_mapping(SelectColumn('id', 'a.id'), SelectColumn('customer', 'a.customer_id'),
+                                SelectColumn('created', 'a.created_at'))
+        with self.assertRaises(AutoETLException) as context:
+            TableDesign.from_config(mapping, {}, CREATE_INSERT_OUTPUT)
+        self.assertEqual(context.exception.args[1],
+                         ["column_alias 'customer' is not a column of the target_table sheet",
+                          "column_alias 'created' is not a column of the target_table sheet"])
+        # ctas creates the select aliases, the created_at sort key is not one of them
+        self.assertEqual(TableDesign.from_config(mapping, {'ddl': {'dist_style': 'even'}}, CTAS_OUTPUT).sort_keys,
+                         ('id',))
+
+
+class TableStatementsTest(unittest.TestCase):
+
+    def test_creates_the_table_before_inserting_the_select(self):
+        design = TableDesign.from_config(build_mapping(), {}, CREATE_INSERT_OUTPUT)
+        sql = ''.join(table_statements(['SELECT 1\n'], design, CREATE_INSERT_OUTPUT, True))
+        self.assertTrue(sql.startswith(create_table(design, True)))
+        self.assertIn('   created_at timestamp ENCODE raw,\n', sql)
+        self.assertIn('   id bigint ENCODE az64 PRIMARY KEY,\n', sql)
+        self.assertIn('DISTSTYLE KEY\nDISTKEY (customer_id)\nCOMPOUND SORTKEY (created_at);\n', sql)
+        self.assertTrue(sql.endswith('INSERT INTO dw.orders (id, customer_id, created_at, name, active)\n'
+                                     'SELECT 1\n;\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
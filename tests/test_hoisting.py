@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.services.config_parser import (Filter, JoinStep, MetadataMapping,  # noqa: E402
+                                       SelectColumn, TargetTable)
+from app.services.query_builder import get_dialect  # noqa: E402
+from app.services.query_builder.hoisting import hoist_expressions, hoist_subqueries  # noqa: E402
+
+REPEATED_SUBQUERY = 'select id, v from s.b where v > 1'
+
+
+def build_mapping(*select_columns: SelectColumn, subquery: str = REPEATED_SUBQUERY) -> MetadataMapping:
+    """method to build a mapping joining the same subquery twice"""
+    return MetadataMapping(
+        's.a', 'a',
+        (JoinStep('b', 'inner join', 's.b', None, 'b.id = a.b_id'),
+         JoinStep('c', 'left join', None, subquery, 'c.id = a.b_id'),
+         JoinStep('d', 'left join', None, subquery, 'd.id = a.c_id')),
+        (Filter('a.id > 0', 0),), select_columns, TargetTable('target', 's', ()))
+
+
+def run(mapping: MetadataMapping) -> list:
+    """method to run the postgres sql of a mapping over a small sqlite copy of the tables"""
+    connection = sqlite3.connect(':memory:')
+    connection.execute("ATTACH ':memory:' AS s")
+    connection.execute('CREATE TABLE s.a (id int, name text, b_id int, c_id int)')
+    connection.execute('CREATE TABLE s.b (id int, v int)')
+    connection.executemany('INSERT INTO s.a VALUES (?, ?, ?, ?)',
+                           [(1, 'ann', 1, 2), (2, 'bob', 2, 3), (3, None, 3, 1), (0, 'zed', 1, 1)])
+    connection.executemany('INSERT INTO s.b VALUES (?, ?)', [(1, 5), (2, 1), (3, None)])
+    sql = str(get_dialect('postgres')(mapping).get_query())
+    return sorted(connection.execute(sql).fetchall(), key=repr)
+
+
+class HoistingTest(unittest.TestCase):
+
+    def test_hoisted_output_matches_the_inline_output(self):
+        mapping = build_mapping(SelectColumn('n1', "upper(a.name) || 'x'"),
+                                SelectColumn('n2', 'upper(a.name)'),
+                                SelectColumn('n3', 'coalesce(upper(a.name), b.v)'),
+                                SelectColumn('v1', 'c.v'), SelectColumn('v2', 'd.v'))
+        hoisted = hoist_expressions(hoist_subqueries(mapping))
+        self.assertEqual([name for name, _ in hoisted.ctes], ['_subquery_1', '_cse_a'])
+        self.assertEqual(run(hoisted), run(mapping))
+
+    def test_never_hoists_volatile_expressions(self):
+        mapping = build_mapping(SelectColumn('r1', 'random() * a.id'), SelectColumn('r2', 'random() * a.id'))
+        self.assertIs(hoist_expressions(mapping), mapping)
+
+    def test_never_hoists_volatile_subqueries(self):
+        mapping = build_mapping(SelectColumn('v1', 'c.r'),
+                                subquery='select id, random() r from s.b')
+        self.assertIs(hoist_subqueries(mapping), mapping)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.services.config_parser import (Filter, JoinStep, MetadataMapping,  # noqa: E402
+                                       SelectColumn, TargetColumn, TargetTable)
+from app.services.query_builder import get_dialect  # noqa: E402
+from app.services.query_builder import incremental  # noqa: E402
+from app.services.query_builder.incremental import ClauseCache  # noqa: E402
+
+
+def build_mapping(num_columns: int = 3) -> MetadataMapping:
+    """method to build a mapping selecting `num_columns` columns over one left join"""
+    return MetadataMapping(
+        's.a', 'a', (JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'),), (Filter('a.id > 1', 0),),
+        tuple(SelectColumn(f'c{i}', f'a.c{i}', None, f'a.c{i}', 's.a', 'a') for i in range(num_columns)),
+        TargetTable('target', 's', tuple(TargetColumn(f'c{i}', 'int') for i in range(num_columns))))
+
+
+class ClauseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dialect = get_dialect('redshift')
+
+    def test_renders_lazily_and_reuses_unchanged_clauses(self):
+        cache, mapping = ClauseCache(), build_mapping()
+        fragments = cache.render(self.dialect(mapping))
+        self.assertFalse(isinstance(fragments, list))
+        first = list(fragments)
+        edited = list(cache.render(self.dialect(mapping._replace(filters=()))))
+        self.assertEqual(''.join(first), str(self.dialect(mapping).get_query()))
+        self.assertNotIn('WHERE', ''.join(edited))
+        self.assertEqual(list(cache.render(self.dialect(mapping))), first)
+
+    def test_keeps_only_a_digest_of_clauses_over_the_size_cap(self):
+        cache, mapping = ClauseCache(), build_mapping(50)
+        with mock.patch.object(incremental, 'MAX_CACHED_CLAUSE_SIZE', 100):
+            rendered = ''.join(cache.render(self.dialect(mapping)))
+            self.assertEqual(''.join(cache.render(self.dialect(mapping))), rendered)
+        digest, fragments = cache.clauses[(self.dialect, 'SELECT')]
+        self.assertIsInstance(digest, str)
+        self.assertIsNone(fragments)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+from typing import Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.services.config_parser import (Filter, JoinStep, MetadataMapping,  # noqa: E402
+                                       SelectColumn, TargetColumn, TargetTable)
+from app.services.query_builder.optimizer import prune_unused_joins, push_down_filters  # noqa: E402
+
+
+def build_mapping(*joins: JoinStep, select: SelectColumn = SelectColumn('id', 'a.id', None, 'a.id', 's.a', 'a'),
+                  filters: Tuple[Filter, ...] = ()) -> MetadataMapping:
+    """method to build a mapping selecting one column over the given joins"""
+    return MetadataMapping(
+        's.a', 'a', joins, filters, (select,),
+        TargetTable('target', 's', (TargetColumn(select.column_alias, 'int', None),)))
+
+
+def kept_aliases(mapping: MetadataMapping, unique_keys=None) -> list:
+    return [_step.reference_table_alias for _step in prune_unused_joins(mapping, unique_keys).joins]
+
+
+class PruneUnusedJoinsTest(unittest.TestCase):
+
+    def test_keeps_left_join_read_by_a_later_join(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'),
+                                JoinStep('c', 'inner join', 's.c', None, 'c.id = b.c_id'))
+        self.assertEqual(kept_aliases(mapping, {'s.b': ['id']}), ['b', 'c'])
+
+    def test_keeps_left_join_read_through_a_chain_of_kept_joins(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'),
+                                JoinStep('c', 'left join', 's.c', None, 'c.id = b.c_id'),
+                                JoinStep('d', 'inner join', 's.d', None, 'd.id = c.d_id'))
+        self.assertEqual(kept_aliases(mapping, {'s.b': ['id'], 's.c': ['id']}), ['b', 'c', 'd'])
+
+    def test_drops_unread_left_join_on_a_declared_unique_key(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'))
+        self.assertEqual(kept_aliases(mapping, {'s.b': ['id']}), [])
+        self.assertEqual(kept_aliases(mapping, {'s.b': [['id', 'region']]}), ['b'])
+
+    def test_keeps_unread_left_join_without_a_unique_key(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'))
+        self.assertEqual(kept_aliases(mapping), ['b'])
+
+    def test_drops_unread_left_join_on_a_grouped_subquery(self):
+        grouped = build_mapping(JoinStep('b', 'left join', None, 'select id, max(x) x from s.b group by id',
+                                         'b.id = a.b_id'))
+        self.assertEqual(kept_aliases(grouped), [])
+        ungrouped = build_mapping(JoinStep('b', 'left join', None, 'select id, x from s.b', 'b.id = a.b_id'))
+        self.assertEqual(kept_aliases(ungrouped), ['b'])
+
+    def test_keeps_left_join_an_unqualified_select_column_may_read(self):
+        unique_b = JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id')
+        bare = build_mapping(unique_b, select=SelectColumn('name', 'name', None, 'name', None, None))
+        self.assertEqual(kept_aliases(bare, {'s.b': ['id']}), ['b'])
+        attributed = build_mapping(unique_b, select=SelectColumn('name', 'upper(name)', 'upper', 'name', 's.a', 'a'))
+        self.assertEqual(kept_aliases(attributed, {'s.b': ['id']}), [])
+
+    def test_keeps_left_join_an_unqualified_filter_column_may_read(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'),
+                                filters=(Filter("status = 'open'", 0),))
+        self.assertEqual(kept_aliases(mapping, {'s.b': ['id']}), ['b'])
+
+
+class PushDownFiltersTest(unittest.TestCase):
+
+    def test_null_rejecting_filter_turns_left_join_into_filtered_inner_join(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'),
+                                filters=(Filter("b.status = 'open' AND a.id > 1", 0),))
+        pushed = push_down_filters(mapping)
+        self.assertEqual(pushed.joins, (JoinStep('b', 'inner join', 's.b', None,
+                                                 "b.id = a.b_id AND b.status = 'open'"),))
+        self.assertEqual(pushed.filters, (Filter('a.id > 1', 0),))
+
+    def test_is_null_filter_keeps_the_left_join(self):
+        for condition in ('b.id IS NULL', 'coalesce(b.status, 0) = 0', "b.status = 'x' OR b.id IS NULL"):
+            mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'),
+                                    filters=(Filter(condition, 0),))
+            self.assertIs(push_down_filters(mapping), mapping, condition)
+
+    def test_is_not_null_filter_rejects_nulls(self):
+        mapping = build_mapping(JoinStep('b', 'left join', 's.b', None, 'b.id = a.b_id'),
+                                filters=(Filter('b.code IS NOT NULL', 0),))
+        self.assertEqual(push_down_filters(mapping).joins[0].join_type, 'inner join')
+
+    def test_pushes_predicate_into_reference_subquery(self):
+        mapping = build_mapping(JoinStep('b', 'inner join', None, 'select * from s.b', 'b.id = a.b_id'),
+                                filters=(Filter('b.dept_id = 2', 0),))
+        pushed = push_down_filters(mapping)
+        self.assertEqual(pushed.joins[0].reference_subquery,
+                         'SELECT * FROM (select * from s.b) AS b WHERE b.dept_id = 2')
+        self.assertEqual(pushed.joins[0].join_condition, 'b.id = a.b_id')
+        self.assertEqual(pushed.filters, ())
+
+    def test_keeps_filters_of_a_mapping_with_an_outer_join(self):
+        mapping = build_mapping(JoinStep('b', 'inner join', 's.b', None, 'b.id = a.b_id'),
+                                JoinStep('c', 'full outer join', 's.c', None, 'c.id = a.c_id'),
+                                filters=(Filter('b.dept_id = 2', 0),))
+        self.assertIs(push_down_filters(mapping), mapping)
+
+
+if __name__ == '__main__':
+    unittest.main()
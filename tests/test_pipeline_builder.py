@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'src'))
+
+from app.etl_exceptions import AutoETLException  # noqa: E402
+from app.services.config_parser import MetadataMapping, SelectColumn, TargetColumn, TargetTable  # noqa: E402
+from app.services.pipeline_builder import PipelineBuilder  # noqa: E402
+from app.services.query_builder import get_dialect  # noqa: E402
+
+ORDER_COLUMNS = (TargetColumn('id', 'bigint', constraint='primary key'), TargetColumn('status', 'varchar(10)'),
+                 TargetColumn('updated_at', 'timestamp'))
+
+
+def build_mapping(*columns: TargetColumn) -> MetadataMapping:
+    """method to build a mapping loading the driving table columns of the target columns as is"""
+    return MetadataMapping(
+        's.orders', 'a', (), (), tuple(SelectColumn(column.name, f'a.{column.name}') for column in columns),
+        TargetTable('orders', 'dw', columns))
+
+
+class PipelineBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.builder = PipelineBuilder(os.path.join(TESTS_DIR, 'Auto_ETL_Metadata_Mapping_V1.xlsx'),
+                                       os.path.join(TESTS_DIR, 'sample_config.json'))
+
+    def render(self, mapping: MetadataMapping, pipeline: dict) -> str:
+        return ''.join(self.builder.render(get_dialect('redshift')(mapping), {'pipeline': pipeline}))
+
+    def test_merges_the_delta_into_the_target(self):
+        sql = self.render(build_mapping(*ORDER_COLUMNS), {'watermark_column': 'a.updated_at'})
+        self.assertIn("a.updated_at > (SELECT COALESCE(MAX(updated_at), '1900-01-01') FROM dw.orders)\n", sql)
+        self.assertTrue(sql.endswith(
+            ';\n\nMERGE INTO dw.orders\nUSING orders_delta\n ON dw.orders.id = orders_delta.id\n'
+            'WHEN MATCHED THEN UPDATE SET\n   status = orders_delta.status,\n'
+            '   updated_at = orders_delta.updated_at\n'
+            'WHEN NOT MATCHED THEN INSERT (id, status, updated_at)\n'
+            '   VALUES (orders_delta.id, orders_delta.status, orders_delta.updated_at);\n\n'
+            'DROP TABLE orders_delta;\n'))
+
+    def test_loads_a_target_of_key_columns_only_with_delete_insert(self):
+        mapping = build_mapping(TargetColumn('id', 'bigint', constraint='primary key'),
+                                TargetColumn('seq', 'integer', constraint='primary key'))
+        sql = self.render(mapping, {'watermark_column': 'a.seq'})
+        self.assertIn('-- incremental delete-insert load of dw.orders on a.seq\n', sql)
+        self.assertIn('a.seq > (SELECT COALESCE(MAX(seq), -9223372036854775808) FROM dw.orders)\n', sql)
+        self.assertNotIn('MERGE', sql)
+        self.assertTrue(sql.endswith(
+            ';\n\nBEGIN;\nDELETE FROM dw.orders\nUSING orders_delta\n'
+            'WHERE dw.orders.id = orders_delta.id AND dw.orders.seq = orders_delta.seq;\n'
+            'INSERT INTO dw.orders (id, seq)\nSELECT id, seq\nFROM orders_delta;\nCOMMIT;\n\n'
+            'DROP TABLE orders_delta;\n'))
+
+    def test_needs_a_low_watermark_for_an_unknown_watermark_type(self):
+        mapping = build_mapping(TargetColumn('id', 'bigint', constraint='primary key'),
+                                TargetColumn('version', 'varchar(20)'))
+        with self.assertRaises(AutoETLException):
+            self.render(mapping, {'watermark_column': 'a.version'})
+        sql = self.render(mapping, {'watermark_column': 'a.version', 'low_watermark': ''})
+        self.assertIn("COALESCE(MAX(version), '') FROM dw.orders", sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
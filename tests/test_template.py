@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.etl_exceptions import AutoETLException  # noqa: E402
+from app.services.query_template import QueryTemplate  # noqa: E402
+
+SQL = ("SELECT a.id, json_extract_path_text(a.doc, '{\"k\": 1}') AS doc\n"
+       "FROM analytics_dev.orders AS a\nWHERE a.day >= '${start:2024-01-01}' AND a.region = '${region}'\n")
+
+
+class QueryTemplateTest(unittest.TestCase):
+
+    def test_compiles_parameters_and_placeholders(self):
+        template = QueryTemplate.compile(SQL, {'schema': 'analytics_dev'}, {'region': 'eu'}, tool='query-builder')
+        self.assertEqual(template.names, ('schema', 'start', 'region'))
+        self.assertEqual(template.defaults, {'start': '2024-01-01', 'region': 'eu'})
+        self.assertEqual(template.source, {'tool': 'query-builder'})
+        self.assertIn('{"k": 1}', template.chunks[0])
+
+    def test_renders_braces_of_the_sql_as_is(self):
+        template = QueryTemplate.compile(SQL, {'schema': 'analytics_dev'})
+        self.assertEqual(template.render({'schema': 'analytics', 'region': 'us'}),
+                         SQL.replace('analytics_dev', 'analytics').replace('${start:2024-01-01}', '2024-01-01')
+                         .replace('${region}', 'us'))
+        with self.assertRaises(AutoETLException):
+            template.render({'schema': 'analytics'})
+
+    def test_saves_and_loads_the_template(self):
+        template = QueryTemplate.compile(SQL, {'schema': 'analytics_dev'}, metadata_file='orders.xlsx')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'orders.template.json')
+            template.save(path)
+            self.assertEqual(QueryTemplate.load(path), template)
+            with open(path, 'w') as fp:
+                json.dump({'version': 0, 'chunks': [''], 'names': []}, fp)
+            with self.assertRaises(AutoETLException):
+                QueryTemplate.load(path)
+
+    def test_templates_do_not_share_a_source(self):
+        first = QueryTemplate(('SELECT 1',), (), {}, 'SELECT 1')
+        self.assertIsNone(first.source)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'one.template.json')
+            first.save(path)
+            loaded = QueryTemplate.load(path)
+        loaded.source['tool'] = 'query-builder'
+        self.assertIsNone(QueryTemplate(('SELECT 2',), (), {}, 'SELECT 2').source)
+
+
+if __name__ == '__main__':
+    unittest.main()
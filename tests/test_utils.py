@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'src'))
+
+from app.services.config_parser import JoinsAndFilters  # noqa: E402
+from app.utils import SHEET_ROW_KEY, qualified_aliases  # noqa: E402
+
+
+class QualifiedAliasesTest(unittest.TestCase):
+
+    def test_skips_qualifiers_of_subqueries_and_function_calls(self):
+        condition = "a.id in (select id from schema.dept d where d.x = 'b.c') and schema.fn(b.col) > 1"
+        self.assertEqual(qualified_aliases(condition), {'a', 'b'})
+
+    def test_reads_qualifiers_after_a_subquery(self):
+        self.assertEqual(qualified_aliases('exists (select 1 from (select 1) s) or c.id = 1'), {'c'})
+
+
+class JoinStepRowTest(unittest.TestCase):
+
+    def test_keeps_the_sheet_row_of_each_step(self):
+        records = [{'driving_table': 's.a', 'driving_table_alias': 'a', SHEET_ROW_KEY: 2},
+                   {'reference_table_alias': 'b', SHEET_ROW_KEY: 5}]
+        self.assertEqual([_step.row for _step in JoinsAndFilters.from_records(records).joins], [2, 5])
+
+    def test_numbers_steps_without_sheet_rows_in_order(self):
+        records = [{'driving_table': 's.a'}, {'reference_table_alias': 'b'}]
+        self.assertEqual([_step.row for _step in JoinsAndFilters.from_records(records).joins], [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()